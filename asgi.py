@@ -1,16 +1,8 @@
 """
-ASGI config for paymentservices project.
+ASGI entry point kept for deployments that import it from the repository root.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
-
-For more information on this file, see
-https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+The application is defined in mmusda/asgi.py; this only re-exports it so the
+two cannot point at different settings.
 """
 
-import os
-
-from django.core.asgi import get_asgi_application
-
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'paymentservices.settings')
-
-application = get_asgi_application()
+from mmusda.asgi import application  # noqa: F401
@@ -0,0 +1,13 @@
+"""
+ASGI config for mmusda project.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mmusda.settings')
+# Tells settings not to keep database connections open between requests
+os.environ['DJANGO_ASGI'] = 'true'
+
+application = get_asgi_application()
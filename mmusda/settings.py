@@ -1,7 +1,9 @@
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Load environment variables from .env file
 load_dotenv()
@@ -36,6 +38,77 @@ MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET')
 MPESA_PASSKEY = os.getenv('MPESA_PASSKEY')
 MPESA_PAYBILL = os.getenv('MPESA_PAYBILL')
 MPESA_CALLBACK_URL = os.getenv('MPESA_CALLBACK_URL')
+MPESA_BASE_URL = os.getenv('MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke')
+
+# Refresh the shared OAuth token this many seconds before it expires
+MPESA_TOKEN_REFRESH_MARGIN = int(os.getenv('MPESA_TOKEN_REFRESH_MARGIN', '300'))
+# Cache alias used to share the token between worker processes (unset = per process)
+MPESA_TOKEN_CACHE_ALIAS = os.getenv('MPESA_TOKEN_CACHE_ALIAS') or None
+
+# Shared HTTP transport for Daraja calls
+MPESA_POOL_CONNECTIONS = int(os.getenv('MPESA_POOL_CONNECTIONS', '10'))
+MPESA_POOL_MAXSIZE = int(os.getenv('MPESA_POOL_MAXSIZE', '20'))
+MPESA_CONNECT_TIMEOUT = float(os.getenv('MPESA_CONNECT_TIMEOUT', '5'))
+MPESA_READ_TIMEOUT = float(os.getenv('MPESA_READ_TIMEOUT', '30'))
+MPESA_MAX_RETRIES = int(os.getenv('MPESA_MAX_RETRIES', '3'))
+MPESA_RETRY_BACKOFF = float(os.getenv('MPESA_RETRY_BACKOFF', '0.5'))
+# Connection limits for the asyncio client used by the async views
+MPESA_ASYNC_MAX_CONNECTIONS = int(os.getenv('MPESA_ASYNC_MAX_CONNECTIONS', '500'))
+MPESA_ASYNC_MAX_KEEPALIVE = int(os.getenv('MPESA_ASYNC_MAX_KEEPALIVE', '100'))
+
+# Queue STK pushes for the run_stk_workers command instead of calling Daraja in the request
+MPESA_ASYNC_INITIATION = os.getenv('MPESA_ASYNC_INITIATION', 'False').lower() == 'true'
+STK_WORKERS = int(os.getenv('STK_WORKERS', '2'))
+
+# Defaults for run_campaign: pushes in flight and pushes per second across them
+CAMPAIGN_CONCURRENCY = int(os.getenv('CAMPAIGN_CONCURRENCY', '4'))
+CAMPAIGN_RATE_LIMIT = float(os.getenv('CAMPAIGN_RATE_LIMIT', '5'))
+
+# Client-side protection for Daraja: STK pushes per second (0 disables the
+# limit) and a circuit breaker that fails fast after repeated upstream errors.
+# Set MPESA_RESILIENCE_CACHE_ALIAS to a shared cache to apply them across workers.
+MPESA_RATE_LIMIT = float(os.getenv('MPESA_RATE_LIMIT', '0'))
+MPESA_RATE_LIMIT_BURST = int(os.getenv('MPESA_RATE_LIMIT_BURST', '0')) or None
+MPESA_RATE_LIMIT_MAX_WAIT = float(os.getenv('MPESA_RATE_LIMIT_MAX_WAIT', '2'))
+MPESA_BREAKER_FAILURE_THRESHOLD = int(os.getenv('MPESA_BREAKER_FAILURE_THRESHOLD', '5'))
+MPESA_BREAKER_RESET_TIMEOUT = int(os.getenv('MPESA_BREAKER_RESET_TIMEOUT', '30'))
+MPESA_RESILIENCE_CACHE_ALIAS = os.getenv('MPESA_RESILIENCE_CACHE_ALIAS') or None
+
+# Page sizes for the keyset-paginated payment lists
+PAYMENT_HISTORY_PAGE_SIZE = int(os.getenv('PAYMENT_HISTORY_PAGE_SIZE', '25'))
+PAYMENTS_API_PAGE_SIZE = int(os.getenv('PAYMENTS_API_PAGE_SIZE', '50'))
+
+# Per-member dashboard cache: payments shown, seconds an entry lives and the
+# cache alias (use a shared cache with several workers so invalidation reaches all)
+DASHBOARD_RECENT_PAYMENTS = int(os.getenv('DASHBOARD_RECENT_PAYMENTS', '5'))
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', '300'))
+DASHBOARD_CACHE_ALIAS = os.getenv('DASHBOARD_CACHE_ALIAS', 'default')
+
+# Family, cohort and payment category lists: seconds each worker trusts its
+# own copy before checking the shared version, and how long cached rows live
+LOOKUP_CACHE_LOCAL_TTL = float(os.getenv('LOOKUP_CACHE_LOCAL_TTL', '5'))
+LOOKUP_CACHE_TIMEOUT = int(os.getenv('LOOKUP_CACHE_TIMEOUT', '3600'))
+LOOKUP_CACHE_ALIAS = os.getenv('LOOKUP_CACHE_ALIAS', 'default')
+
+# Payment result push (/payments/events/): "postgres" uses LISTEN/NOTIFY to
+# reach every web worker from process_callbacks and is the default on
+# PostgreSQL; "local" only reaches the publishing process, so live updates are
+# off with it. Streams send a keepalive every HEARTBEAT seconds and end after MAX_AGE.
+PAYMENT_EVENTS_BACKEND = os.getenv('PAYMENT_EVENTS_BACKEND') or None
+PAYMENT_EVENTS_HEARTBEAT = float(os.getenv('PAYMENT_EVENTS_HEARTBEAT', '15'))
+PAYMENT_EVENTS_MAX_AGE = float(os.getenv('PAYMENT_EVENTS_MAX_AGE', '300'))
+
+# LISTEN needs a session of its own, so with PgBouncer in transaction mode
+# point the payment event listener straight at PostgreSQL
+PAYMENT_EVENTS_LISTEN_URL = os.getenv('PAYMENT_EVENTS_LISTEN_URL') or None
+
+# Admin changelists over tables PostgreSQL estimates at this many rows or more
+# show the estimate instead of running an exact COUNT(*) when unfiltered
+ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ESTIMATED_COUNT_THRESHOLD', '10000'))
+
+# Once payments are partitioned by month (partition_payments), newest-first
+# lists read the last PAYMENTS_HOT_MONTHS months before older partitions; 0 is off
+PAYMENTS_HOT_MONTHS = int(os.getenv('PAYMENTS_HOT_MONTHS', '0'))
 
 # For development, you can use these Safaricom sandbox credentials
 """if DEBUG:
@@ -46,6 +119,10 @@ MPESA_CALLBACK_URL = os.getenv('MPESA_CALLBACK_URL')
     MPESA_CALLBACK_URL = 'https://webhook.site/YOUR-UNIQUE-ID'  # Replace with your webhook.site URL"""
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'payments.middleware.RequestMetricsMiddleware',
+    # Outside the session middleware, so saving a session counts as a write
+    'payments.middleware.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -75,6 +152,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'mmusda.wsgi.application'
+ASGI_APPLICATION = 'mmusda.asgi.application'
 
 """DATABASES = {
     'default': {
@@ -88,6 +166,65 @@ DATABASES = {
     'default':dj_database_url.parse(DATABASE_URL)
 
 }
+
+# Optional read replicas as comma-separated database URLs. Payment history,
+# exports, reports and API lists read from one whose lag behind the primary is
+# at most REPLICA_MAX_LAG seconds (checked every REPLICA_HEALTH_CHECK_INTERVAL
+# seconds), falling back to the primary; a client that wrote reads from the
+# primary for the next REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+for number, url in enumerate([url for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()], 1):
+    DATABASES[f'replica{number}'] = {**dj_database_url.parse(url.strip()), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+# Connections to DATABASE_URL and the replicas. Each is kept open for
+# DATABASE_CONN_MAX_AGE seconds across requests (0 closes it after every
+# request) and checked before reuse while DATABASE_CONN_HEALTH_CHECKS is on.
+# That only helps WSGI workers and the worker commands, whose threads live on.
+# Under ASGI (mmusda/asgi.py sets DJANGO_ASGI) sync code runs on executor
+# threads that come and go, so a kept connection is never reused or closed and
+# they are always closed after the request; use DATABASE_POOL there instead.
+# DATABASE_POOL=true uses psycopg 3's pool instead (pip install "psycopg[binary,pool]"):
+# DATABASE_POOL_MIN_SIZE to DATABASE_POOL_MAX_SIZE connections per worker
+# process, a request waiting up to DATABASE_POOL_TIMEOUT seconds for one.
+# DATABASE_PGBOUNCER=true when connecting through PgBouncer in transaction mode.
+DATABASE_ASGI = os.getenv('DJANGO_ASGI', 'false').lower() == 'true'
+DATABASE_CONN_MAX_AGE = 0 if DATABASE_ASGI else int(os.getenv('DATABASE_CONN_MAX_AGE', '60'))
+DATABASE_CONN_HEALTH_CHECKS = os.getenv('DATABASE_CONN_HEALTH_CHECKS', 'true').lower() == 'true'
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'false').lower() == 'true'
+DATABASE_POOL_MIN_SIZE = int(os.getenv('DATABASE_POOL_MIN_SIZE', '2'))
+DATABASE_POOL_MAX_SIZE = int(os.getenv('DATABASE_POOL_MAX_SIZE', '10'))
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', '10'))
+DATABASE_PGBOUNCER = os.getenv('DATABASE_PGBOUNCER', 'false').lower() == 'true'
+for database in DATABASES.values():
+    database['CONN_HEALTH_CHECKS'] = DATABASE_CONN_HEALTH_CHECKS
+    database['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE
+    if database['ENGINE'] == 'django.db.backends.postgresql':
+        if DATABASE_POOL:
+            # requirements.txt installs psycopg2, which has no pool; fail here rather than on first use
+            if not (find_spec('psycopg') and find_spec('psycopg_pool')):
+                raise ImproperlyConfigured(
+                    'DATABASE_POOL=true needs psycopg 3 and its pool: pip install "psycopg[binary,pool]"'
+                )
+            # The pool keeps the connections; Django must hand them back after each request
+            database['CONN_MAX_AGE'] = 0
+            database.setdefault('OPTIONS', {})['pool'] = {
+                'min_size': DATABASE_POOL_MIN_SIZE,
+                'max_size': DATABASE_POOL_MAX_SIZE,
+                'timeout': DATABASE_POOL_TIMEOUT,
+            }
+        if DATABASE_PGBOUNCER:
+            # Named cursors do not survive the end of a transaction, and a
+            # pooled server connection may not be the one the cursor was opened on.
+            # iterator() then fetches whole results, so large reads such as the
+            # payment export go in keyset batches instead.
+            database['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+DATABASE_ROUTERS = ['payments.routers.ReplicaRouter']
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '5'))
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv('REPLICA_HEALTH_CHECK_INTERVAL', '5'))
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '10'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -112,6 +249,9 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Covering index columns only apply on PostgreSQL; SQLite development databases ignore them
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 
 # Authentication settings
@@ -124,3 +264,24 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+# Logging: LOG_LEVEL for everything else, MPESA_LOG_LEVEL=DEBUG adds redacted Daraja
+# request/response lines, REQUEST_LOG_LEVEL=INFO emits one JSON line per request
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'root': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'WARNING')},
+    'loggers': {
+        'payments.mpesa': {'level': os.getenv('MPESA_LOG_LEVEL', 'INFO')},
+        'payments.requests': {'level': os.getenv('REQUEST_LOG_LEVEL', 'WARNING')},
+    },
+}
+
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
@@ -2,8 +2,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from payments.views import (
-    dashboard, payment_history, initiate_payment, home, register,
-    profile_update, add_family, family_list, add_cohort, cohort_list
+    dashboard, payment_history, initiate_payment, async_initiate_payment, home, register,
+    profile_update, add_family, family_list, add_cohort, cohort_list, metrics, payment_events
 )
 
 urlpatterns = [
@@ -11,6 +11,8 @@ urlpatterns = [
     path('dashboard/', dashboard, name='dashboard'),
     path('payment-history/', payment_history, name='payment_history'),
     path('initiate-payment/', initiate_payment, name='initiate_payment'),
+    path('initiate-payment/async/', async_initiate_payment, name='async_initiate_payment'),
+    path('payments/events/', payment_events, name='payment_events'),
     path('profile/update/', profile_update, name='profile_update'),
     
     # Family management
@@ -23,6 +25,7 @@ urlpatterns = [
     
     path('admin/', admin.site.urls),
     path('api/', include('payments.urls')),
+    path('metrics', metrics, name='metrics'),
     
     # Authentication URLs
     path('login/', auth_views.LoginView.as_view(
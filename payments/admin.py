@@ -1,5 +1,46 @@
-from django.contrib import admin
-from .models import Family, Cohort, Member, PaymentCategory, Payment
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from .callbacks import apply_status_results, expire_payments
+from .models import (
+    Family, Cohort, Member, PaymentCategory, Payment, StkPushJob, CallbackInbox,
+    Campaign, CampaignRecipient, ReconciliationRun, ReconciliationItem
+)
+from .mpesa import MpesaClient
+from .pagination import EstimatedCountPaginator
+from .phone import clean_member_phone, to_msisdn
+from .resilience import DarajaUnavailable
+
+# Most status queries one admin action makes, so a request stays short
+REQUERY_LIMIT = 50
+
+
+class IndexedSearchMixin:
+    """
+    Search that only runs lookups an index can answer.
+
+    The default admin search is an icontains over every field, which scans
+    the whole table. Here a term matches a field exactly, or as a prefix when
+    it ends in ``*``; ``upper_search_fields`` are compared in upper case, as
+    M-Pesa issues them.
+    """
+    upper_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if not term:
+            return queryset, False
+        condition = Q()
+        for field in self.search_fields:
+            value = term.upper() if field in self.upper_search_fields else term
+            condition |= Q(**{f'{field}__startswith' if prefix else field: value})
+        return queryset.filter(condition), False
+
 
 @admin.register(Family)
 class FamilyAdmin(admin.ModelAdmin):
@@ -12,11 +53,36 @@ class CohortAdmin(admin.ModelAdmin):
     search_fields = ('name', 'year')
     ordering = ('-year',)
 
+class MemberAdminForm(forms.ModelForm):
+    class Meta:
+        model = Member
+        fields = '__all__'
+
+    def clean_phone_number(self):
+        phone_number = self.cleaned_data['phone_number']
+        # Unchanged numbers pass, so members sharing one from before msisdn existed stay editable
+        if 'phone_number' not in self.changed_data:
+            return phone_number
+        return clean_member_phone(phone_number, member=self.instance)
+
 @admin.register(Member)
-class MemberAdmin(admin.ModelAdmin):
+class MemberAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    form = MemberAdminForm
     list_display = ('user', 'family', 'cohort', 'phone_number', 'is_amo', 'is_alo')
     list_filter = ('family', 'cohort', 'is_amo', 'is_alo')
-    search_fields = ('user__username', 'user__first_name', 'user__last_name', 'phone_number')
+    list_select_related = ('user', 'family', 'cohort')
+    search_fields = ('user__username', 'msisdn')
+    search_help_text = 'Exact username or phone number in any format; end with * to match a prefix, e.g. 254712*'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        msisdn = to_msisdn(search_term.strip())
+        if msisdn is not None and not search_term.strip().endswith('*'):
+            # 0712..., +254 712... and 712... all find the member stored as 254712...
+            results |= queryset.filter(msisdn=msisdn)
+        return results, may_have_duplicates
 
 @admin.register(PaymentCategory)
 class PaymentCategoryAdmin(admin.ModelAdmin):
@@ -24,8 +90,115 @@ class PaymentCategoryAdmin(admin.ModelAdmin):
     search_fields = ('name',)
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('member', 'payment_type', 'amount', 'payment_date', 'status', 'mpesa_receipt_number')
-    list_filter = ('payment_type', 'status', 'payment_date')
-    search_fields = ('member__user__username', 'transaction_id', 'mpesa_receipt_number')
-    ordering = ('-payment_date',) 
\ No newline at end of file
+    list_filter = ('payment_type', 'status')
+    list_select_related = ('member__user', 'member__family')
+    search_fields = ('mpesa_receipt_number', 'transaction_id', 'checkout_request_id')
+    upper_search_fields = ('mpesa_receipt_number',)
+    search_help_text = 'Exact M-Pesa receipt, transaction or CheckoutRequestID; end with * to match a prefix'
+    date_hierarchy = 'payment_date'
+    # Matches payment_date_id_idx, so pages are read off the index in order
+    ordering = ('-payment_date', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('member',)
+    actions = ('requery_status', 'mark_expired')
+
+    @admin.action(description='Re-query M-Pesa status of selected pending payments')
+    def requery_status(self, request, queryset):
+        checkout_request_ids = list(
+            queryset.filter(status__in=['PENDING', 'EXPIRED'], checkout_request_id__isnull=False)
+            .values_list('checkout_request_id', flat=True)[:REQUERY_LIMIT + 1]
+        )
+        if not checkout_request_ids:
+            self.message_user(request, 'None of the selected payments is awaiting an STK push result.',
+                              messages.WARNING)
+            return
+        if len(checkout_request_ids) > REQUERY_LIMIT:
+            self.message_user(request, f'Only the first {REQUERY_LIMIT} payments were queried.', messages.WARNING)
+            checkout_request_ids = checkout_request_ids[:REQUERY_LIMIT]
+
+        try:
+            client = MpesaClient()
+        except (DarajaUnavailable, ImproperlyConfigured) as e:
+            self.message_user(request, f'Could not reach M-Pesa: {e}', messages.ERROR)
+            return
+
+        results = {}
+        pending = errors = 0
+        for checkout_request_id in checkout_request_ids:
+            try:
+                result_code = client.query_stk_status(checkout_request_id)
+            except DarajaUnavailable as e:
+                # Leave the rest for later instead of adding to the load
+                self.message_user(request, f'Stopped querying, M-Pesa is unavailable: {e}', messages.ERROR)
+                break
+            except Exception:
+                errors += 1
+                continue
+            if result_code is None:
+                pending += 1
+            else:
+                results[checkout_request_id] = result_code
+
+        completed, failed = apply_status_results(results) if results else (0, 0)
+        self.message_user(
+            request,
+            f'{completed} completed, {failed} failed, {pending} still waiting for the customer, '
+            f'{errors} could not be queried.',
+            messages.ERROR if errors and not results else messages.SUCCESS,
+        )
+
+    @admin.action(description='Mark selected pending payments as expired')
+    def mark_expired(self, request, queryset):
+        expired = expire_payments(queryset)
+        self.message_user(request, f'{expired} payments marked as expired.', messages.SUCCESS)
+
+@admin.register(StkPushJob)
+class StkPushJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'payment', 'phone_number', 'status', 'attempts', 'available_at', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('phone_number', 'payment__transaction_id')
+    raw_id_fields = ('payment',)
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'checkout_request_id', 'status', 'received_at', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('checkout_request_id',)
+    readonly_fields = ('payload', 'received_at', 'processed_at')
+
+@admin.register(Campaign)
+class CampaignAdmin(admin.ModelAdmin):
+    list_display = ('name', 'payment_type', 'mission_payment_type', 'amount', 'family', 'cohort', 'status', 'created_at')
+    list_filter = ('status', 'payment_type', 'mission_payment_type')
+    search_fields = ('name',)
+    readonly_fields = ('status', 'created_by', 'started_at', 'finished_at')
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+
+@admin.register(CampaignRecipient)
+class CampaignRecipientAdmin(admin.ModelAdmin):
+    list_display = ('campaign', 'member', 'status', 'payment', 'updated_at')
+    list_filter = ('status', 'campaign')
+    search_fields = ('member__user__username', 'member__msisdn')
+    raw_id_fields = ('member', 'payment')
+
+@admin.register(ReconciliationRun)
+class ReconciliationRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'source', 'started_at', 'rows_read', 'matched', 'missing_callbacks',
+                    'orphan_receipts', 'amount_mismatches', 'ambiguous_matches')
+    readonly_fields = ('source', 'started_at', 'finished_at', 'rows_read', 'matched', 'missing_callbacks',
+                       'orphan_receipts', 'amount_mismatches', 'ambiguous_matches')
+
+@admin.register(ReconciliationItem)
+class ReconciliationItemAdmin(admin.ModelAdmin):
+    list_display = ('receipt_number', 'kind', 'statement_amount', 'payment_amount', 'transaction_time',
+                    'other_party', 'payment', 'resolved')
+    list_filter = ('kind', 'resolved', 'run')
+    search_fields = ('receipt_number', 'other_party')
+    raw_id_fields = ('payment',)
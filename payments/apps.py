@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class PaymentsConfig(AppConfig):
+    name = 'payments'
+
+    def ready(self):
+        from .metrics import install_query_recorder
+        # Lets RequestMetricsMiddleware count queries on whichever thread runs them
+        connection_created.connect(install_query_recorder, dispatch_uid='payments_query_recorder')
+        # Cache invalidation receivers
+        from . import signals  # noqa: F401
@@ -0,0 +1,401 @@
+import logging
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .dashboard import invalidate_dashboards
+from .events import publish_payment_events
+from .models import CallbackInbox, CampaignRecipient, Member, Payment, StkPushJob
+from .phone import to_msisdn
+from .rollups import record_completed_payments
+
+logger = logging.getLogger(__name__)
+
+# The STK callback does not carry the AccountReference, so payments that
+# arrive without a matching pending row are filed under this type
+UNMATCHED_PAYMENT_TYPE = 'CONTRIBUTION'
+
+ACKNOWLEDGEMENT = {'ResultCode': 0, 'ResultDesc': 'Accepted'}
+
+# Puts a FAILED inbox entry back in the queue
+RETRY = {'status': 'RECEIVED', 'error': '', 'processed_at': None}
+
+
+def callback_key(payload):
+    """Return the id Safaricom repeats on every delivery of the same callback"""
+    if not isinstance(payload, dict):
+        return None
+    callback = (payload.get('Body') or {}).get('stkCallback')
+    if isinstance(callback, dict):
+        return callback.get('CheckoutRequestID')
+    # Older flat payloads identified the transaction directly
+    return payload.get('CheckoutRequestID') or payload.get('TransactionID')
+
+
+def _inbox_entry(payload):
+    return CallbackInbox(checkout_request_id=callback_key(payload), payload=payload)
+
+
+def _failed_entry(payload):
+    """The FAILED inbox entry a redelivery of ``payload`` should put back in the queue"""
+    return CallbackInbox.objects.filter(checkout_request_id=callback_key(payload), status='FAILED')
+
+
+def record_callback(payload):
+    """Append a callback to the inbox; repeated deliveries are ignored unless the first one failed"""
+    entry = _inbox_entry(payload)
+    CallbackInbox.objects.bulk_create([entry], ignore_conflicts=True)
+    if entry.checkout_request_id:
+        _failed_entry(payload).update(payload=payload, **RETRY)
+
+
+async def arecord_callback(payload):
+    entry = _inbox_entry(payload)
+    await CallbackInbox.objects.abulk_create([entry], ignore_conflicts=True)
+    if entry.checkout_request_id:
+        await _failed_entry(payload).aupdate(payload=payload, **RETRY)
+
+
+def retry_failed_callbacks():
+    """Queue every FAILED inbox entry to be processed again, returning how many"""
+    return CallbackInbox.objects.filter(status='FAILED').update(**RETRY)
+
+
+def _parse_amount(value):
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value}")
+
+
+def _parse_transaction_date(value):
+    if not value:
+        return None
+    try:
+        naive = datetime.strptime(str(value), '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+    # Daraja timestamps are East Africa Time (UTC+3)
+    return naive.replace(tzinfo=timezone.get_fixed_timezone(180))
+
+
+def parse_stk_callback(payload):
+    """
+    Flatten an STK callback into a dict.
+
+    Handles the nested ``Body.stkCallback`` structure Daraja sends, where
+    the payment details are a list of ``{"Name": ..., "Value": ...}`` items
+    under ``CallbackMetadata.Item``, and the older flat format.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Callback payload is not an object")
+
+    callback = (payload.get('Body') or {}).get('stkCallback')
+    if isinstance(callback, dict):
+        items = {
+            item.get('Name'): item.get('Value')
+            for item in (callback.get('CallbackMetadata') or {}).get('Item', [])
+            if isinstance(item, dict)
+        }
+        data = {
+            'merchant_request_id': callback.get('MerchantRequestID'),
+            'checkout_request_id': callback.get('CheckoutRequestID'),
+            'result_code': callback.get('ResultCode'),
+            'result_desc': callback.get('ResultDesc', ''),
+            'amount': items.get('Amount'),
+            'receipt_number': items.get('MpesaReceiptNumber'),
+            'transaction_date': items.get('TransactionDate'),
+            'phone_number': items.get('PhoneNumber'),
+        }
+    else:
+        data = {
+            'merchant_request_id': payload.get('MerchantRequestID'),
+            'checkout_request_id': callback_key(payload),
+            'result_code': payload.get('ResultCode'),
+            'result_desc': payload.get('ResultDesc', ''),
+            'amount': payload.get('Amount'),
+            'receipt_number': payload.get('MpesaReceiptNumber'),
+            'transaction_date': payload.get('TransactionDate'),
+            'phone_number': payload.get('PhoneNumber'),
+        }
+
+    if not data['checkout_request_id']:
+        raise ValueError("Callback has no CheckoutRequestID")
+    try:
+        data['result_code'] = int(data['result_code'])
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid ResultCode: {data['result_code']}")
+    data['amount'] = _parse_amount(data['amount'])
+    data['transaction_date'] = _parse_transaction_date(data['transaction_date'])
+    data['phone_number'] = str(data['phone_number']) if data['phone_number'] else None
+    data['receipt_number'] = data['receipt_number'] or ''
+    return data
+
+
+def _members_by_phone(phone_numbers):
+    """Members by the callback phone numbers they are registered with, in one msisdn lookup"""
+    msisdns = {}
+    for phone_number in phone_numbers:
+        msisdn = to_msisdn(phone_number)
+        if msisdn is not None:
+            msisdns[msisdn] = phone_number
+    return {
+        msisdns[member.msisdn]: member
+        for member in Member.objects.filter(msisdn__in=list(msisdns)).only('id', 'msisdn', 'family_id', 'cohort_id')
+    }
+
+
+def _uncertain_pushes(member_ids):
+    """
+    Unsettled payments of queued or campaign pushes whose Daraja answer was lost, by (member, amount).
+
+    Their CheckoutRequestID was never seen, so the callback is the first
+    time the app hears it; it is matched on the member and amount instead.
+    """
+    index = {}
+    payments = Payment.objects.filter(
+        Q(stk_job__status='UNCERTAIN') | Q(campaign_recipient__status='UNCERTAIN'),
+        member_id__in=list(member_ids), status__in=['PENDING', 'EXPIRED'],
+        checkout_request_id__isnull=True,
+    ).order_by('payment_date').values('id', 'member_id', 'amount')
+    for payment in payments:
+        index.setdefault((payment['member_id'], payment['amount']), []).append(payment['id'])
+    return index
+
+
+def process_inbox(batch_size=500):
+    """
+    Apply one batch of received callbacks to payments.
+
+    Every STK push made by the app leaves a PENDING payment carrying its
+    CheckoutRequestID, so each callback settles with a single update on
+    that unique index and a delivery that was already applied changes
+    nothing. Returns the number of inbox entries handled.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            CallbackInbox.objects.select_for_update(skip_locked=True)
+            .filter(status='RECEIVED')
+            .order_by('id')[:batch_size]
+        )
+        if not entries:
+            return 0
+
+        callbacks = {}
+        entries_by_key = {}
+        for entry in entries:
+            entry.processed_at = now
+            try:
+                data = parse_stk_callback(entry.payload)
+            except ValueError as e:
+                entry.status = 'FAILED'
+                entry.error = str(e)
+                continue
+            entry.status = 'PROCESSED'
+            callbacks.setdefault(data['checkout_request_id'], data)
+            entries_by_key.setdefault(data['checkout_request_id'], []).append(entry)
+
+        member_ids = dict(
+            Payment.objects.filter(checkout_request_id__in=list(callbacks))
+            .values_list('checkout_request_id', 'member_id')
+        )
+        settled = set()
+        completed = []
+        events = []
+        for checkout_request_id, data in callbacks.items():
+            if checkout_request_id not in member_ids:
+                continue
+            if data['result_code'] == 0:
+                # A late success still counts if the sweep already expired the row
+                payments = Payment.objects.filter(
+                    checkout_request_id=checkout_request_id, status__in=['PENDING', 'EXPIRED']
+                )
+                changes = {'status': 'COMPLETED', 'mpesa_receipt_number': data['receipt_number']}
+            else:
+                payments = Payment.objects.filter(checkout_request_id=checkout_request_id, status='PENDING')
+                changes = {'status': 'FAILED'}
+            # One indexed update per callback; rows settled by an earlier
+            # delivery no longer match and are left alone
+            updated = payments.update(**changes)
+            if not updated and data['result_code'] == 0 and data['receipt_number']:
+                # Completed through a status query, which carries no receipt
+                Payment.objects.filter(
+                    checkout_request_id=checkout_request_id, status='COMPLETED', mpesa_receipt_number=''
+                ).update(mpesa_receipt_number=data['receipt_number'])
+            if updated:
+                settled.add(checkout_request_id)
+                events.append({
+                    'member_id': member_ids[checkout_request_id],
+                    'checkout_request_id': checkout_request_id,
+                    'status': changes['status'],
+                    'receipt_number': data['receipt_number'],
+                })
+                if data['result_code'] == 0:
+                    completed.append(checkout_request_id)
+
+        for checkout_request_id, data in callbacks.items():
+            if checkout_request_id in member_ids or data['result_code'] == 0:
+                continue
+            # Nothing was paid, but the attempt is kept for reconciliation
+            logger.warning(
+                "No payment for failed STK callback %s (ResultCode %s: %s)",
+                checkout_request_id, data['result_code'], data['result_desc'],
+            )
+            for entry in entries_by_key[checkout_request_id]:
+                entry.status = 'UNMATCHED'
+                entry.error = f"No payment for failed callback: {data['result_desc']}"
+
+        # Pushes made outside this app have no pending row, fall back to the phone number
+        unmatched = [
+            data for key, data in callbacks.items()
+            if key not in member_ids and data['result_code'] == 0
+        ]
+        members = _members_by_phone({data['phone_number'] for data in unmatched if data['phone_number']})
+        uncertain = _uncertain_pushes(member.id for member in members.values()) if members else {}
+        to_create = []
+        for data in unmatched:
+            member = members.get(data['phone_number'])
+            if member is None or data['amount'] is None:
+                for entry in entries_by_key[data['checkout_request_id']]:
+                    entry.status = 'FAILED'
+                    entry.error = f"No member found for phone number {data['phone_number']}"
+                continue
+            claimable = uncertain.get((member.id, data['amount']))
+            if claimable:
+                payment_id = claimable.pop(0)
+                Payment.objects.filter(id=payment_id).update(
+                    status='COMPLETED',
+                    transaction_id=data['checkout_request_id'],
+                    checkout_request_id=data['checkout_request_id'],
+                    merchant_request_id=data['merchant_request_id'],
+                    mpesa_receipt_number=data['receipt_number'],
+                )
+                StkPushJob.objects.filter(payment_id=payment_id).update(status='SUCCEEDED', error='')
+                CampaignRecipient.objects.filter(payment_id=payment_id).update(status='SENT', error='')
+                completed.append(data['checkout_request_id'])
+                events.append({
+                    'member_id': member.id,
+                    'checkout_request_id': data['checkout_request_id'],
+                    'status': 'COMPLETED',
+                    'receipt_number': data['receipt_number'],
+                })
+                continue
+            to_create.append(Payment(
+                member=member,
+                payment_type=UNMATCHED_PAYMENT_TYPE,
+                amount=data['amount'],
+                transaction_id=data['checkout_request_id'],
+                checkout_request_id=data['checkout_request_id'],
+                merchant_request_id=data['merchant_request_id'],
+                status='COMPLETED',
+                mpesa_receipt_number=data['receipt_number'],
+            ))
+        created = []
+        for payment in to_create:
+            # A savepoint per row rather than bulk_create(ignore_conflicts=True),
+            # which cannot say which rows it skipped
+            try:
+                with transaction.atomic():
+                    payment.save(force_insert=True)
+            except IntegrityError:
+                continue
+            # Payment.save() has added it to the rollups
+            created.append(payment)
+        events.extend({
+            'member_id': payment.member_id,
+            'checkout_request_id': payment.checkout_request_id,
+            'status': payment.status,
+            'receipt_number': payment.mpesa_receipt_number,
+        } for payment in created)
+        invalidate_dashboards(event['member_id'] for event in events)
+        publish_payment_events(events)
+
+        if completed:
+            record_completed_payments(
+                Payment.objects.filter(checkout_request_id__in=completed, status='COMPLETED')
+                .select_related('member')
+                .only('amount', 'payment_date', 'payment_type', 'mission_payment_type',
+                      'member', 'member__family', 'member__cohort')
+            )
+
+        CallbackInbox.objects.bulk_update(entries, ['status', 'error', 'processed_at'])
+    return len(entries)
+
+
+def _settled(rows, status):
+    """Invalidate dashboards and notify clients for payments just moved to ``status``"""
+    invalidate_dashboards(row['member_id'] for row in rows)
+    publish_payment_events({**row, 'status': status} for row in rows)
+
+
+def expire_payments(payments):
+    """Mark the PENDING payments among ``payments`` EXPIRED with one update, returning how many"""
+    with transaction.atomic():
+        rows = list(
+            payments.select_related(None).select_for_update().filter(status='PENDING')
+            .values('id', 'member_id', 'checkout_request_id')
+        )
+        if not rows:
+            return 0
+        expired = Payment.objects.filter(id__in=[row['id'] for row in rows]).update(status='EXPIRED')
+        _settled(rows, 'EXPIRED')
+    return expired
+
+
+def apply_status_results(results):
+    """
+    Settle payments from STK status query results.
+
+    ``results`` maps CheckoutRequestID to ResultCode. Successful pushes that
+    are still PENDING or EXPIRED become COMPLETED and failed PENDING ones
+    FAILED, each with one update; the receipt follows with the callback or a
+    statement reconciliation. Returns (completed, failed).
+    """
+    with transaction.atomic():
+        rows = list(
+            Payment.objects.select_for_update()
+            .filter(checkout_request_id__in=list(results), status__in=['PENDING', 'EXPIRED'])
+            .values('id', 'member_id', 'checkout_request_id', 'status')
+        )
+        completed = [row for row in rows if results[row['checkout_request_id']] == 0]
+        failed = [
+            row for row in rows
+            if results[row['checkout_request_id']] != 0 and row['status'] == 'PENDING'
+        ]
+        if completed:
+            Payment.objects.filter(id__in=[row['id'] for row in completed]).update(status='COMPLETED')
+            record_completed_payments(
+                Payment.objects.filter(id__in=[row['id'] for row in completed])
+                .select_related('member')
+                .only('amount', 'payment_date', 'payment_type', 'mission_payment_type',
+                      'member', 'member__family', 'member__cohort')
+            )
+            _settled(completed, 'COMPLETED')
+        if failed:
+            Payment.objects.filter(id__in=[row['id'] for row in failed]).update(status='FAILED')
+            _settled(failed, 'FAILED')
+    return len(completed), len(failed)
+
+
+def expire_pending_payments(older_than, batch_size=1000):
+    """
+    Mark PENDING payments that never got a callback as EXPIRED.
+
+    Walks the partial index on pending payment dates in batches, so the
+    sweep only ever touches stale pending rows. Returns the number expired.
+    """
+    cutoff = timezone.now() - older_than
+    total = 0
+    while True:
+        ids = list(
+            Payment.objects.filter(status='PENDING', payment_date__lt=cutoff)
+            .order_by('payment_date')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return total
+        total += expire_payments(Payment.objects.filter(id__in=ids))
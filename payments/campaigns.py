@@ -0,0 +1,229 @@
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.db import transaction
+from django.utils import timezone
+from .dashboard import invalidate_dashboards
+from .jobs import apply_stk_response, pending_payment_for
+from .models import CampaignRecipient
+from .mpesa import StkPushOutcomeUnknown
+from .resilience import DarajaUnavailable, TokenBucket
+
+
+class CampaignProgress:
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.uncertain = 0
+        self.started = time.monotonic()
+
+    def record(self, status):
+        if status == 'SENT':
+            self.sent += 1
+        elif status == 'UNCERTAIN':
+            self.uncertain += 1
+        else:
+            self.failed += 1
+
+    def summary(self):
+        done = self.sent + self.failed + self.uncertain
+        elapsed = time.monotonic() - self.started
+        rate = done / elapsed if elapsed else 0
+        success = 100 * self.sent / done if done else 0
+        return (
+            f'{done}/{self.total} pushed, {self.sent} sent, {self.failed} failed, '
+            f'{self.uncertain} uncertain ({success:.0f}% success, {rate:.1f} pushes/sec)'
+        )
+
+
+def populate_recipients(campaign, batch_size=1000):
+    """Add a QUEUED recipient for every target member not already in the campaign"""
+    member_ids = campaign.target_members().order_by('id').values_list('id', flat=True)
+    batch = []
+    for member_id in member_ids.iterator(chunk_size=batch_size):
+        batch.append(CampaignRecipient(campaign=campaign, member_id=member_id))
+        if len(batch) >= batch_size:
+            CampaignRecipient.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        CampaignRecipient.objects.bulk_create(batch, ignore_conflicts=True)
+    return campaign.recipients.count()
+
+
+def resume_interrupted(campaign):
+    """
+    Settle recipients a stopped run left SENDING.
+
+    A recipient is only SENDING while its own push is in flight. Those whose
+    payment already carries a CheckoutRequestID reached Daraja and count as
+    SENT. The rest may have been prompted without the answer being stored,
+    so they are never pushed again: they become UNCERTAIN and their payments
+    stay PENDING for the callback, matched on member and amount, or a
+    statement reconciliation to settle.
+    """
+    interrupted = campaign.recipients.filter(status='SENDING')
+    sent = interrupted.filter(payment__checkout_request_id__isnull=False).update(status='SENT')
+    uncertain = interrupted.update(
+        status='UNCERTAIN', error='Run stopped before the push outcome was recorded', updated_at=timezone.now()
+    )
+    return sent, uncertain
+
+
+def next_recipients(campaign, limit):
+    return list(
+        campaign.recipients.filter(status='QUEUED').select_related('member').order_by('id')[:limit]
+    )
+
+
+def start_recipient(campaign, recipient):
+    """
+    Mark one recipient SENDING, with its PENDING payment, right before its push.
+
+    The status guard makes this the claim, so two runs never push the same
+    recipient; returns False when another run took it first.
+    """
+    with transaction.atomic():
+        if not CampaignRecipient.objects.filter(id=recipient.id, status='QUEUED').update(status='SENDING'):
+            return False
+        recipient.status = 'SENDING'
+        recipient.payment = pending_payment_for(
+            recipient.member, campaign.amount, campaign.payment_type, campaign.mission_payment_type
+        )
+        recipient.payment.save()
+        recipient.save(update_fields=['payment', 'updated_at'])
+        invalidate_dashboards([recipient.member_id])
+    return True
+
+
+def _push(client, campaign, recipient):
+    return client.initiate_stk_push(
+        phone_number=recipient.member.phone_number,
+        amount=recipient.payment.amount,
+        account_reference=campaign.account_reference,
+    )
+
+
+def _finish(recipient, response=None, error=''):
+    payment = recipient.payment
+    with transaction.atomic():
+        if response is not None and response.get('ResponseCode') == '0':
+            # Stored the moment the push returns, so a resumed run sees it reached Daraja
+            apply_stk_response(payment, response)
+            payment.save(update_fields=['transaction_id', 'checkout_request_id', 'merchant_request_id'])
+            recipient.status = 'SENT'
+        else:
+            if response is not None:
+                error = response.get('errorMessage') or response.get('ResponseDescription', 'STK push rejected')
+            payment.status = 'FAILED'
+            payment.save(update_fields=['status'])
+            recipient.status = 'FAILED'
+            recipient.error = error
+        recipient.save(update_fields=['status', 'error', 'updated_at'])
+    return recipient.status
+
+
+def _uncertain(recipient, error):
+    # The customer may already hold the prompt; the payment stays PENDING for its callback
+    recipient.status = 'UNCERTAIN'
+    recipient.error = error
+    recipient.save(update_fields=['status', 'error', 'updated_at'])
+    return recipient.status
+
+
+def _requeue(recipient):
+    with transaction.atomic():
+        recipient.payment.status = 'FAILED'
+        recipient.payment.save(update_fields=['status'])
+        recipient.status = 'QUEUED'
+        recipient.payment = None
+        recipient.save(update_fields=['status', 'payment', 'updated_at'])
+
+
+def _settle(in_flight, return_when):
+    """
+    Record the outcome of finished pushes, removing them from ``in_flight``.
+
+    Returns the statuses recorded and how long to pause before pushing
+    again, 0 unless Daraja reported itself unavailable.
+    """
+    done, _ = wait(in_flight, return_when=return_when)
+    statuses = []
+    pause = 0
+    for future in done:
+        recipient = in_flight.pop(future)
+        try:
+            response = future.result()
+        except DarajaUnavailable as e:
+            # Daraja is struggling, not the recipient; try them again once it recovers
+            _requeue(recipient)
+            pause = max(pause, e.retry_after)
+            continue
+        except StkPushOutcomeUnknown as e:
+            statuses.append(_uncertain(recipient, str(e)))
+        except Exception as e:
+            statuses.append(_finish(recipient, error=str(e)))
+        else:
+            statuses.append(_finish(recipient, response=response))
+    return statuses, pause
+
+
+def run_campaign(campaign, client, concurrency=4, rate=5.0, batch_size=None,
+                 report=None, report_interval=5.0):
+    """
+    Push the campaign's STK prompt to every QUEUED recipient.
+
+    At most ``concurrency`` pushes are in flight and all of them share one
+    ``rate`` per second budget to stay inside the Daraja quota. Recipient
+    state is saved as each push finishes, so a stopped run picks up where
+    it left off. Returns the CampaignProgress.
+    """
+    resume_interrupted(campaign)
+    campaign.status = 'RUNNING'
+    campaign.started_at = campaign.started_at or timezone.now()
+    campaign.save(update_fields=['status', 'started_at'])
+
+    progress = CampaignProgress(campaign.recipients.filter(status='QUEUED').count())
+    # In-process bucket for this run's own pace; MpesaClient also applies the global limit
+    limiter = TokenBucket(f'campaign:{campaign.pk}', rate, capacity=concurrency, max_wait=float('inf'))
+    batch_size = batch_size or concurrency * 10
+    last_report = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Worker threads only talk to Daraja; every database write stays on this thread
+        in_flight = {}
+        recipients = []
+        while True:
+            if not recipients:
+                recipients = next_recipients(campaign, batch_size)
+            if not recipients and not in_flight:
+                break
+            if not recipients or len(in_flight) >= concurrency:
+                # Wait for a thread to come free, or for the last pushes to finish
+                statuses, pause = _settle(in_flight, FIRST_COMPLETED)
+                if pause:
+                    drained, drained_pause = _settle(in_flight, ALL_COMPLETED)
+                    statuses += drained
+                    pause = max(pause, drained_pause)
+                for status in statuses:
+                    progress.record(status)
+                if pause:
+                    if report:
+                        report(f'M-Pesa unavailable, pausing for {pause}s')
+                    time.sleep(pause)
+                    # Read again so the recipients put back in the queue are included
+                    recipients = []
+                continue
+            recipient = recipients.pop(0)
+            # Paced first and started only on a free thread, so SENDING means the push is under way
+            limiter.acquire()
+            if start_recipient(campaign, recipient):
+                in_flight[executor.submit(_push, client, campaign, recipient)] = recipient
+            if report and time.monotonic() - last_report >= report_interval:
+                report(progress.summary())
+                last_report = time.monotonic()
+
+    if not campaign.recipients.exclude(status__in=['SENT', 'FAILED', 'UNCERTAIN']).exists():
+        campaign.status = 'COMPLETED'
+        campaign.finished_at = timezone.now()
+        campaign.save(update_fields=['status', 'finished_at'])
+    return progress
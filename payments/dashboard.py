@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Sum
+from .models import Member, Payment
+from .queries import newest_first
+
+# Bumped when a family or cohort changes, which every cached profile may show
+VERSION_KEY = 'dashboard:version'
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _user_key(user_id):
+    return f'dashboard:user:{user_id}'
+
+
+def _member_key(version, member_id):
+    return f'dashboard:{version}:member:{member_id}'
+
+
+def build_dashboard(member, user):
+    """Profile summary, most recent payments and completed totals by type for ``member``"""
+    limit = getattr(settings, 'DASHBOARD_RECENT_PAYMENTS', 5)
+    recent = newest_first(
+        Payment.objects.filter(member=member).values('payment_date', 'payment_type', 'amount', 'status'),
+        limit,
+    )
+    labels = dict(Payment.PAYMENT_TYPES)
+    totals = [
+        {**row, 'label': labels.get(row['payment_type'], row['payment_type'])}
+        for row in Payment.objects.filter(member=member, status='COMPLETED')
+        .values('payment_type')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by('payment_type')
+    ]
+    return {
+        'member_id': member.id,
+        'profile': {
+            'full_name': user.get_full_name(),
+            'family': str(member.family) if member.family_id else None,
+            'cohort': str(member.cohort) if member.cohort_id else None,
+            'phone_number': member.phone_number,
+            'is_amo': member.is_amo,
+            'is_alo': member.is_alo,
+        },
+        'recent_payments': recent,
+        'totals': totals,
+    }
+
+
+def get_dashboard(user):
+    """
+    Dashboard data for ``user``'s member profile, or None when there is none.
+
+    Served from the cache while the member's payments and profile are
+    unchanged, so a hit costs no queries.
+    """
+    cache = _cache()
+    cached = cache.get_many([VERSION_KEY, _user_key(user.pk)])
+    version = cached.get(VERSION_KEY, 0)
+    member_id = cached.get(_user_key(user.pk))
+    if member_id is not None:
+        data = cache.get(_member_key(version, member_id))
+        if data is not None:
+            return data
+
+    member = Member.objects.select_related('family', 'cohort').filter(user=user).first()
+    if member is None:
+        return None
+    data = build_dashboard(member, user)
+    # A write committing while this was built is only invalidated once, so the
+    # timeout bounds how long such a stale entry can be served
+    cache.set_many(
+        {_user_key(user.pk): member.id, _member_key(version, member.id): data},
+        timeout=getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300),
+    )
+    return data
+
+
+def _delete_dashboards(member_ids):
+    cache = _cache()
+    version = cache.get(VERSION_KEY, 0)
+    cache.delete_many([_member_key(version, member_id) for member_id in member_ids])
+
+
+def invalidate_dashboards(member_ids):
+    """Drop the cached dashboards of ``member_ids`` once the current transaction commits"""
+    member_ids = {member_id for member_id in member_ids if member_id is not None}
+    if member_ids:
+        transaction.on_commit(lambda: _delete_dashboards(member_ids))
+
+
+def invalidate_user_dashboard(user_id, forget_member=False):
+    """Drop the cached dashboard of ``user_id``'s member, and its user to member mapping if asked"""
+    def delete():
+        cache = _cache()
+        member_id = cache.get(_user_key(user_id))
+        if member_id is not None:
+            _delete_dashboards([member_id])
+        if forget_member:
+            cache.delete(_user_key(user_id))
+    transaction.on_commit(delete)
+
+
+def invalidate_all_dashboards():
+    """Retire every cached dashboard by moving to a new key version"""
+    def bump():
+        cache = _cache()
+        cache.add(VERSION_KEY, 0, timeout=None)
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(VERSION_KEY, 1, timeout=None)
+    transaction.on_commit(bump)
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import logging
+import queue
+import select
+import threading
+import time
+import dj_database_url
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Payment statuses after which nothing more will be published for a checkout
+FINAL_STATUSES = {'COMPLETED', 'FAILED', 'EXPIRED'}
+
+# The one PostgreSQL NOTIFY channel carrying every event
+PG_CHANNEL = 'payment_events'
+
+# Tells EventSource clients to reconnect after 2 seconds when a stream ends
+RECONNECT = 'retry: 2000\n\n'
+
+
+def member_channel(member_id):
+    return f'member:{member_id}'
+
+
+def checkout_channel(checkout_request_id):
+    return f'checkout:{checkout_request_id}'
+
+
+class Subscription:
+    """Events for a set of channels, read from a thread with ``get``"""
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.queue = queue.SimpleQueue()
+
+    def deliver(self, event):
+        self.queue.put(event)
+
+    def get(self, timeout):
+        """The next event, or None if none arrives within ``timeout`` seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """Events for a set of channels, awaited on the event loop that subscribed"""
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, event):
+        # Publishers run on other threads
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # The loop has closed, the client is gone
+            pass
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBroker:
+    """
+    Publish/subscribe between the threads and event loops of this process.
+
+    Only reaches subscribers in the process that publishes. Callbacks are
+    applied by process_callbacks, so web clients never hear from it and
+    live updates are turned off while it is the broker.
+    """
+
+    # Whether events published by another process reach this one's subscribers
+    cross_process = False
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channels, asynchronous=False):
+        subscription = (AsyncSubscription if asynchronous else Subscription)(self, list(channels))
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscribers[channel]
+
+    def dispatch(self, channel, event):
+        """Hand ``event`` to this process's subscribers of ``channel``"""
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def publish(self, channel, event):
+        """Send ``event`` to ``channel`` once the current transaction commits"""
+        transaction.on_commit(lambda: self.dispatch(channel, event))
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Publish/subscribe across processes with PostgreSQL LISTEN/NOTIFY.
+
+    Events are sent with ``pg_notify`` on the publisher's connection, so
+    PostgreSQL delivers them only if its transaction commits. Each process
+    with subscribers runs one thread holding a dedicated connection that
+    LISTENs and dispatches to its local subscribers.
+    """
+
+    cross_process = True
+
+    def __init__(self, using='default'):
+        super().__init__()
+        self.using = using
+        self.listener = None
+
+    def subscribe(self, channels, asynchronous=False):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name='payment-events', daemon=True)
+                self.listener.start()
+        return super().subscribe(channels, asynchronous)
+
+    def publish(self, channel, event):
+        payload = json.dumps({'channel': channel, 'event': event}, default=str)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [PG_CHANNEL, payload])
+
+    def connection_params(self):
+        """Parameters for the listener's own connection, outside any pool"""
+        wrapper = connections[self.using]
+        # get_connection_params() leaves the pool options out
+        params = wrapper.get_connection_params()
+        url = getattr(settings, 'PAYMENT_EVENTS_LISTEN_URL', None)
+        if url:
+            direct = dj_database_url.parse(url)
+            params.update({
+                key: direct[name]
+                for key, name in (('dbname', 'NAME'), ('user', 'USER'), ('password', 'PASSWORD'),
+                                  ('host', 'HOST'), ('port', 'PORT'))
+                if direct.get(name)
+            })
+        return params
+
+    def listen(self):
+        wrapper = connections[self.using]
+        while True:
+            try:
+                conn = wrapper.Database.connect(**self.connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {PG_CHANNEL}')
+                if callable(conn.notifies):
+                    # psycopg 3 yields notifications as they arrive
+                    while True:
+                        for notify in conn.notifies(timeout=5):
+                            message = json.loads(notify.payload)
+                            self.dispatch(message['channel'], message['event'])
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        message = json.loads(conn.notifies.pop(0).payload)
+                        self.dispatch(message['channel'], message['event'])
+            except Exception:
+                logger.exception('Payment event listener lost its connection, reconnecting')
+                time.sleep(1)
+
+
+BROKERS = {
+    'local': LocalBroker,
+    'postgres': PostgresBroker,
+}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker chosen by PAYMENT_EVENTS_BACKEND, by default postgres on PostgreSQL"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            backend = getattr(settings, 'PAYMENT_EVENTS_BACKEND', None)
+            if not backend:
+                backend = 'postgres' if connections['default'].vendor == 'postgresql' else 'local'
+            _broker = BROKERS[backend]()
+        return _broker
+
+
+def live_updates_enabled():
+    """Whether results applied by process_callbacks can reach clients of the web workers"""
+    return get_broker().cross_process
+
+
+def publish_payment_events(events):
+    """
+    Notify the member and the CheckoutRequestID waiting on each payment.
+
+    ``events`` are dicts with ``member_id``, ``checkout_request_id``,
+    ``status`` and ``receipt_number``; delivery waits for the current
+    transaction to commit.
+    """
+    broker = get_broker()
+    for event in events:
+        event = {
+            'checkout_request_id': event['checkout_request_id'],
+            'status': event['status'],
+            'receipt_number': event.get('receipt_number') or '',
+            'member_id': event['member_id'],
+        }
+        broker.publish(member_channel(event['member_id']), event)
+        if event['checkout_request_id']:
+            broker.publish(checkout_channel(event['checkout_request_id']), event)
+
+
+def _format(event):
+    return f"event: payment\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+def _finished(event, close_on_final):
+    return close_on_final and event['status'] in FINAL_STATUSES
+
+
+def stream_events(subscription, initial=None, close_on_final=False):
+    """Server-sent events for a thread-based Subscription, with keepalive comments"""
+    heartbeat = getattr(settings, 'PAYMENT_EVENTS_HEARTBEAT', 15)
+    deadline = time.monotonic() + getattr(settings, 'PAYMENT_EVENTS_MAX_AGE', 300)
+    try:
+        yield RECONNECT
+        if initial is not None:
+            yield _format(initial)
+            if _finished(initial, close_on_final):
+                return
+        while (remaining := deadline - time.monotonic()) > 0:
+            event = subscription.get(min(heartbeat, remaining))
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield _format(event)
+            if _finished(event, close_on_final):
+                return
+    finally:
+        subscription.close()
+
+
+async def astream_events(subscription, initial=None, close_on_final=False):
+    """stream_events for an AsyncSubscription, holding no thread while it waits"""
+    heartbeat = getattr(settings, 'PAYMENT_EVENTS_HEARTBEAT', 15)
+    deadline = time.monotonic() + getattr(settings, 'PAYMENT_EVENTS_MAX_AGE', 300)
+    try:
+        yield RECONNECT
+        if initial is not None:
+            yield _format(initial)
+            if _finished(initial, close_on_final):
+                return
+        while (remaining := deadline - time.monotonic()) > 0:
+            event = await subscription.get(min(heartbeat, remaining))
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield _format(event)
+            if _finished(event, close_on_final):
+                return
+    finally:
+        subscription.close()
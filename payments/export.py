@@ -0,0 +1,226 @@
+import csv
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from django.utils import timezone
+from .models import Payment
+from .pagination import older_than
+from .queries import filter_payment_history
+
+EXPORT_FIELDS = (
+    ('Date', 'payment_date'),
+    ('Member', 'member__user__username'),
+    ('First name', 'member__user__first_name'),
+    ('Last name', 'member__user__last_name'),
+    ('Phone number', 'member__phone_number'),
+    ('Family', 'member__family__name'),
+    ('Cohort', 'member__cohort__name'),
+    ('Payment type', 'payment_type'),
+    ('Mission type', 'mission_payment_type'),
+    ('Amount', 'amount'),
+    ('Status', 'status'),
+    ('M-Pesa receipt', 'mpesa_receipt_number'),
+    ('Transaction ID', 'transaction_id'),
+)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def _id_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name} id: {value}")
+
+
+def export_queryset(params):
+    """
+    Payments matching the payment_history filters in ``params`` plus
+    ``family``, ``cohort`` and ``member`` ids, newest first.
+
+    Raises ValueError when one of the ids is not a number.
+    """
+    ids = {name: _id_param(params, name) for name in ('family', 'cohort', 'member')}
+    payments = filter_payment_history(Payment.objects.all(), params)
+    for name in ('family', 'cohort'):
+        if ids[name] is not None:
+            payments = payments.filter(**{f'member__{name}_id': ids[name]})
+    if ids['member'] is not None:
+        payments = payments.filter(member_id=ids['member'])
+    return payments.order_by('-payment_date', '-id')
+
+
+def export_rows(payments, chunk_size=2000):
+    """
+    Yield one tuple per payment in ``EXPORT_FIELDS`` order.
+
+    Rows are read in keyset batches of ``chunk_size`` on ``(payment_date,
+    id)``, each seeking on payment_date_id_idx past the last row of the one
+    before. Only one batch is held in memory, without the server-side cursor
+    that DISABLE_SERVER_SIDE_CURSORS turns off behind PgBouncer.
+    """
+    lookups = ['id'] + [lookup for _, lookup in EXPORT_FIELDS]
+    batch = list(payments.values_list(*lookups)[:chunk_size])
+    while batch:
+        for row in batch:
+            yield row[1:]
+        if len(batch) < chunk_size:
+            return
+        # EXPORT_FIELDS starts with payment_date
+        last_id, last_date = batch[-1][:2]
+        batch = list(older_than(payments, last_date, last_id).values_list(*lookups)[:chunk_size])
+
+
+class _Echo:
+    """File-like object whose write() hands back what it was given"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([header for header, _ in EXPORT_FIELDS]).encode()
+    for row in rows:
+        values = list(row)
+        values[0] = timezone.localtime(values[0]).strftime('%Y-%m-%d %H:%M:%S')
+        yield writer.writerow(values).encode()
+
+
+class _ChunkBuffer:
+    """Unseekable sink for zipfile; the bytes written are drained by the generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Payments" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Style 1 is the built-in "m/d/yy h:mm" format used for payment dates
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# XML 1.0 rejects most control characters even when escaped
+_CONTROL_CHARACTERS = dict.fromkeys(c for c in range(32) if c not in (9, 10, 13))
+
+
+def _xlsx_cell(value):
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, datetime):
+        local = timezone.localtime(value).replace(tzinfo=None)
+        return f'<c s="1"><v>{(local - _EXCEL_EPOCH).total_seconds() / 86400:.6f}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(str(value).translate(_CONTROL_CHARACTERS))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+def iter_xlsx(rows, rows_per_chunk=500):
+    """
+    Yield an XLSX workbook with a single sheet as it is compressed.
+
+    zipfile writes to the unseekable buffer with data descriptors, so each
+    batch of rows is deflated and handed on without building the file.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _xlsx_row(header for header, _ in EXPORT_FIELDS)
+            ).encode())
+            lines = []
+            for row in rows:
+                lines.append(_xlsx_row(row))
+                if len(lines) >= rows_per_chunk:
+                    sheet.write(''.join(lines).encode())
+                    lines = []
+                    yield buffer.drain()
+            sheet.write((''.join(lines) + '</sheetData></worksheet>').encode())
+    yield buffer.drain()
+
+
+def iter_export(payments, file_format='csv', chunk_size=2000):
+    rows = export_rows(payments, chunk_size=chunk_size)
+    if file_format == 'xlsx':
+        return iter_xlsx(rows)
+    return iter_csv(rows)
@@ -0,0 +1,230 @@
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+
+class FakeDarajaHandler(BaseHTTPRequestHandler):
+    """Answers the Daraja endpoints MpesaClient uses with canned responses"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            return None
+
+    def injected_error(self):
+        """Answer with the configured error status for a share of requests"""
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.send_json(self.server.error_status, {'errorMessage': 'Injected fake Daraja error'})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.startswith('/oauth/v1/generate'):
+            time.sleep(self.server.latency)
+            if not self.injected_error():
+                self.send_json(200, {'access_token': 'fake-access-token', 'expires_in': '3599'})
+        else:
+            self.send_json(404, {'errorMessage': 'Not found'})
+
+    def do_POST(self):
+        if self.path == '/mpesa/stkpushquery/v1/query':
+            self.query_status()
+            return
+        if self.path != '/mpesa/stkpush/v1/processrequest':
+            self.send_json(404, {'errorMessage': 'Not found'})
+            return
+        payload = self.read_json()
+        time.sleep(self.server.latency)
+        if self.injected_error():
+            return
+        if not payload or not payload.get('PhoneNumber'):
+            self.send_json(400, {'errorMessage': 'Bad Request - Invalid PhoneNumber'})
+            return
+        number = next(self.server.counter)
+        # The run prefix keeps ids unique across servers sharing one database
+        merchant_request_id = f'fake-merchant-{self.server.run_id}-{number}'
+        checkout_request_id = f'ws_CO_fake_{self.server.run_id}_{number}'
+        self.send_json(200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        })
+        callback = self.server.callback_payload(merchant_request_id, checkout_request_id, payload)
+        if self.server.callbacks is not None and payload.get('CallBackURL'):
+            self.server.callbacks.schedule(payload['CallBackURL'], callback)
+
+    def query_status(self):
+        payload = self.read_json() or {}
+        time.sleep(self.server.latency)
+        if self.injected_error():
+            return
+        checkout_request_id = payload.get('CheckoutRequestID')
+        callback = self.server.results.get(checkout_request_id)
+        if callback is None:
+            # What Daraja answers while the customer has not responded yet
+            self.send_json(500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'})
+            return
+        self.send_json(200, {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successfully',
+            'MerchantRequestID': callback['MerchantRequestID'],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': str(callback['ResultCode']),
+            'ResultDesc': callback['ResultDesc'],
+        })
+
+
+class CallbackDispatcher:
+    """Posts STK callbacks to the push's CallBackURL after a delay, from a few worker threads"""
+
+    def __init__(self, delay, workers=4, timeout=10):
+        self.delay = delay
+        self.timeout = timeout
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.sent = 0
+        self.failed = 0
+        self.threads = [
+            threading.Thread(target=self.run, name=f'fake-daraja-callbacks-{i}', daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def schedule(self, url, payload):
+        with self.condition:
+            heapq.heappush(self.queue, (time.monotonic() + self.delay, next(self.sequence), url, payload))
+            self.condition.notify()
+
+    def pending(self):
+        with self.condition:
+            return len(self.queue)
+
+    def run(self):
+        session = requests.Session()
+        while True:
+            with self.condition:
+                while not self.stopping and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if self.stopping:
+                    return
+                _, _, url, payload = heapq.heappop(self.queue)
+            try:
+                response = session.post(url, json=payload, timeout=self.timeout)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            with self.condition:
+                if ok:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Benchmarks open hundreds of connections at once
+    request_queue_size = 1024
+
+
+class FakeDarajaServer:
+    """
+    Local stand-in for the Safaricom Daraja API, for benchmarks and offline runs.
+
+    Point MPESA_BASE_URL at ``server.url`` after ``start()``. ``latency`` is
+    added to every OAuth and STK push response to mimic the real upstream,
+    and ``error_rate`` of them are answered with ``error_status`` instead.
+    With ``callback_delay`` set, every accepted push is followed that many
+    seconds later by its STK callback, POSTed to the push's CallBackURL;
+    ``callback_failure_rate`` of those report the customer cancelling. STK
+    status queries answer with a push's result once its callback is built,
+    and with Daraja's still-processing error before that.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, error_status=500,
+                 callback_delay=None, callback_failure_rate=0.0, callback_workers=4):
+        self.httpd = _HTTPServer((host, port), FakeDarajaHandler)
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.error_status = error_status
+        self.httpd.counter = itertools.count(1)
+        self.httpd.run_id = uuid.uuid4().hex[:8]
+        self.httpd.callback_payload = self.callback_payload
+        # CheckoutRequestID -> the stkCallback its push reports, also answered by the status query
+        self.httpd.results = {}
+        self.callback_failure_rate = callback_failure_rate
+        self.callbacks = None
+        if callback_delay is not None:
+            self.callbacks = CallbackDispatcher(callback_delay, workers=callback_workers)
+        self.httpd.callbacks = self.callbacks
+        self.thread = None
+
+    def callback_payload(self, merchant_request_id, checkout_request_id, request):
+        """The body Daraja sends to CallBackURL once the customer answers the prompt"""
+        callback = {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+        }
+        if self.callback_failure_rate and random.random() < self.callback_failure_rate:
+            callback.update(ResultCode=1032, ResultDesc='Request cancelled by user')
+        else:
+            callback.update(ResultCode=0, ResultDesc='The service request is processed successfully.')
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': request.get('Amount')},
+                {'Name': 'MpesaReceiptNumber', 'Value': f'FK{uuid.uuid4().hex[:8].upper()}'},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': int(request.get('PhoneNumber'))},
+            ]}
+        self.httpd.results[checkout_request_id] = callback
+        return {'Body': {'stkCallback': callback}}
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-daraja', daemon=True)
+        self.thread.start()
+        if self.callbacks is not None:
+            self.callbacks.start()
+        return self
+
+    def stop(self):
+        if self.callbacks is not None:
+            self.callbacks.stop()
+        self.httpd.shutdown()
+        self.httpd.server_close()
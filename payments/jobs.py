@@ -0,0 +1,178 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Payment, StkPushJob
+from .mpesa import StkPushOutcomeUnknown
+from .resilience import DarajaUnavailable
+
+
+def async_initiation_enabled():
+    return getattr(settings, 'MPESA_ASYNC_INITIATION', False)
+
+
+def _clean_payment_fields(amount, payment_type, mission_payment_type):
+    try:
+        amount = Decimal(str(amount))
+    except (InvalidOperation, TypeError):
+        raise ValueError("Invalid amount provided")
+    if amount <= 0:
+        raise ValueError("Amount must be positive")
+    if payment_type not in dict(Payment.PAYMENT_TYPES):
+        raise ValueError(f"Invalid payment type: {payment_type}")
+    if mission_payment_type not in dict(Payment.MISSION_PAYMENT_TYPES):
+        mission_payment_type = None
+    return amount, payment_type, mission_payment_type
+
+
+def apply_stk_response(payment, response):
+    """Copy the ids Daraja assigned to an accepted push onto its payment"""
+    checkout_request_id = response.get('CheckoutRequestID')
+    if checkout_request_id:
+        payment.transaction_id = checkout_request_id
+        payment.checkout_request_id = checkout_request_id
+    payment.merchant_request_id = response.get('MerchantRequestID') or None
+    return payment
+
+
+def pending_payment_for(member, amount, payment_type, mission_payment_type=None):
+    """
+    Build (unsaved) the PENDING payment for an STK push made inside the request.
+
+    Built before the push so bad input is rejected without prompting the
+    customer; save it after ``apply_stk_response``.
+    """
+    amount, payment_type, mission_payment_type = _clean_payment_fields(
+        amount, payment_type, mission_payment_type
+    )
+    return Payment(
+        member=member,
+        payment_type=payment_type,
+        mission_payment_type=mission_payment_type,
+        amount=amount,
+        transaction_id=f"PENDING-{uuid.uuid4().hex}",
+        status='PENDING',
+    )
+
+
+def enqueue_stk_push(member, amount, payment_type, account_reference,
+                     mission_payment_type=None, phone_number=None):
+    """Persist a PENDING payment and the job that will push its STK prompt"""
+    amount, payment_type, mission_payment_type = _clean_payment_fields(
+        amount, payment_type, mission_payment_type
+    )
+
+    with transaction.atomic():
+        payment = Payment.objects.create(
+            member=member,
+            payment_type=payment_type,
+            mission_payment_type=mission_payment_type,
+            amount=amount,
+            # Replaced by the CheckoutRequestID once Daraja accepts the push
+            transaction_id=f"PENDING-{uuid.uuid4().hex}",
+            status='PENDING',
+        )
+        job = StkPushJob.objects.create(
+            payment=payment,
+            phone_number=phone_number or member.phone_number,
+            account_reference=account_reference,
+        )
+    return job
+
+
+def release_stale_jobs(timeout):
+    """
+    Mark RUNNING jobs whose worker stopped without finishing them UNCERTAIN.
+
+    The worker may have died after its push reached Daraja, so the job is
+    never sent again; its payment stays PENDING for the callback or a
+    statement reconciliation to settle.
+    """
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return StkPushJob.objects.filter(status='RUNNING', locked_at__lt=cutoff).update(
+        status='UNCERTAIN', error='Worker stopped before recording the push outcome',
+        locked_by='', locked_at=None, updated_at=timezone.now(),
+    )
+
+
+def claim_jobs(worker_id, limit):
+    """Atomically take up to ``limit`` due jobs for ``worker_id``"""
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked lets workers claim disjoint batches on PostgreSQL; the
+        # status guard on the update keeps claims exclusive everywhere else
+        ids = list(
+            StkPushJob.objects.select_for_update(skip_locked=True)
+            .filter(status='QUEUED', available_at__lte=now)
+            .order_by('available_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        StkPushJob.objects.filter(id__in=ids, status='QUEUED').update(
+            status='RUNNING', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1
+        )
+    return list(
+        StkPushJob.objects.filter(id__in=ids, status='RUNNING', locked_by=worker_id)
+        .select_related('payment')
+    )
+
+
+def _finish(job, status, payment_status, response=None, error=''):
+    job.status = status
+    job.response = response
+    job.error = error
+    job.locked_by = ''
+    job.locked_at = None
+    job.save(update_fields=['status', 'response', 'error', 'locked_by', 'locked_at', 'updated_at'])
+    if payment_status:
+        job.payment.status = payment_status
+        job.payment.save(update_fields=[
+            'status', 'transaction_id', 'checkout_request_id', 'merchant_request_id'
+        ])
+
+
+def run_job(job, client, max_attempts=3):
+    """Push one job's STK prompt and record the outcome on the job and its payment"""
+    try:
+        response = client.initiate_stk_push(
+            phone_number=job.phone_number,
+            amount=job.payment.amount,
+            account_reference=job.account_reference,
+        )
+    except DarajaUnavailable as e:
+        # An open circuit or exhausted rate limit is not this job's fault, retry without using an attempt
+        job.status = 'QUEUED'
+        job.error = str(e)
+        job.attempts -= 1
+        job.locked_by = ''
+        job.locked_at = None
+        job.available_at = timezone.now() + timedelta(seconds=e.retry_after)
+        job.save(update_fields=['status', 'error', 'attempts', 'locked_by', 'locked_at', 'available_at', 'updated_at'])
+        return job
+    except StkPushOutcomeUnknown as e:
+        # The customer may already hold the prompt; the payment stays PENDING for its callback
+        _finish(job, 'UNCERTAIN', None, error=str(e))
+        return job
+    except Exception as e:
+        if job.attempts < max_attempts:
+            job.status = 'QUEUED'
+            job.error = str(e)
+            job.locked_by = ''
+            job.locked_at = None
+            job.available_at = timezone.now() + timedelta(seconds=2 ** job.attempts)
+            job.save(update_fields=['status', 'error', 'locked_by', 'locked_at', 'available_at', 'updated_at'])
+        else:
+            _finish(job, 'FAILED', 'FAILED', error=str(e))
+        return job
+
+    if response.get('ResponseCode') == '0':
+        apply_stk_response(job.payment, response)
+        _finish(job, 'SUCCEEDED', 'PENDING', response=response)
+    else:
+        error = response.get('errorMessage') or response.get('ResponseDescription', 'STK push rejected')
+        _finish(job, 'FAILED', 'FAILED', response=response, error=error)
+    return job
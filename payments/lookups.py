@@ -0,0 +1,138 @@
+import threading
+import time
+import uuid
+from django import forms
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.forms.models import ModelChoiceIterator
+from .models import Cohort, Family, PaymentCategory
+
+# Small tables that change a few times a year and are read on most pages
+LOOKUP_MODELS = {
+    'family': Family,
+    'cohort': Cohort,
+    'payment_category': PaymentCategory,
+}
+
+
+class LookupTable:
+    """One version of a lookup table's rows, ordered by id"""
+
+    def __init__(self, name, version, modified, objects):
+        self.name = name
+        self.version = version
+        self.modified = modified
+        self.objects = objects
+        self.by_pk = {obj.pk: obj for obj in objects}
+
+    @property
+    def etag(self):
+        return f'"{self.name}-{self.version}"'
+
+
+# name -> (LookupTable, time its version was last checked)
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'LOOKUP_CACHE_ALIAS', 'default')]
+
+
+def _version_key(name):
+    return f'lookups:{name}:version'
+
+
+def _current_version(cache, name):
+    timeout = getattr(settings, 'LOOKUP_CACHE_TIMEOUT', 3600)
+    state = {'version': uuid.uuid4().hex, 'modified': time.time()}
+    # add() so that workers starting together settle on one version
+    cache.add(_version_key(name), state, timeout=timeout)
+    return cache.get(_version_key(name)) or state
+
+
+def get_lookup(name):
+    """
+    Current rows of the lookup table ``name``.
+
+    Rows are kept in this process and in the shared cache under a version
+    that save/delete signals replace. The process copy is trusted for
+    LOOKUP_CACHE_LOCAL_TTL seconds before the shared version is checked
+    again, so other workers see a change within that time.
+    """
+    now = time.monotonic()
+    entry = _local.get(name)
+    if entry is not None and now - entry[1] < getattr(settings, 'LOOKUP_CACHE_LOCAL_TTL', 5):
+        return entry[0]
+
+    cache = _cache()
+    # The version is read before the rows, so rows fetched while a change
+    # commits are stored under a version that is already being retired
+    state = _current_version(cache, name)
+    if entry is not None and entry[0].version == state['version']:
+        table = entry[0]
+    else:
+        rows_key = f'lookups:{name}:{state["version"]}'
+        objects = cache.get(rows_key)
+        if objects is None:
+            # From the primary even inside replica reads, as a lagging copy would stay cached
+            objects = list(LOOKUP_MODELS[name].objects.using(DEFAULT_DB_ALIAS).order_by('pk'))
+            cache.set(rows_key, objects, timeout=getattr(settings, 'LOOKUP_CACHE_TIMEOUT', 3600))
+        table = LookupTable(name, state['version'], state['modified'], objects)
+    with _local_lock:
+        _local[name] = (table, now)
+    return table
+
+
+def invalidate_lookup(name):
+    """Start a new version of the lookup table ``name`` once the current transaction commits"""
+    def bump():
+        _cache().set(
+            _version_key(name),
+            {'version': uuid.uuid4().hex, 'modified': time.time()},
+            timeout=getattr(settings, 'LOOKUP_CACHE_TIMEOUT', 3600),
+        )
+        with _local_lock:
+            _local.pop(name, None)
+    transaction.on_commit(bump)
+
+
+class CachedChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in get_lookup(self.field.lookup_name).objects:
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(get_lookup(self.field.lookup_name).objects) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(get_lookup(self.field.lookup_name).objects)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField for a lookup table that renders and validates from the lookup cache"""
+    iterator = CachedChoiceIterator
+
+    def __init__(self, lookup_name, **kwargs):
+        self.lookup_name = lookup_name
+        super().__init__(queryset=LOOKUP_MODELS[lookup_name].objects.all(), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        value = getattr(value, 'pk', value)
+        try:
+            obj = get_lookup(self.lookup_name).by_pk.get(int(value))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return obj
@@ -0,0 +1,45 @@
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from payments.partitioning import add_months, archivable_partitions, archive_partition, is_partitioned, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves monthly payment partitions older than --older-than months into gzip-compressed '
+        'CSV files, dropping them from the payments table'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=24,
+                            help='Months of payments, counting the current one, that stay in the table')
+        parser.add_argument('--directory', default='.', help='Where to write the archive files')
+        parser.add_argument('--keep-table', action='store_true',
+                            help='Keep each archived partition as a standalone table instead of dropping it')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the partitions that would be archived')
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError('The payments table is not partitioned, run partition_payments first')
+        if options['older_than'] < 1:
+            raise CommandError('--older-than must be at least 1')
+        directory = Path(options['directory'])
+        if not directory.is_dir():
+            raise CommandError(f'{directory} is not a directory')
+
+        before = add_months(month_start(timezone.now()), 1 - options['older_than'])
+        partitions = archivable_partitions(before)
+        if not partitions:
+            self.stdout.write(f'No partitions before {before:%Y-%m} to archive')
+            return
+
+        total = 0
+        for name, month in partitions:
+            if options['dry_run']:
+                self.stdout.write(f'Would archive {name}')
+                continue
+            count, path = archive_partition(name, month, directory, keep_table=options['keep_table'])
+            total += count
+            self.stdout.write(f'Archived {count} payments from {month:%Y-%m} to {path}')
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Archived {total} payments from {len(partitions)} partitions'))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from payments.models import Member
+from payments.phone import to_msisdn
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills Member.msisdn from phone_number for members saved before it existed, in batches. '
+        'Invalid numbers and numbers already held by another member are reported and left empty'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        updated = invalid = conflicts = 0
+        last_id = 0
+        while True:
+            # Keyset over the primary key, so every batch is one index range
+            members = list(
+                Member.objects.filter(id__gt=last_id).order_by('id')
+                .only('id', 'phone_number', 'msisdn')[:options['batch_size']]
+            )
+            if not members:
+                break
+            last_id = members[-1].id
+
+            wanted = {member.id: to_msisdn(member.phone_number) for member in members}
+            held = dict(
+                Member.objects.filter(msisdn__in=[msisdn for msisdn in wanted.values() if msisdn])
+                .values_list('msisdn', 'id')
+            )
+            changed = []
+            for member in members:
+                msisdn = wanted[member.id]
+                if msisdn is None:
+                    if member.phone_number:
+                        self.stderr.write(f'Member {member.id}: invalid phone number "{member.phone_number}"')
+                    invalid += 1
+                elif held.setdefault(msisdn, member.id) != member.id:
+                    self.stderr.write(
+                        f'Member {member.id}: phone number {msisdn} already belongs to member {held[msisdn]}'
+                    )
+                    conflicts += 1
+                    msisdn = None
+                if member.msisdn != msisdn:
+                    member.msisdn = msisdn
+                    changed.append(member)
+            if changed:
+                with transaction.atomic():
+                    Member.objects.bulk_update(changed, ['msisdn'])
+                updated += len(changed)
+            self.stdout.write(f'Up to member {last_id}: {updated} updated')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {updated} members; {invalid} have no valid phone number and '
+            f'{conflicts} share a number with another member'
+        ))
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from payments.fake_daraja import FakeDarajaServer
+from payments.mpesa_async import get_async_http_client
+
+SYNC_PATH = '/api/payments/initiate_payment/'
+ASYNC_PATH = '/api/async/payments/initiate_payment/'
+PAYLOAD = {'phone_number': '0712345678', 'amount': '20', 'payment_type': 'OFFERING'}
+
+
+class Command(BaseCommand):
+    help = 'Compares sync (WSGI) and async (ASGI) STK push initiation throughput against a local fake Daraja server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Seconds the fake Daraja server waits before answering')
+        parser.add_argument('--sync-workers', type=int, default=8,
+                            help='Concurrent WSGI workers (threads) for the sync run')
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='In-flight requests on the single event loop for the async run')
+
+    def handle(self, *args, **options):
+        server = FakeDarajaServer(latency=options['latency']).start()
+        overrides = {
+            'MPESA_BASE_URL': server.url,
+            'MPESA_CONSUMER_KEY': 'bench-key',
+            'MPESA_CONSUMER_SECRET': 'bench-secret',
+            'MPESA_PAYBILL': '174379',
+            'MPESA_PASSKEY': 'bench-passkey',
+            'MPESA_CALLBACK_URL': f'{server.url}/callback',
+            'MPESA_ASYNC_INITIATION': False,
+            'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) + ['testserver'],
+        }
+        try:
+            with override_settings(**overrides):
+                results = [
+                    self.run_sync(options['requests'], options['sync_workers']),
+                    asyncio.run(self.run_async(options['requests'], options['concurrency'])),
+                ]
+        finally:
+            server.stop()
+
+        self.stdout.write(f"Fake Daraja latency: {options['latency'] * 1000:.0f} ms")
+        self.stdout.write(f"{'mode':<12}{'concurrency':>12}{'requests':>10}{'errors':>8}{'seconds':>10}{'req/s':>10}")
+        for mode, concurrency, total, errors, elapsed in results:
+            self.stdout.write(
+                f"{mode:<12}{concurrency:>12}{total:>10}{errors:>8}{elapsed:>10.2f}{total / elapsed:>10.1f}"
+            )
+
+    def run_sync(self, total, workers):
+        remaining = iter(range(total))
+        lock = threading.Lock()
+        errors = []
+
+        def worker():
+            client = Client()
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                response = client.post(SYNC_PATH, PAYLOAD, content_type='application/json')
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return ('sync/wsgi', workers, total, len(errors), elapsed)
+
+    async def run_async(self, total, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        errors = []
+
+        async def one():
+            async with semaphore:
+                response = await client.post(ASYNC_PATH, PAYLOAD, content_type='application/json')
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        await get_async_http_client().aclose()
+        return ('async/asgi', concurrency, total, len(errors), elapsed)
@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from payments.callbacks import expire_pending_payments
+
+
+class Command(BaseCommand):
+    help = 'Marks PENDING payments that never received an M-Pesa callback as EXPIRED'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=60,
+                            help='Minutes a payment may stay PENDING before it expires')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = expire_pending_payments(
+            timedelta(minutes=options['older_than']),
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} pending payments'))
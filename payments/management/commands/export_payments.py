@@ -0,0 +1,48 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from payments.export import CONTENT_TYPES, export_queryset, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Streams payments to a CSV or XLSX file using the payment history filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='File to write; CSV goes to stdout when omitted')
+        parser.add_argument('--format', choices=sorted(CONTENT_TYPES),
+                            help='Defaults to the output file extension, else csv')
+        parser.add_argument('--payment-type')
+        parser.add_argument('--status')
+        parser.add_argument('--date-from', help='YYYY-MM-DD')
+        parser.add_argument('--date-to', help='YYYY-MM-DD')
+        parser.add_argument('--family', type=int, help='Family id')
+        parser.add_argument('--cohort', type=int, help='Cohort id')
+        parser.add_argument('--member', type=int, help='Member id')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format']
+        if file_format is None:
+            file_format = 'xlsx' if output and output.lower().endswith('.xlsx') else 'csv'
+        if file_format == 'xlsx' and not output:
+            raise CommandError('XLSX exports need --output')
+
+        params = {
+            name: options[name] for name in (
+                'payment_type', 'status', 'date_from', 'date_to', 'family', 'cohort', 'member'
+            ) if options[name] is not None
+        }
+        chunks = iter_export(export_queryset(params), file_format, chunk_size=options['chunk_size'])
+
+        if output is None:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
+            return
+        size = 0
+        with open(output, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Wrote {size} bytes to {output}'))
@@ -0,0 +1,202 @@
+import csv
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from payments.models import Family, Cohort, Member
+from payments.phone import normalize_phone_number
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+# Stands in for the id of a name that more than one family or cohort has
+AMBIGUOUS = object()
+
+# User fields whose length the database enforces; a longer value would abort the batch insert
+LIMITED_FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+def _hash_password(password):
+    # Blank passwords give the account an unusable one; members reset it to log in
+    return make_password(password or None)
+
+
+def _name_map(*row_lists):
+    """Lower-cased name -> id, or AMBIGUOUS for names shared by different rows"""
+    ids = defaultdict(set)
+    for rows in row_lists:
+        for pk, name in rows:
+            ids[str(name).strip().lower()].add(pk)
+    return {name: pks.pop() if len(pks) == 1 else AMBIGUOUS for name, pks in ids.items()}
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports members from a CSV with the columns username, phone_number and '
+        'optionally first_name, last_name, email, password, family, cohort, is_amo, is_alo'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used to hash passwords')
+        parser.add_argument('--delimiter', default=',')
+
+    def handle(self, *args, **options):
+        # Families and cohorts can be referred to by name, cohorts also by year
+        self.families = _name_map(Family.objects.values_list('id', 'name'))
+        self.cohorts = _name_map(
+            Cohort.objects.values_list('id', 'name'), Cohort.objects.values_list('id', 'year')
+        )
+
+        self.imported = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        batch_size = options['batch_size']
+        self.workers = max(1, options['workers'])
+
+        try:
+            f = open(options['path'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        # Hashing is CPU bound and deliberately slow, so it runs in other processes
+        with f, ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup) as pool:
+            reader = csv.DictReader(f, delimiter=options['delimiter'])
+            missing = {'username', 'phone_number'} - set(reader.fieldnames or [])
+            if missing:
+                raise CommandError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+
+            batch = []
+            for row in reader:
+                member = self.clean_row(reader.line_num, row)
+                if member is None:
+                    self.skipped += 1
+                    continue
+                batch.append(member)
+                if len(batch) >= batch_size:
+                    self.insert_batch(batch, pool)
+                    batch = []
+            if batch:
+                self.insert_batch(batch, pool)
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} members, skipped {self.skipped} rows '
+            f'in {elapsed:.1f}s ({self.imported / elapsed if elapsed else 0:.0f} rows/sec)'
+        ))
+
+    def clean_row(self, line, row):
+        """Validate one CSV row, returning the fields to insert or None to skip it"""
+        username = (row.get('username') or '').strip()
+        if not username:
+            self.stderr.write(f'Line {line}: missing username')
+            return None
+        try:
+            User.username_validator(username)
+        except ValidationError as e:
+            self.stderr.write(f'Line {line}: invalid username "{username}": {" ".join(e.messages)}')
+            return None
+        for field in LIMITED_FIELDS:
+            max_length = User._meta.get_field(field).max_length
+            if len((row.get(field) or '').strip()) > max_length:
+                self.stderr.write(f'Line {line}: {field} is longer than {max_length} characters')
+                return None
+        try:
+            phone_number = normalize_phone_number(row.get('phone_number') or '')
+        except ValueError as e:
+            self.stderr.write(f'Line {line}: {e}')
+            return None
+
+        lookups = {}
+        for field, names in (('family', self.families), ('cohort', self.cohorts)):
+            value = (row.get(field) or '').strip()
+            lookups[field] = names.get(value.lower()) if value else None
+            if value and lookups[field] is None:
+                self.stderr.write(f'Line {line}: unknown {field} "{value}"')
+                return None
+            if lookups[field] is AMBIGUOUS:
+                self.stderr.write(f'Line {line}: more than one {field} matches "{value}"')
+                return None
+
+        return {
+            'line': line,
+            'username': username,
+            'first_name': (row.get('first_name') or '').strip(),
+            'last_name': (row.get('last_name') or '').strip(),
+            'email': (row.get('email') or '').strip(),
+            'password': row.get('password') or '',
+            'phone_number': phone_number,
+            'family_id': lookups['family'],
+            'cohort_id': lookups['cohort'],
+            'is_amo': (row.get('is_amo') or '').strip().lower() in TRUE_VALUES,
+            'is_alo': (row.get('is_alo') or '').strip().lower() in TRUE_VALUES,
+        }
+
+    def insert_batch(self, batch, pool):
+        # Usernames and phone numbers taken by existing members or earlier rows are skipped, not overwritten
+        existing = set(
+            User.objects.filter(username__in=[row['username'] for row in batch])
+            .values_list('username', flat=True)
+        )
+        taken = set(
+            Member.objects.filter(msisdn__in=[row['phone_number'] for row in batch])
+            .values_list('msisdn', flat=True)
+        )
+        rows = []
+        for row in batch:
+            if row['username'] in existing:
+                self.stderr.write(f"Line {row['line']}: username {row['username']} already exists")
+                self.skipped += 1
+                continue
+            if row['phone_number'] in taken:
+                self.stderr.write(f"Line {row['line']}: phone number {row['phone_number']} already belongs to a member")
+                self.skipped += 1
+                continue
+            existing.add(row['username'])
+            taken.add(row['phone_number'])
+            rows.append(row)
+        if not rows:
+            return
+
+        chunksize = max(1, len(rows) // (self.workers * 4))
+        passwords = pool.map(_hash_password, [row['password'] for row in rows], chunksize=chunksize)
+        users = [
+            User(
+                username=row['username'],
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+                email=row['email'],
+                password=password,
+            )
+            for row, password in zip(rows, passwords)
+        ]
+
+        with transaction.atomic():
+            # PostgreSQL and SQLite return the new primary keys from bulk_create
+            User.objects.bulk_create(users)
+            Member.objects.bulk_create([
+                Member(
+                    user=user,
+                    phone_number=row['phone_number'],
+                    # bulk_create skips Member.save(); the number is already normalized
+                    msisdn=row['phone_number'],
+                    family_id=row['family_id'],
+                    cohort_id=row['cohort_id'],
+                    is_amo=row['is_amo'],
+                    is_alo=row['is_alo'],
+                )
+                for user, row in zip(users, rows)
+            ])
+
+        self.imported += len(rows)
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f'{self.imported} imported ({self.imported / elapsed if elapsed else 0:.0f} rows/sec)'
+        )
@@ -0,0 +1,245 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from payments.callbacks import process_inbox
+from payments.fake_daraja import FakeDarajaServer
+from payments.models import Member
+
+LOADTEST_USERNAME = 'loadtest'
+LOADTEST_PHONE = '254799000000'
+CALLBACK_PATH = '/api/payments/mpesa_callback/'
+CSRF_TOKEN = 'loadtestcsrftokenloadtestcsrftok'
+
+# name -> (method, path, body); form posts go through the login and CSRF checks
+SCENARIOS = {
+    'form': ('POST', '/initiate-payment/', {'amount': '10', 'payment_type': 'OFFERING'}),
+    'api': ('POST', '/api/payments/initiate_payment/', {
+        'phone_number': LOADTEST_PHONE, 'amount': '10', 'payment_type': 'OFFERING',
+    }),
+    'api-list': ('GET', '/api/payments/', None),
+}
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ServerStats:
+    """WSGI wrapper recording each request's server-side time and database query count by path"""
+
+    def __init__(self, app):
+        self.app = app
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        queries = []
+        start = time.perf_counter()
+        with connection.execute_wrapper(lambda execute, *args: queries.append(1) or execute(*args)):
+            response = self.app(environ, start_response)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples.setdefault(environ['PATH_INFO'], []).append((elapsed, len(queries)))
+        return response
+
+    def for_path(self, path):
+        with self.lock:
+            return list(self.samples.get(path, []))
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the payment flow end to end against a local fake Daraja server: drives the '
+        'payment form, the payments API and the M-Pesa callbacks at a target rate and reports '
+        'latency percentiles, throughput and database queries per request. Writes payments for a '
+        '"loadtest" member, so run it against a development database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help='Scenario to run, repeatable (default: all)')
+        parser.add_argument('--rps', type=float, default=20, help='Target requests per second')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per scenario')
+        parser.add_argument('--concurrency', type=int, default=32, help='Maximum requests in flight')
+        parser.add_argument('--latency', type=float, default=0.05, help='Fake Daraja response latency')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of Daraja requests answered with HTTP 500')
+        parser.add_argument('--callback-delay', type=float, default=1.0,
+                            help='Seconds between an accepted push and its callback')
+        parser.add_argument('--callback-failure-rate', type=float, default=0.1,
+                            help='Share of callbacks reporting a cancelled payment')
+
+    def handle(self, *args, **options):
+        if options['rps'] <= 0 or options['duration'] <= 0:
+            raise CommandError('--rps and --duration must be positive')
+
+        member = self.loadtest_member()
+        stats = ServerStats(get_internal_wsgi_application())
+        app_server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler, allow_reuse_address=False)
+        app_server.set_app(stats)
+        app_url = f'http://127.0.0.1:{app_server.server_address[1]}'
+        daraja = FakeDarajaServer(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            callback_delay=options['callback_delay'],
+            callback_failure_rate=options['callback_failure_rate'],
+            callback_workers=8,
+        )
+        overrides = {
+            'MPESA_BASE_URL': daraja.url,
+            'MPESA_CONSUMER_KEY': 'loadtest-key',
+            'MPESA_CONSUMER_SECRET': 'loadtest-secret',
+            'MPESA_PAYBILL': '174379',
+            'MPESA_PASSKEY': 'loadtest-passkey',
+            'MPESA_CALLBACK_URL': f'{app_url}{CALLBACK_PATH}',
+            'MPESA_ASYNC_INITIATION': False,
+            'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) + ['127.0.0.1'],
+        }
+
+        daraja.start()
+        threading.Thread(target=app_server.serve_forever, name='loadtest-app', daemon=True).start()
+        results = []
+        try:
+            with override_settings(**overrides):
+                session_key = self.login(member.user)
+                for name in options['scenario'] or list(SCENARIOS):
+                    results.append(self.run_scenario(name, app_url, session_key, stats, options))
+                callbacks = self.drain_callbacks(daraja, stats)
+        finally:
+            daraja.stop()
+            app_server.shutdown()
+            app_server.server_close()
+
+        self.report(results, callbacks, options)
+
+    def loadtest_member(self):
+        user, created = User.objects.get_or_create(username=LOADTEST_USERNAME)
+        if created:
+            user.set_unusable_password()
+            user.save(update_fields=['password'])
+        member, _ = Member.objects.get_or_create(user=user, defaults={'phone_number': LOADTEST_PHONE})
+        if member.phone_number != LOADTEST_PHONE:
+            member.phone_number = LOADTEST_PHONE
+            member.save(update_fields=['phone_number'])
+        return member
+
+    def login(self, user):
+        client = Client()
+        client.force_login(user)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def run_scenario(self, name, app_url, session_key, stats, options):
+        method, path, body = SCENARIOS[name]
+        total = max(1, int(options['rps'] * options['duration']))
+        interval = 1 / options['rps']
+        latencies = []
+        errors = []
+        local = threading.local()
+
+        def session():
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+                local.session.cookies.set(settings.CSRF_COOKIE_NAME, CSRF_TOKEN)
+                local.session.headers['X-CSRFToken'] = CSRF_TOKEN
+            return local.session
+
+        def send(scheduled):
+            try:
+                if name == 'form':
+                    response = session().post(app_url + path, data=body, allow_redirects=False, timeout=60)
+                    ok = response.status_code == 302
+                elif method == 'POST':
+                    response = requests.post(app_url + path, json=body, timeout=60)
+                    ok = response.status_code == 200
+                else:
+                    response = session().get(app_url + path, timeout=60)
+                    ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            # Measured from the scheduled start, so queueing behind slow requests counts
+            latencies.append(time.perf_counter() - scheduled)
+            if not ok:
+                errors.append(1)
+
+        before = len(stats.for_path(path))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for i in range(total):
+                scheduled = start + i * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, scheduled)
+        elapsed = time.perf_counter() - start
+        return name, total, len(errors), elapsed, latencies, stats.for_path(path)[before:]
+
+    def drain_callbacks(self, daraja, stats, timeout=60):
+        """Wait for the fake server to deliver every callback, then apply them from the inbox"""
+        deadline = time.monotonic() + timeout + daraja.callbacks.delay
+        while daraja.callbacks.pending() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        # Let the last posts in flight land
+        time.sleep(0.5)
+        start = time.perf_counter()
+        processed = 0
+        while True:
+            handled = process_inbox()
+            if not handled:
+                break
+            processed += handled
+        return {
+            'delivered': daraja.callbacks.sent,
+            'failed': daraja.callbacks.failed,
+            'processed': processed,
+            'process_seconds': time.perf_counter() - start,
+            'samples': stats.for_path(CALLBACK_PATH),
+        }
+
+    def report(self, results, callbacks, options):
+        self.stdout.write(
+            f"Target {options['rps']:g} req/s for {options['duration']:g}s per scenario, "
+            f"fake Daraja latency {options['latency'] * 1000:.0f} ms, error rate {options['error_rate']:g}"
+        )
+        self.stdout.write(
+            f"{'scenario':<12}{'requests':>9}{'errors':>8}{'req/s':>8}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'max q':>7}"
+        )
+        for name, total, errors, elapsed, latencies, samples in results:
+            self.write_row(name, total, errors, total / elapsed, latencies, samples)
+
+        samples = callbacks['samples']
+        self.write_row(
+            'callback', len(samples), callbacks['failed'], None,
+            [elapsed for elapsed, _ in samples], samples,
+        )
+        self.stdout.write(
+            f"Callbacks: {callbacks['delivered']} delivered, {callbacks['failed']} failed, "
+            f"{callbacks['processed']} applied from the inbox in {callbacks['process_seconds']:.2f}s"
+        )
+        self.stdout.write('Latency is client-side (server-side for callbacks); queries are per request.')
+
+    def write_row(self, name, total, errors, rate, latencies, samples):
+        queries = [count for _, count in samples]
+        average = sum(queries) / len(queries) if queries else 0
+        self.stdout.write(
+            f"{name:<12}{total:>9}{errors:>8}{(f'{rate:.1f}' if rate is not None else '-'):>8}"
+            f"{percentile(latencies, 0.50) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.99) * 1000:>9.1f}{average:>9.1f}{max(queries, default=0):>7}"
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from payments.partitioning import ensure_partitions, is_partitioned, partition_payments_table
+
+
+class Command(BaseCommand):
+    help = (
+        'Converts the payments table to monthly range partitions on payment_date (PostgreSQL), '
+        'or on an already partitioned table creates the partitions for the coming months'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Months after the current one to create partitions for')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning the payments table needs PostgreSQL')
+        if options['months_ahead'] < 0:
+            raise CommandError('--months-ahead cannot be negative')
+
+        if is_partitioned():
+            created = ensure_partitions(options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(f'Created {created} monthly partitions'))
+            return
+
+        self.stdout.write('Partitioning payments; writes to them wait until this finishes')
+        try:
+            copied = partition_payments_table(options['months_ahead'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied {copied} payments into the partitioned table. The original is kept as '
+            f'payments_payment_legacy; drop it once the data is verified.'
+        ))
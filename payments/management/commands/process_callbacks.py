@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from payments.callbacks import process_inbox, retry_failed_callbacks
+from payments.partitioning import maintain_partitions
+
+# Seconds between checks that next months' payment partitions exist
+PARTITION_CHECK_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = 'Applies received M-Pesa callbacks from the inbox to payments in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the inbox is empty instead of polling')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Process callbacks that failed before again, e.g. once their member exists')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f'Retrying {retry_failed_callbacks()} failed callbacks')
+        total = 0
+        next_partition_check = 0
+        try:
+            while True:
+                # As between requests: drop broken or expired connections, hand pooled ones back
+                close_old_connections()
+                if time.monotonic() >= next_partition_check:
+                    # Always running, so it keeps partitions ahead of the payments they will hold
+                    created = maintain_partitions()
+                    if created:
+                        self.stdout.write(f'Created {created} monthly payment partitions')
+                    next_partition_check = time.monotonic() + PARTITION_CHECK_INTERVAL
+                handled = process_inbox(options['batch_size'])
+                total += handled
+                if handled:
+                    self.stdout.write(f'Processed {handled} callbacks')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} callbacks in total'))
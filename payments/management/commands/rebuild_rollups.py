@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from payments.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the contribution rollups from the full payment history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        total = rebuild_rollups(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {total} rollup buckets'))
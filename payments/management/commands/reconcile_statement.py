@@ -0,0 +1,67 @@
+import time
+from collections import Counter
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from payments.models import ReconciliationRun
+from payments.reconciliation import Reconciler, read_statement
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconciles payments against an M-Pesa paybill statement export (CSV), recording '
+        'missing callbacks, orphan receipts, amount mismatches and ambiguous matches as reconciliation items'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the statement CSV')
+        parser.add_argument('--window', type=float, default=10,
+                            help='Minutes between a push and its statement line for them to be paired')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Statement lines per query')
+        parser.add_argument('--apply', action='store_true',
+                            help='Mark pushes whose callback never arrived as COMPLETED with their receipt; '
+                                 'ambiguous matches are never applied')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['window'] <= 0:
+            raise CommandError('--batch-size and --window must be positive')
+
+        run = ReconciliationRun.objects.create(source=options['statement'][:255])
+        reconciler = Reconciler(
+            run,
+            window=timedelta(minutes=options['window']),
+            batch_size=options['batch_size'],
+            apply=options['apply'],
+        )
+        stats = Counter()
+        start = time.perf_counter()
+        try:
+            with open(options['statement'], newline='', encoding='utf-8-sig') as statement:
+                counts = reconciler.reconcile(read_statement(statement, stats))
+        except (OSError, ValueError) as e:
+            run.delete()
+            raise CommandError(f"Could not read {options['statement']}: {e}")
+        elapsed = time.perf_counter() - start
+
+        run.finished_at = timezone.now()
+        run.rows_read = stats['rows']
+        run.matched = counts['matched']
+        run.missing_callbacks = counts['MISSING_CALLBACK']
+        run.orphan_receipts = counts['ORPHAN_RECEIPT']
+        run.amount_mismatches = counts['AMOUNT_MISMATCH']
+        run.ambiguous_matches = counts['AMBIGUOUS_MATCH']
+        run.save()
+
+        self.stdout.write(
+            f"Read {stats['rows']} statement rows in {elapsed:.1f}s "
+            f"({stats['rows'] / elapsed if elapsed else 0:.0f} rows/sec), "
+            f"skipped {stats['skipped']} that are not completed credits"
+        )
+        self.stdout.write(f'Matched:            {run.matched}')
+        self.stdout.write(f'Missing callbacks:  {run.missing_callbacks}')
+        self.stdout.write(f'Orphan receipts:    {run.orphan_receipts}')
+        self.stdout.write(f'Amount mismatches:  {run.amount_mismatches}')
+        self.stdout.write(f'Ambiguous matches:  {run.ambiguous_matches}')
+        if options['apply']:
+            self.stdout.write(f'Completed {reconciler.repaired} payments from their statement lines')
+        self.stdout.write(self.style.SUCCESS(f'Recorded as reconciliation run {run.pk}'))
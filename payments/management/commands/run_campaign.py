@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payments.campaigns import populate_recipients, run_campaign
+from payments.models import Campaign
+from payments.mpesa import MpesaClient
+
+
+class Command(BaseCommand):
+    help = 'Sends a campaign STK push to every member it targets, resuming any earlier run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int)
+        parser.add_argument('--concurrency', type=int,
+                            default=getattr(settings, 'CAMPAIGN_CONCURRENCY', 4),
+                            help='Pushes in flight at once')
+        parser.add_argument('--rate', type=float,
+                            default=getattr(settings, 'CAMPAIGN_RATE_LIMIT', 5.0),
+                            help='Maximum pushes per second across all threads')
+        parser.add_argument('--report-interval', type=float, default=5.0,
+                            help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        try:
+            campaign = Campaign.objects.get(pk=options['campaign_id'])
+        except Campaign.DoesNotExist:
+            raise CommandError(f"Campaign {options['campaign_id']} does not exist")
+        if campaign.status == 'COMPLETED':
+            raise CommandError(f'Campaign "{campaign.name}" has already completed')
+
+        if campaign.status == 'DRAFT':
+            total = populate_recipients(campaign)
+            self.stdout.write(f'Queued {total} recipients for "{campaign.name}"')
+
+        progress = run_campaign(
+            campaign,
+            MpesaClient(),
+            concurrency=max(1, options['concurrency']),
+            rate=options['rate'],
+            report=self.stdout.write,
+            report_interval=options['report_interval'],
+        )
+        self.stdout.write(self.style.SUCCESS(progress.summary()))
@@ -0,0 +1,111 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from payments.jobs import claim_jobs, release_stale_jobs, run_job
+from payments.mpesa import MpesaClient
+from payments.resilience import DarajaUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Longest pause between attempts to build the client while M-Pesa is unreachable
+MAX_CLIENT_BACKOFF = 60
+
+
+def worker_loop(worker_id, batch_size, poll_interval, max_attempts, once):
+    """Drain the STK push queue until told to stop"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *args: stopping.append(True))
+
+    client = None
+    backoff = poll_interval
+    while not stopping:
+        if client is None:
+            # No jobs are claimed without a client, so none use an attempt while Daraja is down
+            client, retry_after = _build_client()
+            if client is None:
+                if once:
+                    break
+                backoff = min(max(backoff * 2, retry_after), MAX_CLIENT_BACKOFF)
+                time.sleep(backoff)
+                continue
+            backoff = poll_interval
+        # As between requests: drop broken or expired connections, hand pooled ones back
+        close_old_connections()
+        jobs = claim_jobs(worker_id, batch_size)
+        if not jobs:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        for job in jobs:
+            run_job(job, client, max_attempts)
+
+
+def _build_client():
+    """Return (client, 0), or (None, seconds to wait) while M-Pesa cannot be reached"""
+    try:
+        return MpesaClient(), 0
+    except DarajaUnavailable as e:
+        logger.warning("M-Pesa unavailable, not claiming STK push jobs: %s", e)
+        return None, e.retry_after
+    except Exception:
+        logger.exception("Could not build the M-Pesa client, not claiming STK push jobs")
+        return None, 0
+
+
+class Command(BaseCommand):
+    help = 'Runs worker processes that send queued STK push jobs to M-Pesa'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'STK_WORKERS', 2))
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--max-attempts', type=int, default=3)
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Seconds after which a RUNNING job is considered abandoned')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling')
+
+    def handle(self, *args, **options):
+        released = release_stale_jobs(options['stale_after'])
+        if released:
+            self.stdout.write(f'Marked {released} abandoned jobs UNCERTAIN')
+
+        # Children must open their own database connections
+        connections.close_all()
+
+        host = socket.gethostname()
+        processes = []
+        for index in range(options['workers']):
+            worker_id = f'{host}:{os.getpid()}:{index}'
+            process = multiprocessing.Process(
+                target=worker_loop,
+                args=(worker_id, options['batch_size'], options['poll_interval'],
+                      options['max_attempts'], options['once']),
+                name=f'stk-worker-{index}',
+            )
+            process.start()
+            processes.append(process)
+        self.stdout.write(self.style.SUCCESS(f'Started {len(processes)} STK push workers'))
+
+        def stop(*args):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            stop()
+            for process in processes:
+                process.join()
+        self.stdout.write('STK push workers stopped')
@@ -0,0 +1,220 @@
+import contextvars
+import threading
+import time
+
+# Seconds; Daraja calls regularly take over a second, so the buckets run long
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        # labels -> [per-bucket counts, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'{self.name}_bucket{_labels(self.label_names, labels, [("le", bound)])} {cumulative}'
+                    )
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {count}')
+        return lines
+
+
+REQUESTS = Counter('http_requests_total', 'Requests handled, by view, method and status',
+                   labels=('view', 'method', 'status'))
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Wall time spent in each view',
+                             labels=('view',))
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', 'Database queries run per request',
+                               labels=('view',), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_DURATION = Histogram('http_request_db_duration_seconds', 'Database time per request',
+                                labels=('view',))
+DARAJA_REQUESTS = Counter('daraja_requests_total', 'Calls made to the Daraja API, by endpoint and status',
+                          labels=('endpoint', 'status'))
+DARAJA_DURATION = Histogram('daraja_request_duration_seconds', 'Latency of calls to the Daraja API',
+                            labels=('endpoint',))
+
+METRICS = [REQUESTS, REQUEST_DURATION, REQUEST_DB_QUERIES, REQUEST_DB_DURATION, DARAJA_REQUESTS, DARAJA_DURATION]
+
+
+class RequestStats:
+    """What one request spent on the database and on Daraja"""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.daraja_calls = 0
+        self.daraja_seconds = 0.0
+
+
+# Set by RequestMetricsMiddleware; contextvars follow sync_to_async into its threads
+current_request = contextvars.ContextVar('payments_request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper installed on every connection; a no-op outside requests"""
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_seconds += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver adding record_query to each new connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_daraja_call(endpoint, status, seconds):
+    DARAJA_REQUESTS.inc(endpoint, status)
+    DARAJA_DURATION.observe(seconds, endpoint)
+    stats = current_request.get()
+    if stats is not None:
+        stats.daraja_calls += 1
+        stats.daraja_seconds += seconds
+
+
+def _pool_lines():
+    from .transport import get_transport
+    gauges = {
+        'daraja_pool_maxsize': ('maxsize', 'Connection pool size per Daraja host'),
+        'daraja_pool_connections_in_use': ('in_use', 'Pooled connections checked out'),
+        'daraja_pool_connections_idle': ('idle', 'Open pooled connections waiting for reuse'),
+    }
+    counters = {
+        'daraja_pool_new_connections_total': ('new_connections', 'Connections opened to Daraja'),
+        'daraja_pool_reused_connections_total': ('reused_connections', 'Requests served on a kept-alive connection'),
+    }
+    pools = get_transport().pool_stats()
+    lines = []
+    for kind, metrics in (('gauge', gauges), ('counter', counters)):
+        for name, (key, help) in metrics.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(("host",), (pool["host"],))} {pool[key]}' for pool in pools]
+    return lines
+
+
+def _replica_lines():
+    from .routers import replica_health
+    health = replica_health()
+    lines = [
+        '# HELP db_replica_up Whether the read replica passed its last health check',
+        '# TYPE db_replica_up gauge',
+    ]
+    lines += [f'db_replica_up{_labels(("alias",), (alias,))} {int(usable)}' for alias, (usable, _) in health.items()]
+    lines += [
+        '# HELP db_replica_lag_seconds Replication lag seen by the last health check',
+        '# TYPE db_replica_lag_seconds gauge',
+    ]
+    lines += [
+        f'db_replica_lag_seconds{_labels(("alias",), (alias,))} {lag}'
+        for alias, (_, lag) in health.items() if lag is not None
+    ]
+    return lines
+
+
+def _db_pool_lines():
+    from django.db import connections
+    gauges = {
+        'db_pool_max_size': ('pool_max', 'Most connections the pool of this worker may open'),
+        'db_pool_size': ('pool_size', 'Connections the pool holds, in use or idle'),
+        'db_pool_available': ('pool_available', 'Idle connections ready to be handed out'),
+        'db_pool_requests_waiting': ('requests_waiting', 'Requests currently waiting for a connection'),
+    }
+    counters = {
+        'db_pool_requests_total': ('requests_num', 'Connections requested from the pool'),
+        'db_pool_requests_queued_total': ('requests_queued', 'Requests that had to wait for a connection'),
+        'db_pool_requests_errors_total': ('requests_errors', 'Requests that timed out or failed to get a connection'),
+        'db_pool_connections_total': ('connections_num', 'Connections the pool opened to the database'),
+    }
+    pools = []
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is not None:
+            pools.append((alias, pool.get_stats()))
+    lines = []
+    for kind, metrics in (('gauge', gauges), ('counter', counters)):
+        for name, (key, help) in metrics.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(("alias",), (alias,))} {stats.get(key, 0)}' for alias, stats in pools]
+    # Time spent waiting is the signal that a pool is too small for its worker
+    lines += [
+        '# HELP db_pool_wait_seconds_total Time requests spent waiting for a pooled connection',
+        '# TYPE db_pool_wait_seconds_total counter',
+    ]
+    lines += [
+        f'db_pool_wait_seconds_total{_labels(("alias",), (alias,))} {stats.get("requests_wait_ms", 0) / 1000}'
+        for alias, stats in pools
+    ]
+    return lines
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _pool_lines()
+    lines += _replica_lines()
+    lines += _db_pool_lines()
+    return '\n'.join(lines) + '\n'
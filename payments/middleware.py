@@ -0,0 +1,117 @@
+import json
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import (
+    REQUESTS, REQUEST_DB_DURATION, REQUEST_DB_QUERIES, REQUEST_DURATION, RequestStats, current_request
+)
+from .routers import PIN_COOKIE, end_request, start_request
+
+logger = logging.getLogger('payments.requests')
+
+
+class RequestMetricsMiddleware:
+    """
+    Times every request and counts its database queries and Daraja calls.
+
+    The totals feed the Prometheus metrics served at /metrics and, when the
+    ``payments.requests`` logger is enabled at INFO, one JSON log line per
+    request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.finish(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.finish(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def finish(self, request, response, stats, elapsed):
+        # The URL pattern name keeps label cardinality bounded, unlike the raw path
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else '<unmatched>'
+        REQUESTS.inc(view, request.method, str(response.status_code))
+        REQUEST_DURATION.observe(elapsed, view)
+        REQUEST_DB_QUERIES.observe(stats.db_queries, view)
+        REQUEST_DB_DURATION.observe(stats.db_seconds, view)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'event': 'request',
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                'db_queries': stats.db_queries,
+                'db_ms': round(stats.db_seconds * 1000, 2),
+                'daraja_calls': stats.daraja_calls,
+                'daraja_ms': round(stats.daraja_seconds * 1000, 2),
+            }))
+
+
+class PrimaryPinMiddleware:
+    """
+    Keeps a client that wrote reading from the primary until replicas catch up.
+
+    Routing state lives for one request; a request that writes sets a
+    cookie so the client's requests in the next REPLICA_PIN_SECONDS (such
+    as the page a form redirects to) skip the replicas too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = start_request(request.COOKIES.get(PIN_COOKIE))
+        try:
+            response = self.get_response(request)
+        finally:
+            state = end_request(token)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        token = start_request(request.COOKIES.get(PIN_COOKIE))
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = end_request(token)
+        return self.pin(response, state)
+
+    def pin(self, response, state):
+        if state.wrote and getattr(settings, 'DATABASE_REPLICAS', ()):
+            seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+            response.set_cookie(PIN_COOKIE, f'{time.time() + seconds:.0f}', max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
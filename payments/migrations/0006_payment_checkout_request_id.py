@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+def backfill_request_ids(apps, schema_editor):
+    """Copy Daraja ids from accepted STK push jobs onto their pending payments"""
+    StkPushJob = apps.get_model('payments', 'StkPushJob')
+    Payment = apps.get_model('payments', 'Payment')
+    jobs = StkPushJob.objects.filter(status='SUCCEEDED', payment__status='PENDING')
+    for job in jobs.iterator():
+        response = job.response or {}
+        checkout_request_id = response.get('CheckoutRequestID')
+        if not checkout_request_id:
+            continue
+        Payment.objects.filter(pk=job.payment_id).update(
+            checkout_request_id=checkout_request_id,
+            merchant_request_id=response.get('MerchantRequestID'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_callbackinbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='merchant_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('EXPIRED', 'Expired')], default='PENDING', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['payment_date'], name='payment_pending_date_idx'),
+        ),
+        migrations.RunPython(backfill_request_ids, migrations.RunPython.noop),
+    ]
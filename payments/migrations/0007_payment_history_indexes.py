@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_payment_checkout_request_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['phone_number'], name='member_phone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['member', '-payment_date'], include=('payment_type', 'status', 'amount', 'mpesa_receipt_number'), name='payment_member_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['member', 'payment_type', '-payment_date'], name='payment_member_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['member', 'status', '-payment_date'], name='payment_member_status_date_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_payment_history_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_member_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_member_type_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_member_status_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['member', '-payment_date', '-id'], include=('payment_type', 'status', 'amount', 'mpesa_receipt_number'), name='payment_member_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['member', 'payment_type', '-payment_date', '-id'], name='payment_member_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['member', 'status', '-payment_date', '-id'], name='payment_member_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-payment_date', '-id'], name='payment_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContributionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('ALL', 'All payments'), ('MEMBER', 'Member'), ('FAMILY', 'Family'), ('COHORT', 'Cohort'), ('PAYMENT_TYPE', 'Payment type'), ('MISSION_TYPE', 'Mission payment type')], max_length=20)),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('MONTH', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('key', models.CharField(blank=True, max_length=50)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payment_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'period', 'period_start', 'key'), name='contributionrollup_bucket_unique')],
+            },
+        ),
+    ]
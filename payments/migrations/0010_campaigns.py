@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_contributionrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('payment_type', models.CharField(choices=[('OFFERING', 'Offering'), ('TITHE', 'Tithe'), ('CONTRIBUTION', 'Contribution'), ('MISSION', 'Mission'), ('LUNCH', 'Lunch Money'), ('FUNDRAISING', 'Fundraising')], default='MISSION', max_length=20)),
+                ('mission_payment_type', models.CharField(blank=True, choices=[('20_BOB', '20 Bob Challenge'), ('50_BOB', '50 Bob Challenge'), ('COHORT', 'Cohort Payment'), ('FAMILY', 'Family Payment'), ('MINI_FUNDRAISER', 'Mini Fundraiser '), ('MUSIC_CONCERT', 'music concert'), ('MEGA_FUNDRAISER', 'Mega Fundraiser')], max_length=20, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('account_reference', models.CharField(default='MMUSDA', max_length=50)),
+                ('amo_only', models.BooleanField(default=False)),
+                ('alo_only', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('RUNNING', 'Running'), ('COMPLETED', 'Completed')], default='DRAFT', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('cohort', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='payments.cohort')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('family', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='payments.family')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CampaignRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('SENDING', 'Sending'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='QUEUED', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='payments.campaign')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.member')),
+                ('payment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='campaign_recipient', to='payments.payment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['campaign', 'status', 'id'], name='campaignrecipient_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'member'), name='campaignrecipient_unique')],
+            },
+        ),
+    ]
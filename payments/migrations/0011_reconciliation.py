@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_campaigns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('MISSING_CALLBACK', 'Missing callback'), ('ORPHAN_RECEIPT', 'Orphan receipt'), ('AMOUNT_MISMATCH', 'Amount mismatch')], max_length=20)),
+                ('receipt_number', models.CharField(max_length=100)),
+                ('transaction_time', models.DateTimeField(blank=True, null=True)),
+                ('statement_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('other_party', models.CharField(blank=True, max_length=255)),
+                ('payment_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('resolved', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('rows_read', models.PositiveIntegerField(default=0)),
+                ('matched', models.PositiveIntegerField(default=0)),
+                ('missing_callbacks', models.PositiveIntegerField(default=0)),
+                ('orphan_receipts', models.PositiveIntegerField(default=0)),
+                ('amount_mismatches', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['mpesa_receipt_number'], name='payment_receipt_idx'),
+        ),
+        migrations.AddField(
+            model_name='reconciliationitem',
+            name='payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='payments.payment'),
+        ),
+        migrations.AddField(
+            model_name='reconciliationitem',
+            name='run',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='payments.reconciliationrun'),
+        ),
+        migrations.AddIndex(
+            model_name='reconciliationitem',
+            index=models.Index(fields=['run', 'kind', 'resolved'], name='reconitem_run_kind_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reconciliationitem',
+            index=models.Index(fields=['receipt_number'], name='reconitem_receipt_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_reconciliation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='member',
+            name='member_phone_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_receipt_idx',
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['phone_number'], name='member_phone_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['mpesa_receipt_number'], name='payment_receipt_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
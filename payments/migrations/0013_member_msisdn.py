@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0012_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='member',
+            name='member_phone_idx',
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='msisdn',
+            field=models.CharField(blank=True, editable=False, max_length=12, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0013_member_msisdn'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stkpushjob',
+            name='status',
+            field=models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed'), ('UNCERTAIN', 'Uncertain')], default='QUEUED', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0014_stkpushjob_uncertain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reconciliationrun',
+            name='ambiguous_matches',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='reconciliationitem',
+            name='kind',
+            field=models.CharField(choices=[('MISSING_CALLBACK', 'Missing callback'), ('ORPHAN_RECEIPT', 'Orphan receipt'), ('AMOUNT_MISMATCH', 'Amount mismatch'), ('AMBIGUOUS_MATCH', 'Ambiguous match')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+from payments.phone import to_msisdn
+
+BATCH_SIZE = 2000
+
+
+def backfill_msisdn(apps, schema_editor):
+    """
+    Fill Member.msisdn for members saved before it existed.
+
+    As backfill_msisdn does: invalid numbers and numbers already held by
+    another member are left empty, the lowest member id keeping a number.
+    """
+    Member = apps.get_model('payments', 'Member')
+    held = set(Member.objects.exclude(msisdn=None).values_list('msisdn', flat=True))
+    last_id = 0
+    while True:
+        members = list(
+            Member.objects.filter(id__gt=last_id, msisdn=None).order_by('id')
+            .only('id', 'phone_number')[:BATCH_SIZE]
+        )
+        if not members:
+            return
+        last_id = members[-1].id
+        changed = []
+        for member in members:
+            msisdn = to_msisdn(member.phone_number)
+            if msisdn is not None and msisdn not in held:
+                held.add(msisdn)
+                member.msisdn = msisdn
+                changed.append(member)
+        Member.objects.bulk_update(changed, ['msisdn'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0015_reconciliation_ambiguous_matches'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_msisdn, migrations.RunPython.noop),
+    ]
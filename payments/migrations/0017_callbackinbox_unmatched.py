@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0016_backfill_member_msisdn'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='callbackinbox',
+            name='status',
+            field=models.CharField(choices=[('RECEIVED', 'Received'), ('PROCESSED', 'Processed'), ('FAILED', 'Failed'), ('UNMATCHED', 'Unmatched')], default='RECEIVED', max_length=20),
+        ),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+import logging
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .phone import to_msisdn
+
+logger = logging.getLogger(__name__)
 
 class Family(models.Model):
     name = models.CharField(max_length=100)
@@ -24,12 +29,53 @@ class Member(models.Model):
     family = models.ForeignKey(Family, on_delete=models.SET_NULL, null=True)
     cohort = models.ForeignKey(Cohort, on_delete=models.SET_NULL, null=True)
     phone_number = models.CharField(max_length=15)
+    # phone_number as 254XXXXXXXXX, kept in step by save(); NULL while the
+    # number is not a valid Kenyan one or another member holds it. Members
+    # are resolved by phone on it.
+    msisdn = models.CharField(max_length=12, unique=True, null=True, blank=True, editable=False)
     is_amo = models.BooleanField(default=False)
     is_alo = models.BooleanField(default=False)
 
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.family}"
 
+    def free_msisdn(self):
+        """
+        msisdn for phone_number, or None when another member already holds it.
+
+        Members left without one by the backfill share a number with an
+        older member; saving them must not fail on the unique index.
+        Forms reject such numbers before they get here.
+        """
+        msisdn = to_msisdn(self.phone_number)
+        if msisdn is not None and Member.objects.filter(msisdn=msisdn).exclude(pk=self.pk).exists():
+            logger.warning(
+                "Phone number %s of member %s belongs to another member, leaving msisdn empty",
+                msisdn, self.pk,
+            )
+            return None
+        return msisdn
+
+    def save(self, *args, **kwargs):
+        from .rollups import move_member_rollups
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'phone_number' in update_fields:
+            self.msisdn = self.free_msisdn()
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'msisdn'}
+        if self._state.adding or (
+            update_fields is not None and not {'family', 'family_id', 'cohort', 'cohort_id'} & set(update_fields)
+        ):
+            super().save(*args, **kwargs)
+            return
+        # Family and cohort totals follow the member, in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            before = Member.objects.select_for_update().filter(pk=self.pk).values('family_id', 'cohort_id').first()
+            super().save(*args, **kwargs)
+            if before is not None:
+                move_member_rollups(self.pk, before, {'family_id': self.family_id, 'cohort_id': self.cohort_id})
+
 class PaymentCategory(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
@@ -40,6 +86,9 @@ class PaymentCategory(models.Model):
     def __str__(self):
         return self.name
 
+# Payment fields that decide which rollup buckets a COMPLETED payment counts in
+ROLLUP_FIELDS = {'status', 'amount', 'payment_date', 'payment_type', 'mission_payment_type', 'member', 'member_id'}
+
 class Payment(models.Model):
     PAYMENT_TYPES = [
         ('OFFERING', 'Offering'),
@@ -60,14 +109,290 @@ class Payment(models.Model):
         ('MEGA_FUNDRAISER', 'Mega Fundraiser'),
     ]
 
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+        ('EXPIRED', 'Expired'),
+    ]
+
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
     payment_type = models.CharField(max_length=20, choices=PAYMENT_TYPES)
     mission_payment_type = models.CharField(max_length=20, choices=MISSION_PAYMENT_TYPES, null=True, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_id = models.CharField(max_length=100, unique=True)
     payment_date = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20, default='PENDING')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     mpesa_receipt_number = models.CharField(max_length=100, blank=True)
+    # Identifiers Daraja returns for an STK push and repeats in its callback
+    merchant_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # dashboard and payment_history: a member's payments newest first,
+            # carrying the listed columns so PostgreSQL can answer from the index
+            models.Index(
+                fields=['member', '-payment_date', '-id'],
+                include=['payment_type', 'status', 'amount', 'mpesa_receipt_number'],
+                name='payment_member_date_idx',
+            ),
+            # payment_history filtered by type or by status
+            models.Index(fields=['member', 'payment_type', '-payment_date', '-id'], name='payment_member_type_date_idx'),
+            models.Index(fields=['member', 'status', '-payment_date', '-id'], name='payment_member_status_date_idx'),
+            # Keyset pagination over all payments in the API
+            models.Index(fields=['-payment_date', '-id'], name='payment_date_id_idx'),
+            # Statement reconciliation looks payments up by M-Pesa receipt; the
+            # pattern opclass also serves the admin's prefix search on it
+            models.Index(fields=['mpesa_receipt_number'], name='payment_receipt_idx', opclasses=['varchar_pattern_ops']),
+            # Lets the expiry sweep reach stale pending rows without a table scan
+            models.Index(
+                fields=['payment_date'],
+                condition=models.Q(status='PENDING'),
+                name='payment_pending_date_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.member} - {self.payment_type} - {self.amount}" 
+
+    def save(self, *args, **kwargs):
+        """
+        Save, keeping the contribution rollups in step.
+
+        A payment saved into, out of or while COMPLETED moves its rollup
+        buckets in the same transaction; queryset updates that complete
+        payments call record_completed_payments themselves.
+        """
+        from .rollups import record_payment_change
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not ROLLUP_FIELDS & set(update_fields):
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic(using=kwargs.get('using')):
+            before = None
+            if not self._state.adding:
+                before = (
+                    Payment.objects.select_for_update().select_related('member')
+                    .filter(pk=self.pk).first()
+                )
+            super().save(*args, **kwargs)
+            record_payment_change(before, self)
+
+class StkPushJob(models.Model):
+    """A queued STK push for a PENDING payment, drained by run_stk_workers"""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+        # Sent, but the answer was lost; settled by its callback or a statement, never re-sent
+        ('UNCERTAIN', 'Uncertain'),
+    ]
+
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='stk_job')
+    phone_number = models.CharField(max_length=15)
+    account_reference = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='stkjob_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"STK job {self.pk} - {self.status}"
+
+
+class CallbackInbox(models.Model):
+    """Raw M-Pesa callback as delivered, stored before any processing"""
+    STATUS_CHOICES = [
+        ('RECEIVED', 'Received'),
+        ('PROCESSED', 'Processed'),
+        ('FAILED', 'Failed'),
+        # A failed push with no payment to mark, kept for reconciliation
+        ('UNMATCHED', 'Unmatched'),
+    ]
+
+    # Safaricom retries deliveries, the unique key turns repeats into no-ops
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RECEIVED')
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Callback inbox"
+        indexes = [
+            models.Index(fields=['status', 'id'], name='callbackinbox_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.checkout_request_id or self.pk} - {self.status}"
+
+
+class ContributionRollup(models.Model):
+    """Running total of COMPLETED payments for one dimension value in one day or month"""
+    PERIOD_CHOICES = [
+        ('DAY', 'Day'),
+        ('MONTH', 'Month'),
+    ]
+
+    DIMENSION_CHOICES = [
+        ('ALL', 'All payments'),
+        ('MEMBER', 'Member'),
+        ('FAMILY', 'Family'),
+        ('COHORT', 'Cohort'),
+        ('PAYMENT_TYPE', 'Payment type'),
+        ('MISSION_TYPE', 'Mission payment type'),
+    ]
+
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    # Member/family/cohort id or payment type code, empty for ALL
+    key = models.CharField(max_length=50, blank=True)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dimension', 'period', 'period_start', 'key'],
+                name='contributionrollup_bucket_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension} {self.key} {self.period} {self.period_start}: {self.total_amount}"
+
+
+class Campaign(models.Model):
+    """An STK push sent to every member of a target group, run by run_campaign"""
+    STATUS_CHOICES = [
+        ('DRAFT', 'Draft'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payment_type = models.CharField(max_length=20, choices=Payment.PAYMENT_TYPES, default='MISSION')
+    mission_payment_type = models.CharField(
+        max_length=20, choices=Payment.MISSION_PAYMENT_TYPES, null=True, blank=True
+    )
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    account_reference = models.CharField(max_length=50, default='MMUSDA')
+    # Target set: members matching every filter that is set
+    family = models.ForeignKey(Family, on_delete=models.SET_NULL, null=True, blank=True)
+    cohort = models.ForeignKey(Cohort, on_delete=models.SET_NULL, null=True, blank=True)
+    amo_only = models.BooleanField(default=False)
+    alo_only = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='DRAFT')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def target_members(self):
+        members = Member.objects.all()
+        if self.family_id:
+            members = members.filter(family_id=self.family_id)
+        if self.cohort_id:
+            members = members.filter(cohort_id=self.cohort_id)
+        if self.amo_only:
+            members = members.filter(is_amo=True)
+        if self.alo_only:
+            members = members.filter(is_alo=True)
+        return members
+
+    def __str__(self):
+        return f"{self.name} - {self.status}"
+
+
+class CampaignRecipient(models.Model):
+    """One member's STK push within a campaign; its state lets a stopped run resume"""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+        # May have been prompted without the answer being stored; settled by its callback, never re-sent
+        ('UNCERTAIN', 'Uncertain'),
+    ]
+
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='recipients')
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    payment = models.OneToOneField(
+        Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='campaign_recipient'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'member'], name='campaignrecipient_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['campaign', 'status', 'id'], name='campaignrecipient_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.campaign_id} - {self.member_id} - {self.status}"
+
+
+class ReconciliationRun(models.Model):
+    """One reconcile_statement pass over a paybill statement export"""
+    source = models.CharField(max_length=255)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows_read = models.PositiveIntegerField(default=0)
+    matched = models.PositiveIntegerField(default=0)
+    missing_callbacks = models.PositiveIntegerField(default=0)
+    orphan_receipts = models.PositiveIntegerField(default=0)
+    amount_mismatches = models.PositiveIntegerField(default=0)
+    ambiguous_matches = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.source} - {self.started_at:%Y-%m-%d %H:%M}"
+
+
+class ReconciliationItem(models.Model):
+    """A statement line that disagrees with the payments table, to be repaired"""
+    KIND_CHOICES = [
+        ('MISSING_CALLBACK', 'Missing callback'),
+        ('ORPHAN_RECEIPT', 'Orphan receipt'),
+        ('AMOUNT_MISMATCH', 'Amount mismatch'),
+        # Unsettled pushes fit the line but none is by its other party
+        ('AMBIGUOUS_MATCH', 'Ambiguous match'),
+    ]
+
+    run = models.ForeignKey(ReconciliationRun, on_delete=models.CASCADE, related_name='items')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    receipt_number = models.CharField(max_length=100)
+    transaction_time = models.DateTimeField(null=True, blank=True)
+    statement_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    other_party = models.CharField(max_length=255, blank=True)
+    # The payment the line belongs to, when one was found
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)
+    payment_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    resolved = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'kind', 'resolved'], name='reconitem_run_kind_idx'),
+            models.Index(fields=['receipt_number'], name='reconitem_receipt_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.member} - {self.payment_type} - {self.amount}" 
\ No newline at end of file
+        return f"{self.kind} - {self.receipt_number}"
@@ -1,12 +1,59 @@
 import requests
 import base64
 import json
+import logging
+import time
 from datetime import datetime
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from .token_store import get_token_store
+from .transport import get_transport, may_have_been_received
+from .phone import normalize_phone_number
+from .resilience import DarajaUnavailable, get_circuit_breaker, get_rate_limiter, is_upstream_failure
+
+logger = logging.getLogger(__name__)
+
+# Never written to logs: the STK password is derived from the passkey
+REDACTED_FIELDS = ('Password',)
+PHONE_FIELDS = ('PartyA', 'PhoneNumber')
+
+# Status query error meaning the customer has not answered the prompt yet
+STK_QUERY_PENDING_ERROR = '500.001.1001'
+
+
+class StkPushOutcomeUnknown(Exception):
+    """An STK push Daraja may have accepted without us seeing its answer; sending it again could prompt twice"""
+
+
+def redact_payload(payload):
+    """Copy of an STK push payload that is safe to log"""
+    redacted = dict(payload)
+    for field in REDACTED_FIELDS:
+        if field in redacted:
+            redacted[field] = '***'
+    for field in PHONE_FIELDS:
+        value = str(redacted.get(field) or '')
+        if len(value) > 6:
+            redacted[field] = f'{value[:5]}***{value[-3:]}'
+    return redacted
+
 
 class MpesaClient:
     def __init__(self):
+        self.configure()
+
+        # Fail early on bad credentials; calls look the token up again each time
+        try:
+            self.get_access_token()
+        except DarajaUnavailable:
+            raise
+        except Exception as e:
+            raise ImproperlyConfigured(
+                f"Failed to get M-Pesa access token. Please check your credentials. Error: {str(e)}"
+            )
+
+    def configure(self):
+        """Load and validate M-Pesa settings"""
         # Check for required settings
         self.consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', None)
         self.consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', None)
@@ -15,7 +62,7 @@ class MpesaClient:
         self.callback_url = getattr(settings, 'MPESA_CALLBACK_URL', None)
         
         # Base URLs
-        self.base_url = "https://sandbox.safaricom.co.ke"
+        self.base_url = getattr(settings, 'MPESA_BASE_URL', "https://sandbox.safaricom.co.ke").rstrip('/')
         
         # Validate required settings
         if not all([self.consumer_key, self.consumer_secret, self.paybill, self.passkey]):
@@ -23,31 +70,73 @@ class MpesaClient:
                 "Missing M-Pesa configuration. Please ensure MPESA_CONSUMER_KEY, "
                 "MPESA_CONSUMER_SECRET, MPESA_PAYBILL, and MPESA_PASSKEY are set in your settings."
             )
-        
-        try:
-            self.access_token = self.get_access_token()
-        except Exception as e:
-            raise ImproperlyConfigured(
-                f"Failed to get M-Pesa access token. Please check your credentials. Error: {str(e)}"
-            )
+
+    @property
+    def token_key(self):
+        """Key the shared token store files this client's token under"""
+        return f"{self.base_url}|{self.consumer_key}"
+
+    @property
+    def circuit_breaker(self):
+        """Breaker shared by every call this process makes to this Daraja host"""
+        return get_circuit_breaker(self.base_url)
+
+    @property
+    def rate_limiter(self):
+        return get_rate_limiter(self.base_url)
+
+    def record_response(self, status_code):
+        """Feed a Daraja response status into the circuit breaker"""
+        if is_upstream_failure(status_code):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
 
     def get_access_token(self):
-        """Get M-Pesa access token"""
-        try:
-            # Create auth string and encode it to base64
-            auth_string = f"{self.consumer_key}:{self.consumer_secret}"
-            auth_bytes = auth_string.encode('ascii')
-            encoded_auth = base64.b64encode(auth_bytes).decode('ascii')
+        """Get M-Pesa access token, reusing the shared token while it is valid"""
+        return get_token_store().get_token(self.token_key, self.request_access_token)
+
+    @property
+    def access_token(self):
+        # Read from the store on every call, so long-lived clients pick up refreshed tokens
+        return self.get_access_token()
+
+    def post(self, url, payload):
+        """
+        POST ``payload`` to Daraja with the current access token.
 
+        A 401 means Daraja rejected the token before handling the request, so
+        the token is dropped from the shared store and the request is sent
+        once more with a fresh one.
+        """
+        for attempt in range(2):
             headers = {
-                'Authorization': f'Basic {encoded_auth}'
+                "Authorization": f"Bearer {self.access_token}",
+                "Content-Type": "application/json"
             }
+            response = get_transport().post(url, json=payload, headers=headers)
+            if response.status_code != 401 or attempt:
+                return response
+            logger.warning("Daraja rejected the access token for %s, fetching a new one", url)
+            get_token_store().invalidate(self.token_key)
 
+    def request_access_token(self):
+        """Request a new access token from Daraja, returning (token, expires_in)"""
+        # Fails fast with CircuitOpenError while Daraja is known to be down
+        self.circuit_breaker.before_call()
+        try:
+            headers = self.basic_auth_headers()
             url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
             
-            response = requests.get(url, headers=headers)
+            try:
+                response = get_transport().get(url, headers=headers)
+            except requests.exceptions.RequestException:
+                self.circuit_breaker.record_failure()
+                raise
+            self.record_response(response.status_code)
             
             if response.status_code != 200:
+                logger.warning("Daraja OAuth request returned HTTP %s", response.status_code)
                 raise Exception(f"HTTP {response.status_code}: {response.text}")
             
             result = response.json()
@@ -55,7 +144,7 @@ class MpesaClient:
             if 'access_token' not in result:
                 raise Exception(f"Invalid response format: {result}")
             
-            return result['access_token']
+            return result['access_token'], result.get('expires_in')
             
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to connect to M-Pesa API: {str(e)}")
@@ -64,6 +153,17 @@ class MpesaClient:
         except Exception as e:
             raise Exception(f"Unexpected error: {str(e)}")
 
+    def basic_auth_headers(self):
+        """Headers for the OAuth token request"""
+        # Create auth string and encode it to base64
+        auth_string = f"{self.consumer_key}:{self.consumer_secret}"
+        auth_bytes = auth_string.encode('ascii')
+        encoded_auth = base64.b64encode(auth_bytes).decode('ascii')
+
+        return {
+            'Authorization': f'Basic {encoded_auth}'
+        }
+
     def generate_password(self, timestamp):
         """Generate M-Pesa password"""
         data_to_encode = f"{self.paybill}{self.passkey}{timestamp}"
@@ -71,100 +171,113 @@ class MpesaClient:
 
     def format_phone_number(self, phone_number):
         """Format phone number to required format (254XXXXXXXXX)"""
-        # Remove any spaces or special characters
-        phone_number = ''.join(filter(str.isdigit, phone_number))
-        
-        if phone_number.startswith('0'):
-            phone_number = '254' + phone_number[1:]
-        elif not phone_number.startswith('254'):
-            phone_number = '254' + phone_number
-        
-        # Validate length (should be 12 digits for Kenya)
-        if len(phone_number) != 12:
-            raise ValueError(f"Invalid phone number length: {phone_number}")
-        
-        return phone_number
+        return normalize_phone_number(phone_number)
 
-    def initiate_stk_push(self, phone_number, amount, account_reference):
-        """Initiate STK push payment"""
+    def build_stk_payload(self, phone_number, amount, account_reference):
+        """Build and validate the STK push request body"""
         if not self.callback_url:
             raise ImproperlyConfigured(
                 "MPESA_CALLBACK_URL is not set. Please configure it in your settings."
             )
-            
+
+        # Format timestamp as required by Safaricom (YYYYMMDDHHmmss)
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        
+        # Generate the password
+        password = self.generate_password(timestamp)
+        
+        # Format and validate phone number
+        phone_number = self.format_phone_number(phone_number)
+
+        # Ensure amount is a positive integer
         try:
-            # Format timestamp as required by Safaricom (YYYYMMDDHHmmss)
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            
-            # Generate the password
-            password = self.generate_password(timestamp)
-            
-            # Format and validate phone number
-            phone_number = self.format_phone_number(phone_number)
+            amount = int(float(amount))
+            if amount <= 0:
+                raise ValueError("Amount must be positive")
+        except (ValueError, TypeError):
+            raise ValueError("Invalid amount provided")
+        
+        # Prepare the payload
+        return {
+            "BusinessShortCode": self.paybill,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": amount,
+            "PartyA": phone_number,
+            "PartyB": self.paybill,
+            "PhoneNumber": phone_number,
+            "CallBackURL": self.callback_url,
+            "AccountReference": str(account_reference)[:12],
+            "TransactionDesc": "MMUSDA Payment"
+        }
 
-            # Ensure amount is a positive integer
-            try:
-                amount = int(float(amount))
-                if amount <= 0:
-                    raise ValueError("Amount must be positive")
-            except (ValueError, TypeError):
-                raise ValueError("Invalid amount provided")
-            
-            # Prepare the payload
-            payload = {
-                "BusinessShortCode": self.paybill,
-                "Password": password,
-                "Timestamp": timestamp,
-                "TransactionType": "CustomerPayBillOnline",
-                "Amount": amount,
-                "PartyA": phone_number,
-                "PartyB": self.paybill,
-                "PhoneNumber": phone_number,
-                "CallBackURL": self.callback_url,
-                "AccountReference": str(account_reference)[:12],
-                "TransactionDesc": "MMUSDA Payment"
-            }
+    def parse_stk_response(self, status_code, text, data):
+        """Validate an STK push response and return its JSON body"""
+        # Handle non-200 responses
+        if status_code != 200:
+            error_msg = f"HTTP {status_code}"
+            if isinstance(data, dict):
+                error_msg += f": {data.get('errorMessage', text)}"
+            else:
+                error_msg += f": {text}"
+            raise Exception(error_msg)
+        
+        # Validate response format
+        if not isinstance(data, dict) or 'ResponseCode' not in data:
+            raise Exception(f"Invalid response format: {data if data is not None else text}")
+        
+        return data
 
-            headers = {
-                "Authorization": f"Bearer {self.access_token}",
-                "Content-Type": "application/json"
-            }
+    def initiate_stk_push(self, phone_number, amount, account_reference):
+        """Initiate STK push payment"""
+        try:
+            payload = self.build_stk_payload(phone_number, amount, account_reference)
+        except ValueError as e:
+            raise Exception(f"Validation error: {str(e)}")
 
+        # Both raise DarajaUnavailable instead of queueing behind a struggling upstream
+        wait = self.rate_limiter.reserve()
+        if wait:
+            time.sleep(wait)
+        self.circuit_breaker.before_call()
+            
+        try:
             url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
             
-            # Print request details for debugging
-            print("\nM-Pesa Request Details:")
-            print(f"URL: {url}")
-            print(f"Headers: {json.dumps(headers, indent=2)}")
-            print(f"Payload: {json.dumps(payload, indent=2)}")
+            # The payload is only serialized when debug logging is on; headers carry the bearer token
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("STK push request to %s: %s", url, json.dumps(redact_payload(payload)))
             
             # Make the request
-            response = requests.post(url, json=payload, headers=headers)
-            
-            # Print response for debugging
-            print("\nM-Pesa Response:")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response: {response.text}")
-            
-            # Handle non-200 responses
-            if response.status_code != 200:
-                error_msg = f"HTTP {response.status_code}"
-                try:
-                    error_data = response.json()
-                    error_msg += f": {error_data.get('errorMessage', response.text)}"
-                except:
-                    error_msg += f": {response.text}"
-                raise Exception(error_msg)
-            
-            # Parse the response
-            result = response.json()
+            try:
+                response = self.post(url, payload)
+            except requests.exceptions.RequestException as e:
+                logger.warning("STK push to %s failed: %s", url, e)
+                self.circuit_breaker.record_failure()
+                if may_have_been_received(e):
+                    raise StkPushOutcomeUnknown(f"No answer to the M-Pesa payment request: {str(e)}")
+                raise
+            self.record_response(response.status_code)
             
-            # Validate response format
-            if 'ResponseCode' not in result:
-                raise Exception(f"Invalid response format: {result}")
+            if response.status_code == 200:
+                logger.debug("STK push response %s: %s", response.status_code, response.text)
+            else:
+                logger.warning("STK push to %s returned HTTP %s: %s", url, response.status_code, response.text[:500])
             
-            return result
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            # A gateway timeout or an unreadable success can hide an accepted push
+            if response.status_code == 504 or (
+                response.status_code == 200 and not (isinstance(data, dict) and 'ResponseCode' in data)
+            ):
+                raise StkPushOutcomeUnknown(f"Unclear answer from M-Pesa: HTTP {response.status_code}")
+            return self.parse_stk_response(response.status_code, response.text, data)
             
+        except (StkPushOutcomeUnknown, DarajaUnavailable):
+            raise
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to initiate M-Pesa payment: {str(e)}")
         except json.JSONDecodeError as e:
@@ -172,4 +285,43 @@ class MpesaClient:
         except ValueError as e:
             raise Exception(f"Validation error: {str(e)}")
         except Exception as e:
-            raise Exception(f"Error: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error: {str(e)}") 
+
+    def query_stk_status(self, checkout_request_id):
+        """
+        Ask Daraja for the result of an STK push.
+
+        Returns the ResultCode as an int (0 for a completed payment), or None
+        while the customer has not answered the prompt yet.
+        """
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        payload = {
+            "BusinessShortCode": self.paybill,
+            "Password": self.generate_password(timestamp),
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+        url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
+
+        self.circuit_breaker.before_call()
+        try:
+            response = self.post(url, payload)
+        except requests.exceptions.RequestException as e:
+            self.circuit_breaker.record_failure()
+            raise Exception(f"Failed to query M-Pesa payment status: {str(e)}")
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+
+        # Answered with HTTP 500, but Daraja itself is fine
+        if isinstance(data, dict) and data.get('errorCode') == STK_QUERY_PENDING_ERROR:
+            self.circuit_breaker.record_success()
+            return None
+        self.record_response(response.status_code)
+        if response.status_code != 200 or not isinstance(data, dict) or 'ResultCode' not in data:
+            raise Exception(f"HTTP {response.status_code}: {response.text[:500]}")
+        try:
+            return int(data['ResultCode'])
+        except (TypeError, ValueError):
+            raise Exception(f"Invalid ResultCode: {data['ResultCode']}")
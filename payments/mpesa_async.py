@@ -0,0 +1,130 @@
+import asyncio
+import time
+import weakref
+from urllib.parse import urlsplit
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .metrics import record_daraja_call
+from .mpesa import MpesaClient
+from .resilience import DarajaUnavailable, is_upstream_failure
+from .token_store import get_token_store
+
+# One pooled HTTP client per running event loop
+_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client():
+    """Return the shared httpx client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=getattr(settings, 'MPESA_ASYNC_MAX_CONNECTIONS', 500),
+                max_keepalive_connections=getattr(settings, 'MPESA_ASYNC_MAX_KEEPALIVE', 100),
+            ),
+            timeout=httpx.Timeout(
+                getattr(settings, 'MPESA_READ_TIMEOUT', 30),
+                connect=getattr(settings, 'MPESA_CONNECT_TIMEOUT', 5),
+            ),
+        )
+        _http_clients[loop] = client
+    return client
+
+
+class AsyncMpesaClient(MpesaClient):
+    """
+    asyncio counterpart of MpesaClient for async views.
+
+    Shares settings, password generation, phone formatting, payload building
+    and the process-wide token store with MpesaClient, but talks to Daraja
+    through a non-blocking httpx client so one event loop can keep many STK
+    pushes in flight. Construction does no I/O; the token is fetched on
+    first use, through the store like every other client.
+    """
+
+    def __init__(self, http_client=None):
+        self.configure()
+        self.http_client = http_client or get_async_http_client()
+
+    async def _store_call(self, method, *args):
+        # A shared cache backend may do blocking I/O, keep it off the event loop
+        store = get_token_store()
+        if store.cache_alias:
+            return await sync_to_async(getattr(store, method))(*args)
+        return getattr(store, method)(*args)
+
+    async def _guard_call(self, guard, method, *args):
+        # Breaker and limiter state may live in a shared cache too
+        if guard.state.cache_alias:
+            return await sync_to_async(getattr(guard, method))(*args)
+        return getattr(guard, method)(*args)
+
+    async def _record_response(self, status_code):
+        failed = is_upstream_failure(status_code)
+        await self._guard_call(self.circuit_breaker, 'record_failure' if failed else 'record_success')
+
+    async def _send(self, method, url, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = await self.http_client.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            record_daraja_call(urlsplit(url).path, status, time.perf_counter() - start)
+
+    async def get_access_token(self):
+        """Get M-Pesa access token, reusing the shared token while it is valid"""
+        token = await self._store_call('peek', self.token_key)
+        if token:
+            return token
+        # The store's single fetch per process and cache-wide lock, and its
+        # background refresh, all run the blocking OAuth request, so off the loop
+        return await sync_to_async(get_token_store().get_token, thread_sensitive=False)(
+            self.token_key, self.request_access_token
+        )
+
+    async def initiate_stk_push(self, phone_number, amount, account_reference):
+        """Initiate STK push payment"""
+        try:
+            payload = self.build_stk_payload(phone_number, amount, account_reference)
+        except ValueError as e:
+            raise Exception(f"Validation error: {str(e)}")
+
+        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
+        wait = await self._guard_call(self.rate_limiter, 'reserve')
+        if wait:
+            await asyncio.sleep(wait)
+        await self._guard_call(self.circuit_breaker, 'before_call')
+        for attempt in range(2):
+            try:
+                access_token = await self.get_access_token()
+            except DarajaUnavailable:
+                raise
+            except Exception as e:
+                raise ImproperlyConfigured(
+                    f"Failed to get M-Pesa access token. Please check your credentials. Error: {str(e)}"
+                )
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            }
+            try:
+                response = await self._send('POST', url, json=payload, headers=headers)
+            except httpx.HTTPError as e:
+                await self._guard_call(self.circuit_breaker, 'record_failure')
+                raise Exception(f"Failed to initiate M-Pesa payment: {str(e)}")
+            # A rejected token means the push was not handled; retry once with a fresh one
+            if response.status_code != 401 or attempt:
+                break
+            await self._store_call('invalidate', self.token_key)
+        await self._record_response(response.status_code)
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        return self.parse_stk_response(response.status_code, response.text, data)
@@ -0,0 +1,198 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from .queries import newest_first
+
+# Oldest first, for reading backwards from a cursor; newest_first orders the
+# other way, with the primary key breaking ties between equal timestamps
+REVERSE_ORDERING = ('payment_date', 'id')
+
+
+def encode_cursor(payment, backwards=False):
+    """Opaque cursor pointing just past ``payment`` in either direction"""
+    data = {'d': payment.payment_date.isoformat(), 'i': payment.pk}
+    if backwards:
+        data['b'] = 1
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return ``(payment_date, id, backwards)``, or None for a missing or malformed cursor"""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(data['d']), int(data['i']), bool(data.get('b'))
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+def older_than(queryset, payment_date, pk):
+    """
+    ``queryset`` narrowed to rows before ``(payment_date, pk)`` in newest-first order.
+
+    The OR spelling out the row comparison is not a range the planner can
+    seek on by itself, so a plain ``payment_date`` bound goes next to it.
+    """
+    return queryset.filter(
+        Q(payment_date__lt=payment_date) | Q(payment_date=payment_date, id__lt=pk),
+        payment_date__lte=payment_date,
+    )
+
+
+def newer_than(queryset, payment_date, pk):
+    """``queryset`` narrowed to rows after ``(payment_date, pk)``, with the same seek bound"""
+    return queryset.filter(
+        Q(payment_date__gt=payment_date) | Q(payment_date=payment_date, id__gt=pk),
+        payment_date__gte=payment_date,
+    )
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(queryset, cursor=None, page_size=25):
+    """
+    Return one page of ``queryset`` ordered newest first on ``(payment_date, id)``.
+
+    Pages are selected with a ``WHERE (payment_date, id) < cursor`` seek on
+    the date indexes instead of OFFSET, so every page costs the same however
+    deep it is, and rows inserted meanwhile never shift or repeat rows on
+    later pages.
+    """
+    position = decode_cursor(cursor)
+    if position is not None and position[2]:
+        payment_date, pk, _ = position
+        rows = list(
+            newer_than(queryset, payment_date, pk)
+            .order_by(*REVERSE_ORDERING)[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1]) if rows else None,
+            previous_cursor=encode_cursor(rows[0], backwards=True) if has_more else None,
+        )
+
+    if position is not None:
+        payment_date, pk, _ = position
+        queryset = older_than(queryset, payment_date, pk)
+    rows = newest_first(queryset, page_size + 1)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if has_more else None,
+        # Only pages reached through a cursor have anything newer before them
+        previous_cursor=encode_cursor(rows[0], backwards=True) if position is not None and rows else None,
+    )
+
+
+class PaymentCursorPagination(BasePagination):
+    """DRF pagination for payment lists using keyset_paginate"""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    @property
+    def page_size(self):
+        return getattr(settings, 'PAYMENTS_API_PAGE_SIZE', 50)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page = keyset_paginate(
+            queryset,
+            cursor=request.query_params.get(self.cursor_query_param),
+            page_size=self.get_page_size(request),
+        )
+        return self.page.items
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes PostgreSQL's row estimate for unfiltered tables.
+
+    An exact COUNT(*) reads the whole table, which is what makes admin
+    changelists slow on millions of payments. With no filter or search
+    applied, a table the planner estimates at ESTIMATED_COUNT_THRESHOLD rows
+    or more is counted from pg_class instead; anything filtered is counted
+    exactly, as it is usually narrowed down by an index.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where and not query.distinct:
+            estimate = self._estimate(queryset)
+            if estimate is not None and estimate >= getattr(settings, 'ESTIMATED_COUNT_THRESHOLD', 10000):
+                return estimate
+        return super().count
+
+    def _estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        table = queryset.model._meta.db_table
+        with connection.cursor() as cursor:
+            # Summed over the partitions of a partitioned table; reltuples is
+            # -1 until a table is first vacuumed or analyzed
+            cursor.execute(
+                "SELECT sum(reltuples)::bigint FROM pg_class WHERE relkind = 'r' AND reltuples >= 0 "
+                "AND (oid = %s::regclass OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass))",
+                [table, table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
@@ -0,0 +1,317 @@
+import csv
+import gzip
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import CampaignRecipient, Payment, ReconciliationItem, StkPushJob
+
+TABLE = Payment._meta.db_table
+# The partitioned table while it is being filled, and the original once replaced
+BUILD_TABLE = f'{TABLE}_partitioned'
+LEGACY_TABLE = f'{TABLE}_legacy'
+DEFAULT_PARTITION = f'{TABLE}_default'
+ID_SEQUENCE = f'{TABLE}_partitioned_id_seq'
+# Rows of the default partition being moved into a new monthly one
+MOVING_TABLE = f'{TABLE}_moving'
+# PostgreSQL only enforces unique constraints on a partitioned table when they
+# include the partition key, which would make these unique per payment_date
+# only. They stay globally unique in a plain table with one row per payment,
+# kept in step by triggers, which is also what foreign keys to payments point at.
+UNIQUE_COLUMNS = ('transaction_id', 'merchant_request_id', 'checkout_request_id')
+KEY_TABLE = f'{TABLE}_key'
+KEY_FUNCTION = f'{TABLE}_sync_key'
+
+
+def month_start(moment):
+    """First instant of ``moment``'s month in UTC, the time zone partitions are bounded in"""
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y%m}'
+
+
+def hot_cutoff():
+    """Start of the oldest hot month, or None while PAYMENTS_HOT_MONTHS is 0"""
+    months = getattr(settings, 'PAYMENTS_HOT_MONTHS', 0)
+    if not months:
+        return None
+    return add_months(month_start(timezone.now()), 1 - months)
+
+
+def _exists(cursor, name):
+    cursor.execute('SELECT to_regclass(%s)', [name])
+    return cursor.fetchone()[0] is not None
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [TABLE])
+        return cursor.fetchone() is not None
+
+
+def _create_partition(cursor, table, month):
+    """
+    Create ``table``'s partition for ``month``.
+
+    PostgreSQL refuses to add a partition while the default one holds rows
+    in its range, so those rows are taken out of the default partition
+    first and inserted again through the parent once the partition exists.
+    The triggers remove and re-add their keys on the way; foreign keys to
+    them are deferred, so they only see the end state.
+    """
+    qn = connection.ops.quote_name
+    bounds = [month, add_months(month, 1)]
+    in_month = 'payment_date >= %s AND payment_date < %s'
+    with transaction.atomic():
+        stray = 0
+        if table == TABLE and _exists(cursor, DEFAULT_PARTITION):
+            # Holds off payments that would land in the default partition meanwhile
+            cursor.execute(f'LOCK TABLE {qn(DEFAULT_PARTITION)} IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(f'SELECT count(*) FROM {qn(DEFAULT_PARTITION)} WHERE {in_month}', bounds)
+            stray = cursor.fetchone()[0]
+        if stray:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {qn(MOVING_TABLE)} AS '
+                f'SELECT * FROM {qn(DEFAULT_PARTITION)} WHERE {in_month}',
+                bounds,
+            )
+            cursor.execute(f'DELETE FROM {qn(DEFAULT_PARTITION)} WHERE {in_month}', bounds)
+        cursor.execute(
+            f'CREATE TABLE {qn(partition_name(month))} PARTITION OF {qn(table)} '
+            f"FOR VALUES FROM ('{bounds[0].isoformat()}') TO ('{bounds[1].isoformat()}')"
+        )
+        if stray:
+            cursor.execute(f'INSERT INTO {qn(TABLE)} SELECT * FROM {qn(MOVING_TABLE)}')
+            cursor.execute(f'DROP TABLE {qn(MOVING_TABLE)}')
+
+
+def ensure_partitions(months_ahead=3, first_month=None, table=TABLE):
+    """
+    Create the missing monthly partitions of ``table`` up to ``months_ahead`` months from now.
+
+    Starts at ``first_month``, or the current month. Payments the default
+    partition caught for a month are moved into its new partition. Returns
+    how many were created.
+    """
+    month = first_month or month_start(timezone.now())
+    last = add_months(month_start(timezone.now()), months_ahead)
+    created = 0
+    with connection.cursor() as cursor:
+        while month <= last:
+            if not _exists(cursor, partition_name(month)):
+                _create_partition(cursor, table, month)
+                created += 1
+            month = add_months(month, 1)
+    return created
+
+
+def maintain_partitions(months_ahead=3):
+    """Create the coming months' partitions if payments are partitioned; returns how many were created"""
+    if not is_partitioned():
+        return 0
+    return ensure_partitions(months_ahead)
+
+
+def _create_key_table(cursor, table):
+    """Fill the key table from ``table`` and install the triggers that keep it in step"""
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(column) for column in UNIQUE_COLUMNS)
+    cursor.execute(
+        f'CREATE TABLE {qn(KEY_TABLE)} (payment_id bigint PRIMARY KEY, '
+        + ', '.join(f'{qn(column)} varchar(100) UNIQUE' for column in UNIQUE_COLUMNS) + ')'
+    )
+    cursor.execute(
+        f'INSERT INTO {qn(KEY_TABLE)} (payment_id, {columns}) SELECT id, {columns} FROM {qn(table)}'
+    )
+    new_values = ', '.join(f'NEW.{qn(column)}' for column in UNIQUE_COLUMNS)
+    assignments = ', '.join(f'{qn(column)} = NEW.{qn(column)}' for column in UNIQUE_COLUMNS)
+    # A payment reusing another's key fails its statement with a unique violation,
+    # as the unique constraints on the unpartitioned table did
+    cursor.execute(
+        f'CREATE FUNCTION {qn(KEY_FUNCTION)}() RETURNS trigger LANGUAGE plpgsql AS $$ '
+        f"BEGIN "
+        f"IF TG_OP = 'INSERT' THEN "
+        f'INSERT INTO {qn(KEY_TABLE)} (payment_id, {columns}) VALUES (NEW.id, {new_values}); '
+        f"ELSIF TG_OP = 'UPDATE' THEN "
+        f'UPDATE {qn(KEY_TABLE)} SET payment_id = NEW.id, {assignments} WHERE payment_id = OLD.id; '
+        f'ELSE '
+        f'DELETE FROM {qn(KEY_TABLE)} WHERE payment_id = OLD.id; '
+        f'END IF; '
+        f'RETURN NULL; '
+        f'END $$'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER {qn(f"{TABLE}_key_sync")} AFTER INSERT OR DELETE ON {qn(table)} '
+        f'FOR EACH ROW EXECUTE FUNCTION {qn(KEY_FUNCTION)}()'
+    )
+    # Status changes, by far the most common update, leave the keys alone
+    cursor.execute(
+        f'CREATE TRIGGER {qn(f"{TABLE}_key_sync_update")} AFTER UPDATE OF id, {columns} ON {qn(table)} '
+        f'FOR EACH ROW EXECUTE FUNCTION {qn(KEY_FUNCTION)}()'
+    )
+
+
+def partition_payments_table(months_ahead=3):
+    """
+    Replace the payments table with one range-partitioned by payment_date month.
+
+    Runs in one transaction that holds a SHARE lock on the payments table:
+    reads carry on, writes wait until the new table is in place. Rows are
+    copied with their ids, the model's indexes are rebuilt on the new table
+    under temporary names and swapped in at the end. The original table is
+    kept as ``payments_payment_legacy``. Transaction, merchant and
+    CheckoutRequest IDs stay unique across partitions through
+    ``payments_payment_key``, and foreign keys from other tables to
+    payments are moved onto it, as PostgreSQL can only reference a
+    partitioned table through a unique key that includes payment_date.
+
+    Returns the number of rows copied.
+    """
+    qn = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        if any(_exists(cursor, name) for name in (LEGACY_TABLE, BUILD_TABLE, KEY_TABLE)):
+            raise ValueError(f'{LEGACY_TABLE}, {BUILD_TABLE} or {KEY_TABLE} already exists, drop it first')
+        cursor.execute(f'LOCK TABLE {qn(TABLE)} IN SHARE MODE')
+        cursor.execute(f'SELECT min(payment_date) FROM {qn(TABLE)}')
+        oldest = cursor.fetchone()[0]
+
+        cursor.execute(
+            f'CREATE TABLE {qn(BUILD_TABLE)} (LIKE {qn(TABLE)} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE (payment_date)'
+        )
+        # Identity columns on partitioned tables need PostgreSQL 17, a sequence works everywhere
+        cursor.execute(f'CREATE SEQUENCE {qn(ID_SEQUENCE)} OWNED BY {qn(BUILD_TABLE)}.id')
+        cursor.execute(f"ALTER TABLE {qn(BUILD_TABLE)} ALTER COLUMN id SET DEFAULT nextval('{ID_SEQUENCE}')")
+        cursor.execute(
+            f'ALTER TABLE {qn(BUILD_TABLE)} ADD CONSTRAINT {qn(f"{TABLE}_part_pkey")} '
+            f'PRIMARY KEY (id, payment_date)'
+        )
+        member_table = Payment._meta.get_field('member').related_model._meta.db_table
+        cursor.execute(
+            f'ALTER TABLE {qn(BUILD_TABLE)} ADD CONSTRAINT {qn(f"{TABLE}_member_id_part_fk")} '
+            f'FOREIGN KEY (member_id) REFERENCES {qn(member_table)} (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+
+        ensure_partitions(months_ahead, first_month=month_start(oldest) if oldest else None, table=BUILD_TABLE)
+        # Catches anything outside the monthly partitions, such as dates far in the future
+        cursor.execute(f'CREATE TABLE {qn(DEFAULT_PARTITION)} PARTITION OF {qn(BUILD_TABLE)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {qn(BUILD_TABLE)} SELECT * FROM {qn(TABLE)}')
+        copied = cursor.rowcount
+        cursor.execute(
+            f"SELECT setval('{ID_SEQUENCE}', (SELECT coalesce(max(id), 0) + 1 FROM {qn(BUILD_TABLE)}), false)"
+        )
+
+        # Built after the copy, which is faster than maintaining them row by row
+        with connection.schema_editor(atomic=False) as editor:
+            for index in Payment._meta.indexes:
+                building = index.clone()
+                building.name = f'{index.name}_part'
+                statement = building.create_sql(Payment, editor)
+                statement.rename_table_references(TABLE, BUILD_TABLE)
+                editor.execute(statement)
+        for column in UNIQUE_COLUMNS:
+            # Lookups, which the unique constraints served before, and prefix
+            # search, as the _like indexes Django adds for unique text columns
+            cursor.execute(f'CREATE INDEX {qn(f"{TABLE}_{column}_part")} ON {qn(BUILD_TABLE)} ({qn(column)})')
+            cursor.execute(
+                f'CREATE INDEX {qn(f"{TABLE}_{column}_part_like")} '
+                f'ON {qn(BUILD_TABLE)} ({qn(column)} varchar_pattern_ops)'
+            )
+        _create_key_table(cursor, BUILD_TABLE)
+
+        cursor.execute(
+            "SELECT c.conrelid::regclass::text, c.conname, a.attname FROM pg_constraint c "
+            "JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1] "
+            "WHERE c.contype = 'f' AND c.confrelid = %s::regclass",
+            [TABLE],
+        )
+        for table, constraint, column in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {qn(constraint)}')
+            cursor.execute(
+                f'ALTER TABLE {table} ADD CONSTRAINT {qn(constraint)} FOREIGN KEY ({qn(column)}) '
+                f'REFERENCES {qn(KEY_TABLE)} (payment_id) DEFERRABLE INITIALLY DEFERRED'
+            )
+
+        cursor.execute(f'ALTER TABLE {qn(TABLE)} RENAME TO {qn(LEGACY_TABLE)}')
+        for index in Payment._meta.indexes:
+            cursor.execute(f'ALTER INDEX {qn(index.name)} RENAME TO {qn(f"{index.name}_legacy")}')
+            cursor.execute(f'ALTER INDEX {qn(f"{index.name}_part")} RENAME TO {qn(index.name)}')
+        cursor.execute(f'ALTER TABLE {qn(BUILD_TABLE)} RENAME TO {qn(TABLE)}')
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {qn(TABLE)}')
+    return copied
+
+
+def archivable_partitions(before):
+    """(name, month) of the monthly partitions holding only payments older than ``before``, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass ORDER BY c.relname',
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        try:
+            month = datetime.strptime(name.removeprefix(f'{TABLE}_p'), '%Y%m').replace(tzinfo=dt_timezone.utc)
+        except ValueError:
+            # The default partition
+            continue
+        if add_months(month, 1) <= before:
+            partitions.append((name, month))
+    return partitions
+
+
+def archive_partition(name, month, directory, keep_table=False):
+    """
+    Move one monthly partition out of the payments table.
+
+    Its rows are written to ``<directory>/<partition>.csv.gz``, rows of other
+    tables pointing at them are detached, their keys are released, and the
+    partition is dropped, or
+    kept as a standalone ``payments_payment_archive_YYYYMM`` table with
+    ``keep_table``. Returns (rows archived, archive path).
+    """
+    qn = connection.ops.quote_name
+    path = Path(directory) / f'{name}.csv.gz'
+    fields = [field.attname for field in Payment._meta.concrete_fields]
+    payments = Payment.objects.filter(payment_date__gte=month, payment_date__lt=add_months(month, 1))
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {qn(name)} IN SHARE MODE')
+        count = 0
+        with gzip.open(path, 'wt', newline='', encoding='utf-8', compresslevel=6) as archive:
+            writer = csv.writer(archive)
+            writer.writerow(fields)
+            # The date range confines the read to this partition
+            for row in payments.order_by().values_list(*fields).iterator(chunk_size=5000):
+                writer.writerow(row)
+                count += 1
+
+        ids = payments.values('id')
+        StkPushJob.objects.filter(payment_id__in=ids).delete()
+        CampaignRecipient.objects.filter(payment_id__in=ids).update(payment=None)
+        ReconciliationItem.objects.filter(payment_id__in=ids).update(payment=None)
+
+        with connection.cursor() as cursor:
+            # Dropping or detaching a partition fires no delete triggers
+            cursor.execute(f'DELETE FROM {qn(KEY_TABLE)} WHERE payment_id IN (SELECT id FROM {qn(name)})')
+            cursor.execute(f'ALTER TABLE {qn(TABLE)} DETACH PARTITION {qn(name)}')
+            if keep_table:
+                cursor.execute(f'ALTER TABLE {qn(name)} RENAME TO {qn(f"{TABLE}_archive_{month:%Y%m}")}')
+            else:
+                cursor.execute(f'DROP TABLE {qn(name)}')
+    return count, path
@@ -0,0 +1,53 @@
+import re
+from django.core.exceptions import ValidationError
+
+NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_phone_number(phone_number):
+    """Normalize a Kenyan phone number to the 254XXXXXXXXX form M-Pesa expects"""
+    # Remove any spaces or special characters
+    phone_number = NON_DIGITS.sub('', str(phone_number))
+
+    if phone_number.startswith('0'):
+        phone_number = '254' + phone_number[1:]
+    elif not phone_number.startswith('254'):
+        phone_number = '254' + phone_number
+
+    # Validate length (should be 12 digits for Kenya)
+    if len(phone_number) != 12:
+        raise ValueError(f"Invalid phone number length: {phone_number}")
+
+    return phone_number
+
+
+def to_msisdn(phone_number):
+    """``phone_number`` in the form stored in Member.msisdn, or None if it is not a valid number"""
+    if not phone_number:
+        return None
+    try:
+        return normalize_phone_number(phone_number)
+    except ValueError:
+        return None
+
+
+def clean_member_phone(phone_number, member=None):
+    """
+    Canonical form of a phone number being given to ``member`` (or a new member).
+
+    Raises ValidationError for numbers that are not valid or belong to
+    another member; forms and serializers both report it on the field.
+    """
+    # Imported here because models.py imports this module
+    from .models import Member
+
+    try:
+        msisdn = normalize_phone_number(phone_number)
+    except ValueError:
+        raise ValidationError('Enter a valid Kenyan phone number, e.g. 0712345678.')
+    taken = Member.objects.filter(msisdn=msisdn)
+    if member is not None and member.pk is not None:
+        taken = taken.exclude(pk=member.pk)
+    if taken.exists():
+        raise ValidationError('Another member is registered with this phone number.')
+    return msisdn
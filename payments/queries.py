@@ -0,0 +1,66 @@
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from .models import Payment
+from .partitioning import hot_cutoff
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD query parameter, returning None when it is missing or invalid"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def start_of_day(day):
+    """Aware datetime at midnight of ``day`` in the current time zone"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_payment_history(payments, params):
+    """
+    Apply the payment_history filters in ``params`` to ``payments``.
+
+    Date filters compare ``payment_date`` against a half-open
+    ``[date_from 00:00, date_to + 1 day 00:00)`` range rather than
+    ``payment_date__date`` so the database can use the date indexes.
+    """
+    payment_type = params.get('payment_type')
+    status = params.get('status')
+    date_from = parse_date(params.get('date_from'))
+    date_to = parse_date(params.get('date_to'))
+
+    if payment_type:
+        payments = payments.filter(payment_type=payment_type)
+    if status:
+        payments = payments.filter(status=status)
+    if date_from:
+        payments = payments.filter(payment_date__gte=start_of_day(date_from))
+    if date_to:
+        payments = payments.filter(payment_date__lt=start_of_day(date_to + timedelta(days=1)))
+    return payments
+
+
+def member_payments(member):
+    """A member's payments, newest first"""
+    return Payment.objects.filter(member=member).order_by('-payment_date')
+
+
+def newest_first(payments, limit):
+    """
+    Up to ``limit`` of ``payments``, newest first.
+
+    With PAYMENTS_HOT_MONTHS set, the hot months are read first under a
+    payment_date bound that PostgreSQL prunes partitions on, and older
+    partitions are only read when the hot ones do not fill the page.
+    """
+    payments = payments.order_by('-payment_date', '-id')
+    cutoff = hot_cutoff()
+    if cutoff is None:
+        return list(payments[:limit])
+    rows = list(payments.filter(payment_date__gte=cutoff)[:limit])
+    if len(rows) < limit:
+        rows += list(payments.filter(payment_date__lt=cutoff)[:limit - len(rows)])
+    return rows
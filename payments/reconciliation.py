@@ -0,0 +1,326 @@
+import csv
+import re
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .dashboard import invalidate_dashboards
+from .events import publish_payment_events
+from .models import Payment, ReconciliationItem
+from .rollups import record_completed_payments
+
+StatementLine = namedtuple('StatementLine', 'receipt_number time amount other_party')
+
+# Normalized header -> column, covering the names used by the M-Pesa org
+# portal statement export and the older paybill statement
+COLUMNS = {
+    'receipt_number': ('receiptno', 'receiptnumber', 'receipt', 'transactionid'),
+    'time': ('completiontime', 'transactiontime', 'initiationtime', 'date'),
+    'amount': ('paidin', 'amount', 'credit'),
+    'status': ('transactionstatus', 'status'),
+    'other_party': ('otherpartyinfo', 'otherparty', 'details'),
+}
+
+TIME_FORMATS = (
+    '%d-%m-%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%Y%m%d%H%M%S',
+)
+
+# Statements are in East Africa Time (UTC+3)
+STATEMENT_TZ = timezone.get_fixed_timezone(180)
+
+# A push without a receipt that has not been settled may still be the one a line paid
+UNSETTLED_STATUSES = ('PENDING', 'EXPIRED')
+
+# A phone number in OtherPartyInfo, possibly masked: 254712345678, 2547****5678, 0712***678
+PARTY_PHONE = re.compile(r'[0-9*]{9,12}')
+PARTY_NAME = re.compile(r'[A-Z]{2,}')
+
+# Items per INSERT; bulk_create lowers it further where the backend limits query parameters
+ITEM_BATCH_SIZE = 1000
+
+
+def _normalize(header):
+    return ''.join(ch for ch in header.lower() if ch.isalnum())
+
+
+def _column_positions(header):
+    names = [_normalize(cell) for cell in header]
+    positions = {}
+    for column, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                positions[column] = names.index(alias)
+                break
+    return positions
+
+
+def _parse_time(value):
+    value = value.strip()
+    try:
+        # The portal's own YYYY-MM-DD HH:MM:SS, parsed in C
+        return datetime.fromisoformat(value).replace(tzinfo=STATEMENT_TZ)
+    except ValueError:
+        pass
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format).replace(tzinfo=STATEMENT_TZ)
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_amount(value):
+    value = value.replace(',', '').strip()
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def read_statement(lines, stats):
+    """
+    Yield a StatementLine for every completed credit in a statement CSV.
+
+    Lines before the header row (account name, period, ...) are skipped, as
+    are withdrawals and failed transactions; ``stats`` counts rows read and
+    skipped.
+    """
+    reader = csv.reader(lines)
+    positions = None
+    for row in reader:
+        positions = _column_positions(row)
+        if 'receipt_number' in positions and 'amount' in positions:
+            break
+    else:
+        raise ValueError('No header row with receipt number and amount columns found')
+
+    receipt_at = positions['receipt_number']
+    amount_at = positions['amount']
+    time_at = positions.get('time')
+    status_at = positions.get('status')
+    party_at = positions.get('other_party')
+    width = max(positions.values()) + 1
+    for row in reader:
+        stats['rows'] += 1
+        if len(row) < width:
+            stats['skipped'] += 1
+            continue
+        amount = _parse_amount(row[amount_at])
+        receipt_number = row[receipt_at].strip()
+        if (
+            amount is None or amount <= 0 or not receipt_number
+            or (status_at is not None and row[status_at].strip().lower() != 'completed')
+        ):
+            stats['skipped'] += 1
+            continue
+        yield StatementLine(
+            receipt_number,
+            _parse_time(row[time_at]) if time_at is not None else None,
+            amount,
+            row[party_at].strip()[:255] if party_at is not None else '',
+        )
+
+
+def party_matches(other_party, msisdn, names):
+    """
+    Whether a statement line's other party can be the member with ``msisdn`` and ``names``.
+
+    True or False when the line names a phone number, which decides, or a
+    name; None when it carries neither.
+    """
+    phone = PARTY_PHONE.search(other_party)
+    if phone:
+        phone = phone.group()
+        if phone.startswith('0'):
+            phone = '254' + phone[1:]
+        if len(phone) != 12 or not msisdn:
+            return False
+        return all(digit in ('*', known) for digit, known in zip(phone, msisdn))
+    words = set(PARTY_NAME.findall(other_party.upper()))
+    if not words:
+        return None
+    return bool(words & {name.upper() for name in names if len(name) > 1})
+
+
+def _insert_items(items):
+    """Write reconciliation items, a batch of rows per INSERT"""
+    ReconciliationItem.objects.bulk_create(
+        [ReconciliationItem(**item) for item in items], batch_size=ITEM_BATCH_SIZE
+    )
+
+
+class Reconciler:
+    """
+    Matches statement lines against payments, one batch of lines at a time.
+
+    Each batch builds a hash index of its lines by receipt number and looks
+    them up with one query on ``mpesa_receipt_number``/``transaction_id``.
+    Lines left over are matched against unsettled pushes made around the
+    same time through a second index keyed on (amount, time bucket); only
+    a push by the member the line's other party names is taken as its
+    match, the rest are reported as ambiguous. Memory stays bounded by the
+    batch size whatever the statement length.
+    """
+
+    def __init__(self, run, window=timedelta(minutes=10), batch_size=5000, apply=False):
+        self.run = run
+        self.window = window
+        self.batch_size = batch_size
+        self.apply = apply
+        self.counts = defaultdict(int)
+        self.repaired = 0
+        # Unsettled pushes already paired with a line, which may sit in the next batch's window too
+        self.claimed = set()
+
+    def reconcile(self, statement_lines):
+        batch = []
+        for line in statement_lines:
+            batch.append(line)
+            if len(batch) >= self.batch_size:
+                self.reconcile_batch(batch)
+                batch = []
+        if batch:
+            self.reconcile_batch(batch)
+        return self.counts
+
+    def _bucket(self, moment):
+        return int(moment.timestamp() // self.window.total_seconds())
+
+    def _by_receipt(self, lines):
+        by_receipt = {line.receipt_number: line for line in lines}
+        found = {}
+        payments = Payment.objects.filter(
+            Q(mpesa_receipt_number__in=list(by_receipt)) | Q(transaction_id__in=list(by_receipt))
+        ).values('id', 'amount', 'mpesa_receipt_number', 'transaction_id')
+        for payment in payments:
+            if payment['mpesa_receipt_number'] in by_receipt:
+                found[payment['mpesa_receipt_number']] = payment
+            else:
+                found.setdefault(payment['transaction_id'], payment)
+        return found
+
+    def _unsettled_index(self, lines):
+        """Unsettled pushes without a receipt around ``lines``, by (amount, time bucket)"""
+        times = [line.time for line in lines if line.time is not None]
+        index = defaultdict(list)
+        if not times:
+            return index
+        payments = Payment.objects.filter(
+            payment_date__gte=min(times) - self.window,
+            payment_date__lte=max(times) + self.window,
+            status__in=UNSETTLED_STATUSES,
+            mpesa_receipt_number='',
+        ).values('id', 'amount', 'payment_date', 'member__msisdn',
+                 'member__user__first_name', 'member__user__last_name')
+        for payment in payments:
+            if payment['id'] not in self.claimed:
+                index[(payment['amount'], self._bucket(payment['payment_date']))].append(payment)
+        return index
+
+    def _closest_unsettled(self, index, line):
+        """
+        (payment, identified) for the unsettled push nearest ``line``.
+
+        Campaigns push the same amount to many members at once, so the
+        nearest push is only ``identified`` as the line's when its member is
+        the line's other party; otherwise it is just the closest candidate.
+        """
+        if line.time is None:
+            return None, False
+        bucket = self._bucket(line.time)
+        candidates = []
+        for candidate_bucket in (bucket - 1, bucket, bucket + 1):
+            for payment in index.get((line.amount, candidate_bucket), ()):
+                gap = abs(payment['payment_date'] - line.time)
+                if payment['id'] not in self.claimed and gap <= self.window:
+                    candidates.append((gap, payment))
+        if not candidates:
+            return None, False
+        candidates.sort(key=lambda candidate: candidate[0])
+        for _, payment in candidates:
+            names = (payment['member__user__first_name'], payment['member__user__last_name'])
+            if party_matches(line.other_party, payment['member__msisdn'], names):
+                self.claimed.add(payment['id'])
+                return payment, True
+        return candidates[0][1], False
+
+    def reconcile_batch(self, lines):
+        # A receipt repeated in the statement is only counted once
+        lines = list({line.receipt_number: line for line in lines}.values())
+        found = self._by_receipt(lines)
+        items = []
+        unmatched = []
+        for line in lines:
+            payment = found.get(line.receipt_number)
+            if payment is None:
+                unmatched.append(line)
+            elif payment['amount'] != line.amount:
+                items.append(self._item('AMOUNT_MISMATCH', line, payment))
+            else:
+                self.counts['matched'] += 1
+
+        index = self._unsettled_index(unmatched) if unmatched else {}
+        for line in unmatched:
+            payment, identified = self._closest_unsettled(index, line)
+            if identified:
+                items.append(self._item('MISSING_CALLBACK', line, payment))
+            elif payment is not None:
+                # Left for review, never applied
+                items.append(self._item('AMBIGUOUS_MATCH', line, payment))
+            else:
+                items.append(self._item('ORPHAN_RECEIPT', line))
+
+        with transaction.atomic():
+            if self.apply:
+                self._complete_missing([item for item in items if item['kind'] == 'MISSING_CALLBACK'])
+            _insert_items(items)
+
+    def _item(self, kind, line, payment=None):
+        self.counts[kind] += 1
+        return {
+            'run_id': self.run.pk,
+            'kind': kind,
+            'receipt_number': line.receipt_number,
+            'transaction_time': line.time,
+            'statement_amount': line.amount,
+            'other_party': line.other_party,
+            'payment_id': payment['id'] if payment else None,
+            'payment_amount': payment['amount'] if payment else None,
+            'resolved': False,
+        }
+
+    def _complete_missing(self, items):
+        """Settle pushes whose callback never arrived from their statement lines"""
+        completed = []
+        for item in items:
+            # Conditional, so a callback that landed meanwhile is not overwritten
+            if Payment.objects.filter(
+                id=item['payment_id'], status__in=UNSETTLED_STATUSES
+            ).update(status='COMPLETED', mpesa_receipt_number=item['receipt_number']):
+                item['resolved'] = True
+                completed.append(item['payment_id'])
+        if not completed:
+            return
+        payments = list(
+            Payment.objects.filter(id__in=completed)
+            .select_related('member')
+            .only('amount', 'payment_date', 'payment_type', 'mission_payment_type', 'status',
+                  'checkout_request_id', 'mpesa_receipt_number',
+                  'member', 'member__family', 'member__cohort')
+        )
+        record_completed_payments(payments)
+        invalidate_dashboards(payment.member_id for payment in payments)
+        publish_payment_events({
+            'member_id': payment.member_id,
+            'checkout_request_id': payment.checkout_request_id,
+            'status': payment.status,
+            'receipt_number': payment.mpesa_receipt_number,
+        } for payment in payments)
+        self.repaired += len(payments)
@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+import uuid
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DarajaUnavailable(Exception):
+    """Daraja cannot be called right now; the caller should try again shortly"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class CircuitOpenError(DarajaUnavailable):
+    pass
+
+
+class RateLimitExceeded(DarajaUnavailable):
+    pass
+
+
+class SharedStateBusy(DarajaUnavailable):
+    """The shared limiter or breaker state stayed locked by other workers for too long"""
+
+
+class SharedState:
+    """
+    A small dict updated under a lock, either in this process or, when a
+    Django cache alias is given, in that cache so every worker sees it.
+
+    Cross-process updates take a ``cache.add`` lock, the same scheme the
+    token store uses for its OAuth fetches. The lock holds a token unique
+    to its holder, so a caller whose lock expired never releases someone
+    else's.
+    """
+
+    def __init__(self, key, cache_alias=None, lock_timeout=2):
+        self.key = key
+        self.cache_alias = cache_alias
+        self.lock_timeout = lock_timeout
+        self._state = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        if not self.cache_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def peek(self):
+        """Current state without taking the lock, for fast paths that usually change nothing"""
+        cache = self.cache
+        if cache is None:
+            return self._state
+        return cache.get(self.key) or {}
+
+    def update(self, change):
+        """
+        Call ``change(state)``, which edits the dict in place, and return its result.
+
+        Raises SharedStateBusy if the cache lock cannot be taken within
+        ``lock_timeout`` seconds.
+        """
+        with self._lock:
+            cache = self.cache
+            if cache is None:
+                return change(self._state)
+
+            lock_key = f'{self.key}:lock'
+            token = uuid.uuid4().hex
+            deadline = time.time() + self.lock_timeout
+            # A holder that died releases the lock when it times out
+            while not cache.add(lock_key, token, timeout=self.lock_timeout):
+                if time.time() >= deadline:
+                    raise SharedStateBusy(f'{self.key} is locked by another worker')
+                time.sleep(0.002)
+            try:
+                state = cache.get(self.key) or {}
+                result = change(state)
+                cache.set(self.key, state, timeout=None)
+                return result
+            finally:
+                # Ours unless it expired meanwhile; the cache API has no
+                # compare-and-delete, so this narrows the window without closing it
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+
+class TokenBucket:
+    """
+    Token-bucket limit of ``rate`` calls per second with bursts of ``capacity``.
+
+    ``reserve`` takes a token, possibly one that only becomes available in
+    the future, and returns how long the caller must wait before using it,
+    so sync callers can ``time.sleep`` and async ones ``asyncio.sleep``.
+    """
+
+    def __init__(self, name, rate, capacity=None, max_wait=2, cache_alias=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.max_wait = max_wait
+        self.state = SharedState(f'mpesa:ratelimit:{name}', cache_alias)
+
+    def reserve(self):
+        if not self.rate:
+            return 0
+
+        def take(state):
+            now = time.time()
+            tokens = state.get('tokens', self.capacity)
+            tokens = min(self.capacity, tokens + (now - state.get('updated', now)) * self.rate)
+            wait = max(0, (1 - tokens) / self.rate)
+            if wait > self.max_wait:
+                state.update(tokens=tokens, updated=now)
+                return None
+            state.update(tokens=tokens - 1, updated=now)
+            return wait
+
+        wait = self.state.update(take)
+        if wait is None:
+            raise RateLimitExceeded('Too many M-Pesa requests right now', retry_after=self.max_wait)
+        return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail immediately with CircuitOpenError. Once ``reset_timeout``
+    seconds have passed a single caller is let through as a probe: its
+    success closes the circuit again, its failure reopens it.
+    """
+
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, cache_alias=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = SharedState(f'mpesa:circuit:{name}', cache_alias)
+
+    def before_call(self):
+        if self.state.peek().get('status', self.CLOSED) == self.CLOSED:
+            return
+
+        def check(state):
+            now = time.time()
+            status = state.get('status', self.CLOSED)
+            if status == self.CLOSED:
+                return None
+            retry_at = state['opened_at'] + self.reset_timeout
+            if status == self.OPEN and now >= retry_at:
+                state.update(status=self.HALF_OPEN, probe_started=now)
+                return None
+            if status == self.HALF_OPEN and now >= state['probe_started'] + self.reset_timeout:
+                # The probe never reported back, let another caller try
+                state.update(probe_started=now)
+                return None
+            return max(retry_at - now, 1)
+
+        retry_after = self.state.update(check)
+        if retry_after is not None:
+            raise CircuitOpenError('M-Pesa is not responding, not calling it for now', retry_after=retry_after)
+
+    def record_success(self):
+        if not self.state.peek().get('failures'):
+            return
+
+        def close(state):
+            state.clear()
+            state.update(status=self.CLOSED, failures=0)
+        self._record(close)
+
+    def record_failure(self):
+        def fail(state):
+            failures = state.get('failures', 0) + 1
+            state.update(failures=failures)
+            if state.get('status') == self.HALF_OPEN or failures >= self.failure_threshold:
+                state.update(status=self.OPEN, opened_at=time.time())
+        self._record(fail)
+
+    def _record(self, change):
+        # Outcomes are reported after Daraja has answered; losing one must not
+        # turn a handled call into an error its caller might retry
+        try:
+            self.state.update(change)
+        except SharedStateBusy as e:
+            logger.warning('Circuit breaker outcome not recorded: %s', e)
+
+    @property
+    def status(self):
+        return self.state.peek().get('status', self.CLOSED)
+
+
+def is_upstream_failure(status_code):
+    """Responses that mean Daraja itself is unhealthy rather than the request being bad"""
+    return status_code >= 500 or status_code == 429
+
+
+_breakers = {}
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breaker(name):
+    """Process-wide breaker for an upstream, configured from settings"""
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=getattr(settings, 'MPESA_BREAKER_FAILURE_THRESHOLD', 5),
+                reset_timeout=getattr(settings, 'MPESA_BREAKER_RESET_TIMEOUT', 30),
+                cache_alias=getattr(settings, 'MPESA_RESILIENCE_CACHE_ALIAS', None),
+            )
+        return _breakers[name]
+
+
+def get_rate_limiter(name):
+    """Process-wide STK push rate limiter for an upstream, configured from settings"""
+    with _registry_lock:
+        if name not in _limiters:
+            _limiters[name] = TokenBucket(
+                name,
+                rate=getattr(settings, 'MPESA_RATE_LIMIT', 0),
+                capacity=getattr(settings, 'MPESA_RATE_LIMIT_BURST', None),
+                max_wait=getattr(settings, 'MPESA_RATE_LIMIT_MAX_WAIT', 2),
+                cache_alias=getattr(settings, 'MPESA_RESILIENCE_CACHE_ALIAS', None),
+            )
+        return _limiters[name]
@@ -0,0 +1,222 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Count, DateField, F, Sum, Value
+from django.db.models.functions import Cast, TruncDate, TruncMonth
+from django.utils import timezone
+from .models import ContributionRollup, Payment
+
+# Dimension name -> Payment lookup its bucket key comes from (None for ALL)
+DIMENSIONS = {
+    'ALL': None,
+    'MEMBER': 'member_id',
+    'FAMILY': 'member__family_id',
+    'COHORT': 'member__cohort_id',
+    'PAYMENT_TYPE': 'payment_type',
+    'MISSION_TYPE': 'mission_payment_type',
+}
+
+
+def _period_starts(payment_date):
+    day = timezone.localdate(payment_date)
+    return {'DAY': day, 'MONTH': day.replace(day=1)}
+
+
+def _bucket_keys(payment):
+    member = payment.member
+    values = {
+        'ALL': '',
+        'MEMBER': payment.member_id,
+        'FAMILY': member.family_id,
+        'COHORT': member.cohort_id,
+        'PAYMENT_TYPE': payment.payment_type,
+        'MISSION_TYPE': payment.mission_payment_type,
+    }
+    # Payments without a family, cohort or mission type only count towards the other dimensions
+    return {dimension: str(value) for dimension, value in values.items() if value is not None}
+
+
+def _bucket_columns():
+    return {
+        name: connection.ops.quote_name(name)
+        for name in ('dimension', 'period', 'period_start', 'key', 'total_amount', 'payment_count')
+    }
+
+
+def _params(deltas):
+    return [
+        (dimension, period, period_start, key, amount, count)
+        for (dimension, period, period_start, key), (amount, count) in sorted(deltas.items())
+    ]
+
+
+def _upsert(deltas):
+    """Add ``{(dimension, period, period_start, key): (amount, count)}`` onto the stored buckets"""
+    if not deltas:
+        return
+    table = connection.ops.quote_name(ContributionRollup._meta.db_table)
+    # Both PostgreSQL and SQLite support INSERT ... ON CONFLICT DO UPDATE,
+    # which adds to an existing bucket atomically without a read first
+    column = _bucket_columns()
+    bucket = ', '.join(column[name] for name in ('dimension', 'period', 'period_start', 'key'))
+    sql = (
+        f"INSERT INTO {table} ({bucket}, {column['total_amount']}, {column['payment_count']}) "
+        f"VALUES (%s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({bucket}) DO UPDATE SET "
+        f"{column['total_amount']} = {table}.{column['total_amount']} + excluded.{column['total_amount']}, "
+        f"{column['payment_count']} = {table}.{column['payment_count']} + excluded.{column['payment_count']}"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, _params(deltas))
+
+
+def _shrink(deltas):
+    """Add deltas with a negative count onto the buckets that already exist"""
+    if not deltas:
+        return
+    table = connection.ops.quote_name(ContributionRollup._meta.db_table)
+    # A plain UPDATE: the proposed row of an upsert would fail the
+    # payment_count check before the conflict is seen
+    column = _bucket_columns()
+    sql = (
+        f"UPDATE {table} SET "
+        f"{column['total_amount']} = {column['total_amount']} + %s, "
+        f"{column['payment_count']} = {column['payment_count']} + %s "
+        f"WHERE {column['dimension']} = %s AND {column['period']} = %s "
+        f"AND {column['period_start']} = %s AND {column['key']} = %s"
+    )
+    params = [
+        (amount, count, dimension, period, period_start, key)
+        for dimension, period, period_start, key, amount, count in _params(deltas)
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def _apply(deltas):
+    _upsert({bucket: delta for bucket, delta in deltas.items() if delta[1] > 0 or (delta[1] == 0 and delta[0])})
+    _shrink({bucket: delta for bucket, delta in deltas.items() if delta[1] < 0})
+
+
+def _add_payments(deltas, payments, sign):
+    for payment in payments:
+        periods = _period_starts(payment.payment_date)
+        for dimension, key in _bucket_keys(payment).items():
+            for period, period_start in periods.items():
+                delta = deltas[(dimension, period, period_start, key)]
+                delta[0] += sign * payment.amount
+                delta[1] += sign
+    return deltas
+
+
+def _new_deltas():
+    return defaultdict(lambda: [Decimal('0'), 0])
+
+
+def record_completed_payments(payments):
+    """
+    Add newly COMPLETED payments to the rollups.
+
+    Call inside the transaction that completes them, exactly once per
+    payment, so the totals commit or roll back with the status change.
+    ``payments`` need ``member`` loaded with its family and cohort ids.
+    Family and cohort buckets follow the member's current membership, as
+    rebuild_rollups counts them; Member.save moves them when it changes.
+    """
+    _apply(_add_payments(_new_deltas(), payments, 1))
+
+
+def remove_completed_payments(payments):
+    """Take payments that are no longer COMPLETED back out of the rollups, as record_completed_payments adds them"""
+    _apply(_add_payments(_new_deltas(), payments, -1))
+
+
+def record_payment_change(before, after):
+    """
+    Move a saved payment between buckets.
+
+    ``before`` is the stored row (None for a new payment) and ``after`` the
+    payment as saved; whichever of them is COMPLETED counts, so leaving
+    COMPLETED subtracts and editing a COMPLETED payment moves its total.
+    """
+    deltas = _new_deltas()
+    if before is not None and before.status == 'COMPLETED':
+        _add_payments(deltas, [before], -1)
+    if after.status == 'COMPLETED':
+        _add_payments(deltas, [after], 1)
+    _apply(deltas)
+
+
+def move_member_rollups(member_id, before, after):
+    """
+    Move a member's COMPLETED totals to the family and cohort they now belong to.
+
+    ``before`` and ``after`` map ``family_id`` and ``cohort_id`` to the old
+    and new values. One GROUP BY over the member's payments gives the day
+    buckets, and the months are summed from those.
+    """
+    moves = [
+        (dimension, before[field], after[field])
+        for dimension, field in (('FAMILY', 'family_id'), ('COHORT', 'cohort_id'))
+        if before[field] != after[field]
+    ]
+    if not moves:
+        return
+    days = (
+        Payment.objects.filter(member_id=member_id, status='COMPLETED')
+        .annotate(day=TruncDate('payment_date')).values('day')
+        .annotate(amount=Sum('amount'), count=Count('id')).order_by()
+    )
+    deltas = _new_deltas()
+    for row in days:
+        for period, period_start in (('DAY', row['day']), ('MONTH', row['day'].replace(day=1))):
+            for dimension, old, new in moves:
+                for key, sign in ((old, -1), (new, 1)):
+                    if key is not None:
+                        delta = deltas[(dimension, period, period_start, str(key))]
+                        delta[0] += sign * row['amount']
+                        delta[1] += sign * row['count']
+    _apply(deltas)
+
+
+def rebuild_rollups(batch_size=5000, stdout=None):
+    """Recompute every bucket from payment history with GROUP BY queries"""
+    completed = Payment.objects.filter(status='COMPLETED')
+    truncations = {
+        'DAY': TruncDate('payment_date'),
+        'MONTH': Cast(TruncMonth('payment_date'), output_field=DateField()),
+    }
+    total = 0
+    with transaction.atomic():
+        ContributionRollup.objects.all().delete()
+        for dimension, lookup in DIMENSIONS.items():
+            for period, truncation in truncations.items():
+                rows = completed.annotate(
+                    bucket_start=truncation,
+                    bucket_key=F(lookup) if lookup else Value(''),
+                )
+                if lookup:
+                    rows = rows.exclude(**{f'{lookup}__isnull': True})
+                rows = rows.values('bucket_start', 'bucket_key').annotate(
+                    amount=Sum('amount'), count=Count('id')
+                ).order_by()
+                batch = []
+                for row in rows.iterator(chunk_size=batch_size):
+                    batch.append(ContributionRollup(
+                        dimension=dimension,
+                        period=period,
+                        period_start=row['bucket_start'],
+                        key=str(row['bucket_key']),
+                        total_amount=row['amount'],
+                        payment_count=row['count'],
+                    ))
+                    if len(batch) >= batch_size:
+                        ContributionRollup.objects.bulk_create(batch)
+                        total += len(batch)
+                        batch = []
+                if batch:
+                    ContributionRollup.objects.bulk_create(batch)
+                    total += len(batch)
+                if stdout is not None:
+                    stdout.write(f'Rebuilt {dimension} {period} buckets')
+    return total
@@ -0,0 +1,160 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Cookie telling later requests from a client that just wrote to read from the primary
+PIN_COOKIE = 'db_primary_until'
+
+# Seconds the replica is behind the primary; 0 when it has replayed everything
+# it received, as the last replay time stands still while the primary is idle
+LAG_SQL = (
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class RoutingState:
+    """Whether the current request must read from the primary"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('payments_db_routing', default=None)
+_replica_reads = contextvars.ContextVar('payments_replica_reads', default=False)
+
+# alias -> (usable, lag in seconds or None, time checked)
+_health = {}
+_health_lock = threading.Lock()
+
+
+def start_request(pin_cookie=None):
+    """Begin routing a request; returns the token end_request needs"""
+    try:
+        pinned = float(pin_cookie) > time.time()
+    except (TypeError, ValueError):
+        pinned = False
+    return _state.set(RoutingState(pinned))
+
+
+def end_request(token):
+    """Stop routing the request started with ``token``, returning its RoutingState"""
+    state = _state.get()
+    _state.reset(token)
+    return state
+
+
+@contextmanager
+def replica_reads():
+    """Let the reads made inside go to a replica"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def use_replica(view):
+    """Decorator for read-only views and viewset actions whose queries may be served by a replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def _check(alias):
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(LAG_SQL)
+                lag = float(cursor.fetchone()[0] or 0)
+            else:
+                cursor.execute('SELECT 1')
+                lag = 0.0
+    except DatabaseError as e:
+        logger.warning('Read replica %s is unavailable: %s', alias, e)
+        connection.close()
+        return False, None
+    usable = lag <= getattr(settings, 'REPLICA_MAX_LAG', 5)
+    if not usable:
+        logger.warning('Read replica %s is %.1fs behind the primary', alias, lag)
+    return usable, lag
+
+
+def healthy_replicas():
+    """Replicas that answered their last health check and were within REPLICA_MAX_LAG"""
+    interval = getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', 5)
+    now = time.monotonic()
+    healthy = []
+    for alias in getattr(settings, 'DATABASE_REPLICAS', ()):
+        entry = _health.get(alias)
+        if entry is None or now - entry[2] >= interval:
+            entry = (*_check(alias), now)
+            with _health_lock:
+                _health[alias] = entry
+        if entry[0]:
+            healthy.append(alias)
+    return healthy
+
+
+def replica_health():
+    """{alias: (usable, lag)} as of each replica's last health check"""
+    with _health_lock:
+        return {alias: entry[:2] for alias, entry in _health.items()}
+
+
+def read_alias():
+    """
+    Database to read from for replica-safe reads.
+
+    The primary while the request has written or its client wrote within
+    REPLICA_PIN_SECONDS, or when no replica is healthy; otherwise a random
+    healthy replica.
+    """
+    state = _state.get()
+    if state is not None and (state.pinned or state.wrote):
+        return DEFAULT_DB_ALIAS
+    replicas = healthy_replicas()
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """
+    Sends reads inside ``replica_reads`` to a healthy replica and everything else to the primary.
+
+    A write pins the rest of the request, and through PrimaryPinMiddleware
+    the client's next requests, to the primary so they read what they wrote.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return read_alias()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', ())}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db not in getattr(settings, 'DATABASE_REPLICAS', ())
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Family, Cohort, Member, PaymentCategory, Payment
+from .phone import clean_member_phone, normalize_phone_number
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,6 +27,9 @@ class MemberSerializer(serializers.ModelSerializer):
         model = Member
         fields = '__all__'
 
+    def validate_phone_number(self, value):
+        return clean_member_phone(value, member=self.instance)
+
 class PaymentCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = PaymentCategory
@@ -44,4 +48,11 @@ class MpesaPaymentSerializer(serializers.Serializer):
     amount = serializers.DecimalField(max_digits=10, decimal_places=2)
     payment_type = serializers.ChoiceField(choices=Payment.PAYMENT_TYPES)
     mission_payment_type = serializers.ChoiceField(choices=Payment.MISSION_PAYMENT_TYPES, required=False)
-    account_reference = serializers.CharField(required=False) 
\ No newline at end of file
+    account_reference = serializers.CharField(required=False)
+
+    def validate_phone_number(self, value):
+        # The same 254XXXXXXXXX form the push is sent with and members are found by
+        try:
+            return normalize_phone_number(value)
+        except ValueError:
+            raise serializers.ValidationError('Enter a valid Kenyan phone number, e.g. 0712345678.') 
\ No newline at end of file
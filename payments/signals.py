@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .dashboard import invalidate_all_dashboards, invalidate_dashboards, invalidate_user_dashboard
+from .lookups import invalidate_lookup
+from .models import Cohort, Family, Member, Payment, PaymentCategory
+from .rollups import remove_completed_payments
+
+# Queryset update() and bulk_create() send no signals; the code paths using
+# them on payments call invalidate_dashboards themselves, and lookup tables
+# changed that way are picked up when LOOKUP_CACHE_TIMEOUT expires.
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    invalidate_dashboards([instance.member_id])
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, **kwargs):
+    # Sent inside the deletion's transaction, so the totals go with the row
+    if instance.status == 'COMPLETED':
+        remove_completed_payments([instance])
+
+
+@receiver(post_save, sender=Member)
+def member_saved(sender, instance, **kwargs):
+    invalidate_dashboards([instance.pk])
+
+
+@receiver(post_delete, sender=Member)
+def member_deleted(sender, instance, **kwargs):
+    invalidate_dashboards([instance.pk])
+    invalidate_user_dashboard(instance.user_id, forget_member=True)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which the dashboard does not show
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_user_dashboard(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Family)
+def family_changed(sender, instance, **kwargs):
+    invalidate_lookup('family')
+    invalidate_all_dashboards()
+
+
+@receiver([post_save, post_delete], sender=Cohort)
+def cohort_changed(sender, instance, **kwargs):
+    invalidate_lookup('cohort')
+    invalidate_all_dashboards()
+
+
+@receiver([post_save, post_delete], sender=PaymentCategory)
+def payment_category_changed(sender, instance, **kwargs):
+    invalidate_lookup('payment_category')
@@ -0,0 +1,86 @@
+from contextlib import ExitStack
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from payments.models import Cohort, Family, Member, Payment, PaymentCategory
+
+# Maximum queries per request, which must also not grow with the row count.
+# Requests are made logged in, so every budget includes the session and user
+# lookups (2 queries).
+BUDGETS = {
+    '/api/payments/': 3,
+    '/api/members/': 3,
+    '/api/families/': 3,
+    '/api/cohorts/': 3,
+    '/api/payment-categories/': 3,
+    '/dashboard/': 5,
+    '/payment-history/': 4,
+}
+
+SMALL = 3
+LARGE = 30
+
+
+def seed(count, prefix):
+    """Add ``count`` rows to every listed table, returning a user whose member has ``count`` payments"""
+    family = Family.objects.create(name=f'{prefix} family')
+    cohort = Cohort.objects.create(name=f'{prefix} cohort', year=2025)
+    PaymentCategory.objects.bulk_create(
+        [PaymentCategory(name=f'{prefix} category {i}') for i in range(count)]
+    )
+    Family.objects.bulk_create([Family(name=f'{prefix} family {i}') for i in range(count)])
+    Cohort.objects.bulk_create([Cohort(name=f'{prefix} cohort {i}', year=2025) for i in range(count)])
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}-budget-{i}', first_name='Budget', last_name=str(i))
+        for i in range(count)
+    ])
+    members = Member.objects.bulk_create([
+        Member(user=user, family=family, cohort=cohort, phone_number=f'2547{i:08d}')
+        for i, user in enumerate(users)
+    ])
+    Payment.objects.bulk_create([
+        Payment(member=members[0], payment_type='TITHE', amount=10,
+                transaction_id=f'{prefix}-budget-{i}', status='COMPLETED')
+        for i in range(count)
+    ] + [
+        Payment(member=member, payment_type='OFFERING', amount=10,
+                transaction_id=f'{prefix}-budget-m{member.pk}', status='COMPLETED')
+        for member in members[1:]
+    ])
+    return members[0].user
+
+
+class QueryBudgetTests(TestCase):
+    """List endpoints run a fixed number of queries regardless of row count"""
+
+    # Replicas mirror the test database, and reads routed to them count too
+    databases = '__all__'
+
+    def measure(self, user, prefix):
+        """Queries each budgeted path runs for ``user``, on every database"""
+        counts = {}
+        client = Client()
+        client.force_login(user)
+        # A private cache per measurement, checked on every request, so nothing
+        # cached by an earlier one can answer
+        cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'budget-{prefix}'}
+        with override_settings(CACHES={'default': cache}, LOOKUP_CACHE_LOCAL_TTL=0):
+            for path in BUDGETS:
+                with ExitStack() as stack:
+                    captured = [
+                        stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in connections
+                    ]
+                    response = client.get(path)
+                self.assertEqual(response.status_code, 200, path)
+                counts[path] = sum(len(queries) for queries in captured)
+        return counts
+
+    def test_list_endpoints_stay_within_budget(self):
+        small = self.measure(seed(SMALL, 'small'), 'small')
+        large = self.measure(seed(LARGE, 'large'), 'large')
+        for path, budget in BUDGETS.items():
+            with self.subTest(path):
+                self.assertEqual(small[path], large[path], 'query count grows with rows')
+                self.assertLessEqual(large[path], budget)
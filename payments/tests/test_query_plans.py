@@ -0,0 +1,80 @@
+import re
+from datetime import date, datetime, timezone
+from unittest import skipUnless
+from django.db import connection
+from django.test import TestCase
+from payments.models import Member, Payment
+from payments.pagination import older_than
+from payments.queries import filter_payment_history, member_payments
+
+# A member id that need not exist, EXPLAIN only needs a value
+MEMBER_ID = 1
+
+
+def seeks_on(plan, column):
+    """Whether ``plan`` starts its index read at a bound on ``column`` rather than scanning the index"""
+    for line in plan.splitlines():
+        # SQLite: SEARCH ... USING INDEX ... (member_id=? AND payment_date<?)
+        if 'SEARCH' in line and re.search(rf'\b{column}\s*<', line):
+            return True
+        # PostgreSQL: Index Cond: ((member_id = 1) AND (payment_date <= ...))
+        if 'Index Cond' in line and re.search(rf'\b{column}\s*<', line):
+            return True
+    return False
+
+
+def access_patterns():
+    """
+    The hot queries, each with the indexes allowed to serve it and the
+    column the index read must be bounded on, if any.
+    """
+    member = Member(pk=MEMBER_ID)
+    history = member_payments(member)
+    return [
+        ('dashboard recent payments', member_payments(member)[:5],
+         ['payment_member_date_idx']),
+        ('history page after a cursor',
+         older_than(history, datetime(2025, 6, 1, tzinfo=timezone.utc), 1000).order_by('-payment_date', '-id')[:25],
+         ['payment_member_date_idx'], 'payment_date'),
+        ('history by type', filter_payment_history(history, {'payment_type': 'TITHE'}),
+         ['payment_member_type_date_idx']),
+        ('history by status', filter_payment_history(history, {'status': 'COMPLETED'}),
+         ['payment_member_status_date_idx']),
+        ('history by date range', filter_payment_history(history, {
+            'date_from': date(2025, 1, 1).isoformat(),
+            'date_to': date(2025, 12, 31).isoformat(),
+        }), ['payment_member_date_idx']),
+        ('history by type and date range', filter_payment_history(history, {
+            'payment_type': 'MISSION',
+            'date_from': date(2025, 1, 1).isoformat(),
+        }), ['payment_member_type_date_idx', 'payment_member_date_idx']),
+        ('member by phone number', Member.objects.filter(msisdn='254712345678'),
+         ['msisdn', 'sqlite_autoindex_payments_member']),
+        ('callback by CheckoutRequestID', Payment.objects.filter(checkout_request_id='ws_CO_1'),
+         ['checkout_request_id', 'sqlite_autoindex_payments_payment']),
+        ('pending payment sweep', Payment.objects.filter(status='PENDING').order_by('payment_date')[:1000],
+         ['payment_pending_date_idx']),
+    ]
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'Query plan checks support PostgreSQL and SQLite')
+class QueryPlanTests(TestCase):
+    """The payment access patterns are planned on their indexes"""
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Small or empty tables would otherwise be planned as sequential scans;
+            # SET LOCAL ends with the transaction wrapping the test
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_access_patterns_use_their_indexes(self):
+        for name, queryset, indexes, *seek in access_patterns():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertTrue(
+                    any(index in plan for index in indexes),
+                    f'expected one of {", ".join(indexes)}:\n{plan}',
+                )
+                for column in seek:
+                    self.assertTrue(seeks_on(plan, column), f'index read not bounded on {column}:\n{plan}')
@@ -0,0 +1,192 @@
+import threading
+import time
+from django.conf import settings
+
+
+class AccessToken:
+    """An OAuth access token and the wall-clock time it expires at"""
+
+    def __init__(self, value, expires_at):
+        self.value = value
+        self.expires_at = expires_at
+
+    def seconds_left(self, now=None):
+        return self.expires_at - (now if now is not None else time.time())
+
+    def to_dict(self):
+        return {'value': self.value, 'expires_at': self.expires_at}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['value'], data['expires_at'])
+
+
+class TokenStore:
+    """
+    Process-wide store for M-Pesa OAuth tokens.
+
+    Tokens are kept per credential key. A token that is close to expiry is
+    still served while a single background thread refreshes it, and callers
+    that find no usable token share one fetch instead of each hitting the
+    OAuth endpoint. When a Django cache alias is configured the token is also
+    shared with every other worker process through that cache.
+    """
+
+    # Fallback lifetime when Daraja does not send expires_in
+    DEFAULT_TTL = 3599
+
+    def __init__(self, refresh_margin=300, cache_alias=None, lock_timeout=30):
+        self.refresh_margin = refresh_margin
+        self.cache_alias = cache_alias
+        self.lock_timeout = lock_timeout
+        self._tokens = {}
+        self._locks = {}
+        self._refreshing = set()
+        self._guard = threading.Lock()
+
+    @property
+    def cache(self):
+        if not self.cache_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def _lock_for(self, key):
+        with self._guard:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _cache_key(self, key):
+        return f'mpesa:token:{key}'
+
+    def _load(self, key):
+        token = self._tokens.get(key)
+        if token is not None and token.seconds_left() > 0:
+            return token
+        cache = self.cache
+        if cache is not None:
+            data = cache.get(self._cache_key(key))
+            if data:
+                token = AccessToken.from_dict(data)
+                if token.seconds_left() > 0:
+                    self._tokens[key] = token
+                    return token
+        return None
+
+    def _save(self, key, token):
+        self._tokens[key] = token
+        cache = self.cache
+        if cache is not None:
+            cache.set(self._cache_key(key), token.to_dict(), timeout=max(int(token.seconds_left()), 1))
+
+    def _fetch(self, key, fetch):
+        value, expires_in = fetch()
+        try:
+            expires_in = int(expires_in)
+        except (TypeError, ValueError):
+            expires_in = self.DEFAULT_TTL
+        token = AccessToken(value, time.time() + expires_in)
+        self._save(key, token)
+        return token
+
+    def _fetch_shared(self, key, fetch):
+        """Fetch a token, letting only one process at a time call the OAuth endpoint"""
+        cache = self.cache
+        if cache is None:
+            return self._fetch(key, fetch)
+
+        lock_key = f'{self._cache_key(key)}:lock'
+        deadline = time.time() + self.lock_timeout
+        while not cache.add(lock_key, 1, timeout=self.lock_timeout):
+            # Another worker is fetching, wait for it to publish the token
+            time.sleep(0.05)
+            token = self._load(key)
+            if token is not None and token.seconds_left() > self.refresh_margin:
+                return token
+            if time.time() > deadline:
+                # The holder died or is stuck, fetch ourselves
+                return self._fetch(key, fetch)
+        try:
+            token = self._load(key)
+            if token is not None and token.seconds_left() > self.refresh_margin:
+                return token
+            return self._fetch(key, fetch)
+        finally:
+            cache.delete(lock_key)
+
+    def _refresh_in_background(self, key, fetch):
+        with self._guard:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                with self._lock_for(key):
+                    token = self._load(key)
+                    if token is None or token.seconds_left() <= self.refresh_margin:
+                        self._fetch_shared(key, fetch)
+            except Exception:
+                # The current token is still valid, the next caller retries
+                pass
+            finally:
+                with self._guard:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='mpesa-token-refresh', daemon=True).start()
+
+    def get_token(self, key, fetch):
+        """
+        Return a valid access token for ``key``.
+
+        ``fetch`` is called with no arguments and must return a
+        ``(token, expires_in)`` tuple from the OAuth endpoint.
+        """
+        token = self._load(key)
+        if token is not None:
+            if token.seconds_left() <= self.refresh_margin:
+                self._refresh_in_background(key, fetch)
+            return token.value
+
+        with self._lock_for(key):
+            # Another thread may have fetched while we waited for the lock
+            token = self._load(key)
+            if token is None:
+                token = self._fetch_shared(key, fetch)
+            return token.value
+
+    def peek(self, key):
+        """Return the stored token for ``key`` if it is valid and not due for refresh"""
+        token = self._load(key)
+        if token is not None and token.seconds_left() > self.refresh_margin:
+            return token.value
+        return None
+
+    def put(self, key, value, expires_in):
+        """Store a token fetched outside the store, e.g. by the asyncio client"""
+        self._fetch(key, lambda: (value, expires_in))
+
+    def invalidate(self, key):
+        """Drop a token, e.g. after Daraja rejects it as expired"""
+        self._tokens.pop(key, None)
+        cache = self.cache
+        if cache is not None:
+            cache.delete(self._cache_key(key))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_token_store():
+    """Return the process-wide token store, configured from settings"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TokenStore(
+                    refresh_margin=getattr(settings, 'MPESA_TOKEN_REFRESH_MARGIN', 300),
+                    cache_alias=getattr(settings, 'MPESA_TOKEN_CACHE_ALIAS', None),
+                )
+    return _store
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, SSLError
+from urllib3.util.retry import Retry
+from django.conf import settings
+from .metrics import record_daraja_call
+
+
+class DarajaTransport:
+    """
+    Shared HTTP transport for Daraja calls.
+
+    Holds one keep-alive ``requests.Session`` per process with sized
+    connection pools and default connect/read timeouts. Idempotent requests
+    (the OAuth GET) are retried with jittered exponential backoff; the STK
+    push POST is never retried automatically since Safaricom would prompt
+    the customer twice.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, connect_timeout=5,
+                 read_timeout=30, max_retries=3, backoff_factor=0.5, backoff_jitter=0.5):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self._session = None
+        self._adapter = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _build_retry(self):
+        return Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            backoff_jitter=self.backoff_jitter,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+
+    @property
+    def session(self):
+        # A session inherited through fork shares sockets with the parent, so
+        # every process builds its own
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize,
+                        max_retries=self._build_retry(),
+                    )
+                    session = requests.Session()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._adapter = adapter
+                    self._session = session
+                    self._pid = pid
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            record_daraja_call(urlsplit(url).path, status, time.perf_counter() - start)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def pool_stats(self):
+        """Return connection pool usage for this process, one entry per host"""
+        stats = []
+        if self._adapter is None or self._pid != os.getpid():
+            return stats
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            in_use = max(pool.pool.maxsize - pool.pool.qsize(), 0)
+            stats.append({
+                'host': f'{pool.scheme}://{pool.host}:{pool.port}',
+                'maxsize': pool.pool.maxsize,
+                'in_use': in_use,
+                'idle': idle,
+                'new_connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'reused_connections': max(pool.num_requests - pool.num_connections, 0),
+            })
+        return stats
+
+
+# Raised before anything is written to the socket
+UNSENT_ERRORS = (
+    requests.exceptions.ConnectTimeout,
+    requests.exceptions.SSLError,
+    requests.exceptions.URLRequired,
+    requests.exceptions.MissingSchema,
+    requests.exceptions.InvalidSchema,
+    requests.exceptions.InvalidURL,
+    requests.exceptions.InvalidHeader,
+)
+
+
+def may_have_been_received(error):
+    """
+    Whether Daraja may have received a request that failed with ``error``.
+
+    Only failing to connect proves it did not. A read timeout or a
+    connection reset can come after Daraja acted on the request.
+    """
+    if isinstance(error, UNSENT_ERRORS):
+        return False
+    if isinstance(error, requests.exceptions.ConnectionError):
+        # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return not isinstance(reason, (ConnectTimeoutError, SSLError))
+    return True
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the process-wide Daraja transport, configured from settings"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = DarajaTransport(
+                    pool_connections=getattr(settings, 'MPESA_POOL_CONNECTIONS', 10),
+                    pool_maxsize=getattr(settings, 'MPESA_POOL_MAXSIZE', 20),
+                    connect_timeout=getattr(settings, 'MPESA_CONNECT_TIMEOUT', 5),
+                    read_timeout=getattr(settings, 'MPESA_READ_TIMEOUT', 30),
+                    max_retries=getattr(settings, 'MPESA_MAX_RETRIES', 3),
+                    backoff_factor=getattr(settings, 'MPESA_RETRY_BACKOFF', 0.5),
+                )
+    return _transport
@@ -2,7 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     FamilyViewSet, CohortViewSet, MemberViewSet,
-    PaymentCategoryViewSet, PaymentViewSet
+    PaymentCategoryViewSet, PaymentViewSet, mpesa_pool_stats, export_payments,
+    async_api_initiate_payment, async_mpesa_callback, ReportViewSet
 )
 
 router = DefaultRouter()
@@ -11,7 +12,13 @@ router.register(r'cohorts', CohortViewSet)
 router.register(r'members', MemberViewSet)
 router.register(r'payment-categories', PaymentCategoryViewSet)
 router.register(r'payments', PaymentViewSet)
+router.register(r'reports', ReportViewSet, basename='report')
 
 urlpatterns = [
+    path('mpesa/pool-stats/', mpesa_pool_stats, name='mpesa_pool_stats'),
+    # Before the router so "export" is not taken for a payment id
+    path('payments/export/', export_payments, name='export_payments'),
+    path('async/payments/initiate_payment/', async_api_initiate_payment, name='async_api_initiate_payment'),
+    path('async/payments/mpesa_callback/', async_mpesa_callback, name='async_mpesa_callback'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -1,22 +1,51 @@
 from django.shortcuts import render, redirect
+from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.core.handlers.wsgi import WSGIRequest
+from django.db.models import F
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from asgiref.sync import sync_to_async
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import Family, Cohort, Member, PaymentCategory, Payment
+from .models import Family, Cohort, Member, PaymentCategory, Payment, StkPushJob, ContributionRollup
 from .serializers import (
     FamilySerializer, CohortSerializer, MemberSerializer,
     PaymentCategorySerializer, PaymentSerializer, MpesaPaymentSerializer
 )
 from .mpesa import MpesaClient
+from .mpesa_async import AsyncMpesaClient
+from .resilience import DarajaUnavailable
+from .metrics import render_metrics
+from .transport import get_transport
+from .jobs import async_initiation_enabled, enqueue_stk_push, pending_payment_for, apply_stk_response
+from .callbacks import ACKNOWLEDGEMENT, arecord_callback, record_callback
+from .queries import filter_payment_history, member_payments, parse_date
+from .pagination import PaymentCursorPagination, keyset_paginate
+from .export import CONTENT_TYPES, export_queryset, iter_export
+from .dashboard import get_dashboard
+from .lookups import CachedModelChoiceField, get_lookup
+from .events import (
+    astream_events, checkout_channel, get_broker, live_updates_enabled, member_channel, stream_events,
+)
+from .phone import clean_member_phone, to_msisdn
+from .routers import read_alias, use_replica
 from django.contrib.auth.forms import UserCreationForm
 from django import forms
-from datetime import datetime
+import json
 from django.core.exceptions import ImproperlyConfigured
 
+DARAJA_BUSY_MESSAGE = 'M-Pesa is not responding right now. Please try again shortly.'
+
 class MemberRegistrationForm(UserCreationForm):
     phone_number = forms.CharField(
         max_length=15,
@@ -24,14 +53,14 @@ class MemberRegistrationForm(UserCreationForm):
         help_text='Enter your M-Pesa phone number',
         widget=forms.TextInput(attrs={'class': 'form-control'})
     )
-    family = forms.ModelChoiceField(
-        queryset=Family.objects.all(),
+    family = CachedModelChoiceField(
+        'family',
         required=True,
         help_text='Select your family',
         widget=forms.Select(attrs={'class': 'form-select'})
     )
-    cohort = forms.ModelChoiceField(
-        queryset=Cohort.objects.all(),
+    cohort = CachedModelChoiceField(
+        'cohort',
         required=True,
         help_text='Select your cohort',
         widget=forms.Select(attrs={'class': 'form-select'})
@@ -57,10 +86,15 @@ class MemberRegistrationForm(UserCreationForm):
             if isinstance(field.widget, (forms.TextInput, forms.EmailInput, forms.PasswordInput)):
                 field.widget.attrs['class'] = 'form-control'
 
+    def clean_phone_number(self):
+        return clean_member_phone(self.cleaned_data['phone_number'])
+
 class ProfileUpdateForm(forms.ModelForm):
     first_name = forms.CharField(max_length=30, required=True)
     last_name = forms.CharField(max_length=30, required=True)
     email = forms.EmailField(required=True)
+    family = CachedModelChoiceField('family')
+    cohort = CachedModelChoiceField('cohort')
     
     class Meta:
         model = Member
@@ -73,15 +107,25 @@ class ProfileUpdateForm(forms.ModelForm):
             self.fields['last_name'].initial = self.instance.user.last_name
             self.fields['email'].initial = self.instance.user.email
 
+    def clean_phone_number(self):
+        return clean_member_phone(self.cleaned_data['phone_number'], member=self.instance)
+
+def create_placeholder_member(user):
+    """Basic member profile for a user without one, to be completed on the profile page"""
+    # The username stands in for the phone number until the user updates it,
+    # unless it is a number another member is already registered with
+    phone_number = user.username
+    msisdn = to_msisdn(phone_number)
+    if msisdn is not None and Member.objects.filter(msisdn=msisdn).exists():
+        phone_number = ''
+    return Member.objects.create(user=user, phone_number=phone_number)
+
 @login_required
 def profile_update(request):
     try:
         member = Member.objects.get(user=request.user)
     except Member.DoesNotExist:
-        member = Member.objects.create(
-            user=request.user,
-            phone_number=request.user.username
-        )
+        member = create_placeholder_member(request.user)
     
     if request.method == 'POST':
         form = ProfileUpdateForm(request.POST, instance=member)
@@ -102,8 +146,8 @@ def profile_update(request):
     
     return render(request, 'profile_update.html', {
         'form': form,
-        'families': Family.objects.all(),
-        'cohorts': Cohort.objects.all()
+        'families': get_lookup('family').objects,
+        'cohorts': get_lookup('cohort').objects
     })
 
 def register(request):
@@ -130,8 +174,8 @@ def register(request):
     
     return render(request, 'registration/register.html', {
         'form': form,
-        'families': Family.objects.all(),
-        'cohorts': Cohort.objects.all()
+        'families': get_lookup('family').objects,
+        'cohorts': get_lookup('cohort').objects
     })
 
 def home(request):
@@ -140,63 +184,44 @@ def home(request):
 
 @login_required
 def dashboard(request):
-    try:
-        member = Member.objects.get(user=request.user)
-    except Member.DoesNotExist:
+    data = get_dashboard(request.user)
+    if data is None:
         # Create a basic member profile if it doesn't exist
-        member = Member.objects.create(
-            user=request.user,
-            phone_number=request.user.username  # Temporary, user should update this
-        )
+        create_placeholder_member(request.user)
         messages.warning(request, 'Please update your profile with your correct phone number.')
-    
-    payments = Payment.objects.filter(member=member).order_by('-payment_date')
+        data = get_dashboard(request.user)
+
     return render(request, 'dashboard.html', {
-        'member': member,
-        'payments': payments
+        'profile': data['profile'],
+        'payments': data['recent_payments'],
+        'totals': data['totals'],
+        # The page listens for results instead of being reloaded by hand, when they can reach it
+        'awaiting_result': live_updates_enabled() and any(
+            payment['status'] == 'PENDING' for payment in data['recent_payments']
+        ),
     })
 
 @login_required
+@use_replica
 def payment_history(request):
     try:
         member = Member.objects.get(user=request.user)
     except Member.DoesNotExist:
         # Create a basic member profile if it doesn't exist
-        member = Member.objects.create(
-            user=request.user,
-            phone_number=request.user.username  # Temporary, user should update this
-        )
+        member = create_placeholder_member(request.user)
         messages.warning(request, 'Please update your profile with your correct phone number.')
     
-    payments = Payment.objects.filter(member=member)
-    
     # Apply filters
-    payment_type = request.GET.get('payment_type')
-    status = request.GET.get('status')
-    date_from = request.GET.get('date_from')
-    date_to = request.GET.get('date_to')
-    
-    if payment_type:
-        payments = payments.filter(payment_type=payment_type)
-    if status:
-        payments = payments.filter(status=status)
-    if date_from:
-        try:
-            date_from = datetime.strptime(date_from, '%Y-%m-%d')
-            payments = payments.filter(payment_date__date__gte=date_from)
-        except ValueError:
-            pass
-    if date_to:
-        try:
-            date_to = datetime.strptime(date_to, '%Y-%m-%d')
-            payments = payments.filter(payment_date__date__lte=date_to)
-        except ValueError:
-            pass
-    
-    payments = payments.order_by('-payment_date')
+    payments = filter_payment_history(member_payments(member), request.GET)
+    page = keyset_paginate(
+        payments,
+        cursor=request.GET.get('cursor'),
+        page_size=getattr(settings, 'PAYMENT_HISTORY_PAGE_SIZE', 25)
+    )
     
     return render(request, 'payment_history.html', {
-        'payments': payments
+        'payments': page.items,
+        'page': page
     })
 
 @login_required
@@ -216,6 +241,26 @@ def initiate_payment(request):
                 messages.error(request, 'Please update your profile with a valid phone number.')
                 return redirect('profile_update')
 
+            if async_initiation_enabled():
+                try:
+                    enqueue_stk_push(
+                        member=member,
+                        amount=amount,
+                        payment_type=payment_type,
+                        mission_payment_type=mission_type,
+                        account_reference=f"MMUSDA_{payment_type}"
+                    )
+                    messages.success(request, 'Payment request received. You will get an M-Pesa prompt on your phone shortly.')
+                except ValueError as e:
+                    messages.error(request, str(e))
+                return redirect('dashboard')
+
+            try:
+                payment = pending_payment_for(member, amount, payment_type, mission_type)
+            except ValueError as e:
+                messages.error(request, str(e))
+                return redirect('dashboard')
+
             try:
                 mpesa_client = MpesaClient()
                 response = mpesa_client.initiate_stk_push(
@@ -225,10 +270,13 @@ def initiate_payment(request):
                 )
 
                 if response.get('ResponseCode') == '0':
+                    apply_stk_response(payment, response).save()
                     messages.success(request, 'Payment initiated. Please check your phone to complete the transaction.')
                 else:
                     error_message = response.get('errorMessage', 'Failed to initiate payment. Please try again.')
                     messages.error(request, error_message)
+            except DarajaUnavailable:
+                messages.error(request, DARAJA_BUSY_MESSAGE)
             except ImproperlyConfigured as e:
                 messages.error(request, str(e))
             except Exception as e:
@@ -240,26 +288,261 @@ def initiate_payment(request):
 
     return redirect('dashboard')
 
+# Async views, served without blocking a worker when running under ASGI
+@login_required
+async def async_initiate_payment(request):
+    if request.method != 'POST':
+        return redirect('dashboard')
+
+    user = await request.auser()
+    try:
+        member = await Member.objects.aget(user=user)
+    except Member.DoesNotExist:
+        await sync_to_async(messages.error)(request, 'Please complete your profile before making a payment.')
+        return redirect('profile_update')
+
+    amount = request.POST.get('amount')
+    payment_type = request.POST.get('payment_type')
+    mission_type = request.POST.get('mission_payment_type')
+
+    if not amount:
+        await sync_to_async(messages.error)(request, 'Please enter a valid amount.')
+        return redirect('dashboard')
+
+    if not member.phone_number:
+        await sync_to_async(messages.error)(request, 'Please update your profile with a valid phone number.')
+        return redirect('profile_update')
+
+    try:
+        payment = pending_payment_for(member, amount, payment_type, mission_type)
+    except ValueError as e:
+        await sync_to_async(messages.error)(request, str(e))
+        return redirect('dashboard')
+
+    try:
+        mpesa_client = AsyncMpesaClient()
+        response = await mpesa_client.initiate_stk_push(
+            phone_number=member.phone_number,
+            amount=amount,
+            account_reference=f"MMUSDA_{payment_type}"
+        )
+
+        if response.get('ResponseCode') == '0':
+            await apply_stk_response(payment, response).asave()
+            await sync_to_async(messages.success)(request, 'Payment initiated. Please check your phone to complete the transaction.')
+        else:
+            error_message = response.get('errorMessage', 'Failed to initiate payment. Please try again.')
+            await sync_to_async(messages.error)(request, error_message)
+    except DarajaUnavailable:
+        await sync_to_async(messages.error)(request, DARAJA_BUSY_MESSAGE)
+    except ImproperlyConfigured as e:
+        await sync_to_async(messages.error)(request, str(e))
+    except Exception as e:
+        await sync_to_async(messages.error)(request, f'An error occurred: {str(e)}')
+
+    return redirect('dashboard')
+
+@csrf_exempt
+@require_POST
+async def async_api_initiate_payment(request):
+    """Async counterpart of PaymentViewSet.initiate_payment"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid JSON body.'}, status=400)
+
+    serializer = MpesaPaymentSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    payment_type = serializer.validated_data['payment_type']
+    account_reference = f"MMUSDA_{payment_type}"
+    if payment_type == 'MISSION':
+        mission_type = serializer.validated_data.get('mission_payment_type')
+        if mission_type:
+            account_reference = f"{account_reference}_{mission_type}"
+
+    member = await Member.objects.filter(msisdn=serializer.validated_data['phone_number']).afirst()
+
+    try:
+        response = await AsyncMpesaClient().initiate_stk_push(
+            phone_number=serializer.validated_data['phone_number'],
+            amount=serializer.validated_data['amount'],
+            account_reference=account_reference
+        )
+    except DarajaUnavailable as e:
+        response = JsonResponse({'detail': DARAJA_BUSY_MESSAGE}, status=503)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+    except ImproperlyConfigured as e:
+        return JsonResponse({'detail': str(e)}, status=503)
+    except Exception as e:
+        return JsonResponse({'detail': str(e)}, status=502)
+
+    # Record the push so its callback resolves by CheckoutRequestID
+    if member is not None and response.get('ResponseCode') == '0':
+        payment = pending_payment_for(
+            member, serializer.validated_data['amount'], payment_type,
+            serializer.validated_data.get('mission_payment_type')
+        )
+        await apply_stk_response(payment, response).asave()
+    return JsonResponse(response)
+
+@csrf_exempt
+@require_POST
+async def async_mpesa_callback(request):
+    """Async counterpart of PaymentViewSet.mpesa_callback"""
+    try:
+        callback_data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'status': 'failed', 'message': 'Invalid JSON body'}, status=400)
+
+    await arecord_callback(callback_data)
+    return JsonResponse(ACKNOWLEDGEMENT)
+
+async def payment_events(request):
+    """
+    Server-sent events announcing payment results.
+
+    A logged-in member receives the results of all their payments. With
+    ``?checkout_request_id=`` the stream follows one STK push of theirs
+    (any push for staff) and closes once it settles.
+    """
+    if not live_updates_enabled():
+        # Nothing published by process_callbacks would arrive; don't hold a worker waiting
+        return JsonResponse({'detail': 'Live payment updates are not enabled.'}, status=503)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    checkout_request_id = request.GET.get('checkout_request_id')
+    if checkout_request_id:
+        channel = checkout_channel(checkout_request_id)
+    else:
+        member_id = await Member.objects.filter(user=user).values_list('id', flat=True).afirst()
+        if member_id is None:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+        channel = member_channel(member_id)
+
+    # Under WSGI the stream is iterated by the worker thread, under ASGI on the event loop
+    asynchronous = not isinstance(request, WSGIRequest)
+    subscription = get_broker().subscribe([channel], asynchronous=asynchronous)
+    initial = None
+    if checkout_request_id:
+        # Subscribed first, so a result landing in between is not missed
+        payments = Payment.objects.filter(checkout_request_id=checkout_request_id)
+        if not user.is_staff:
+            payments = payments.filter(member__user=user)
+        initial = await (
+            payments
+            .values('member_id', 'checkout_request_id', 'status', receipt_number=F('mpesa_receipt_number'))
+            .afirst()
+        )
+        if initial is None:
+            subscription.close()
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    stream = astream_events if asynchronous else stream_events
+    response = StreamingHttpResponse(
+        stream(subscription, initial, close_on_final=bool(checkout_request_id)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@staff_member_required
+def mpesa_pool_stats(request):
+    """Connection pool usage of this worker's Daraja transport"""
+    return JsonResponse({'pools': get_transport().pool_stats()})
+
+def metrics(request):
+    """This process's request, database and Daraja metrics for Prometheus"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def export_payments(request):
+    """
+    Stream every payment matching the payment_history filters, plus
+    ``family``, ``cohort`` and ``member``, as CSV or (``?format=xlsx``) XLSX.
+    """
+    file_format = request.GET.get('format', 'csv')
+    if file_format not in CONTENT_TYPES:
+        return JsonResponse({'error': f'Unsupported format: {file_format}'}, status=400)
+    try:
+        payments = export_queryset(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    # Chosen now, as the rows are read after the view has returned
+    payments = payments.using(read_alias())
+    response = StreamingHttpResponse(
+        iter_export(payments, file_format),
+        content_type=CONTENT_TYPES[file_format],
+    )
+    filename = f"payments-{timezone.localdate():%Y%m%d}.{file_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 # API ViewSets
-class FamilyViewSet(viewsets.ModelViewSet):
+class CachedLookupListMixin:
+    """Serves list requests from the lookup cache with ETag/Last-Modified validators"""
+    lookup_table = None
+
+    def list(self, request, *args, **kwargs):
+        table = get_lookup(self.lookup_table)
+        response = get_conditional_response(request, etag=table.etag, last_modified=int(table.modified))
+        if response is None:
+            response = Response(self.get_serializer(table.objects, many=True).data)
+        response['ETag'] = table.etag
+        response['Last-Modified'] = http_date(table.modified)
+        # Clients may keep the copy but must revalidate it
+        patch_cache_control(response, no_cache=True)
+        return response
+
+class ReplicaListMixin:
+    """Serves list requests from a read replica when one is configured and healthy"""
+
+    @use_replica
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+class FamilyViewSet(CachedLookupListMixin, viewsets.ModelViewSet):
     queryset = Family.objects.all()
     serializer_class = FamilySerializer
+    lookup_table = 'family'
 
-class CohortViewSet(viewsets.ModelViewSet):
+class CohortViewSet(CachedLookupListMixin, viewsets.ModelViewSet):
     queryset = Cohort.objects.all()
     serializer_class = CohortSerializer
+    lookup_table = 'cohort'
 
-class MemberViewSet(viewsets.ModelViewSet):
-    queryset = Member.objects.all()
+class MemberViewSet(ReplicaListMixin, viewsets.ModelViewSet):
+    # Everything MemberSerializer reads, fetched in one joined query
+    queryset = Member.objects.select_related('user', 'family', 'cohort').only(
+        'id', 'phone_number', 'msisdn', 'is_amo', 'is_alo', 'user', 'family', 'cohort',
+        'user__id', 'user__username', 'user__email', 'user__first_name', 'user__last_name',
+        'family__name', 'cohort__name'
+    )
     serializer_class = MemberSerializer
 
-class PaymentCategoryViewSet(viewsets.ModelViewSet):
+class PaymentCategoryViewSet(CachedLookupListMixin, viewsets.ModelViewSet):
     queryset = PaymentCategory.objects.all()
     serializer_class = PaymentCategorySerializer
+    lookup_table = 'payment_category'
 
-class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all()
+class PaymentViewSet(ReplicaListMixin, viewsets.ModelViewSet):
+    # PaymentSerializer also reads the member's name and family name
+    queryset = Payment.objects.select_related('member__user', 'member__family').only(
+        *[field.name for field in Payment._meta.concrete_fields],
+        'member__user', 'member__family',
+        'member__user__first_name', 'member__user__last_name', 'member__family__name'
+    ).order_by('-payment_date', '-id')
     serializer_class = PaymentSerializer
+    pagination_class = PaymentCursorPagination
 
     @action(detail=False, methods=['post'])
     def initiate_payment(self, request):
@@ -276,40 +559,119 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 if mission_type:
                     account_reference = f"{account_reference}_{mission_type}"
 
+            if async_initiation_enabled():
+                member = Member.objects.filter(msisdn=phone_number).first()
+                if member is None:
+                    return Response({'phone_number': ['No member is registered with this phone number.']},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                job = enqueue_stk_push(
+                    member=member,
+                    amount=amount,
+                    payment_type=payment_type,
+                    mission_payment_type=serializer.validated_data.get('mission_payment_type'),
+                    account_reference=account_reference,
+                    phone_number=phone_number
+                )
+                return Response({
+                    'job_id': job.id,
+                    'payment_id': job.payment_id,
+                    'status': job.status
+                }, status=status.HTTP_202_ACCEPTED)
+
             # Initialize M-Pesa payment
-            mpesa_client = MpesaClient()
-            response = mpesa_client.initiate_stk_push(
-                phone_number=phone_number,
-                amount=amount,
-                account_reference=account_reference
-            )
+            try:
+                mpesa_client = MpesaClient()
+                response = mpesa_client.initiate_stk_push(
+                    phone_number=phone_number,
+                    amount=amount,
+                    account_reference=account_reference
+                )
+            except DarajaUnavailable as e:
+                return Response({'detail': DARAJA_BUSY_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                headers={'Retry-After': str(e.retry_after)})
+
+            # Record the push so its callback resolves by CheckoutRequestID
+            member = Member.objects.filter(msisdn=phone_number).first()
+            if member is not None and response.get('ResponseCode') == '0':
+                payment = pending_payment_for(
+                    member, amount, payment_type,
+                    serializer.validated_data.get('mission_payment_type')
+                )
+                apply_stk_response(payment, response).save()
 
             return Response(response)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['get'], url_path='status')
+    def payment_status(self, request, pk=None):
+        """Lightweight progress check for a payment and its STK push job"""
+        payment = (
+            Payment.objects.filter(pk=pk)
+            .values('id', 'status', 'transaction_id', 'checkout_request_id', 'mpesa_receipt_number')
+            .first()
+        )
+        if payment is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        payment['job'] = (
+            StkPushJob.objects.filter(payment_id=pk)
+            .values('id', 'status', 'attempts', 'error', 'updated_at')
+            .first()
+        )
+        return Response(payment)
+
     @action(detail=False, methods=['post'])
     def mpesa_callback(self, request):
         """Handle M-Pesa callback"""
-        callback_data = request.data
-        
-        # Extract relevant data from callback
-        result_code = callback_data.get('ResultCode')
-        if result_code == 0:  # Successful payment
-            member = get_object_or_404(Member, phone_number=callback_data.get('PhoneNumber'))
-            
-            # Create payment record
-            payment = Payment.objects.create(
-                member=member,
-                payment_type=callback_data.get('TransactionType'),
-                amount=callback_data.get('Amount'),
-                transaction_id=callback_data.get('TransactionID'),
-                status='COMPLETED',
-                mpesa_receipt_number=callback_data.get('MpesaReceiptNumber')
-            )
-            
-            return Response({'status': 'success', 'payment_id': payment.id})
-        
-        return Response({'status': 'failed', 'message': 'Payment failed'})
+        # Store the raw payload and acknowledge; process_callbacks applies it
+        record_callback(request.data)
+        return Response(ACKNOWLEDGEMENT)
+
+class ReportViewSet(viewsets.ViewSet):
+    """
+    Contribution totals from the precomputed rollups.
+
+    Query parameters: ``dimension`` (ALL, MEMBER, FAMILY, COHORT,
+    PAYMENT_TYPE or MISSION_TYPE, default PAYMENT_TYPE), ``period`` (DAY or
+    MONTH, default MONTH), ``date_from``/``date_to`` (YYYY-MM-DD, bucket
+    start dates) and ``key`` to select a single family, cohort, type, etc.
+    """
+
+    @use_replica
+    def list(self, request):
+        dimension = request.query_params.get('dimension', 'PAYMENT_TYPE').upper()
+        period = request.query_params.get('period', 'MONTH').upper()
+        if dimension not in dict(ContributionRollup.DIMENSION_CHOICES):
+            return Response({'dimension': [f'Unknown dimension: {dimension}']}, status=status.HTTP_400_BAD_REQUEST)
+        if period not in dict(ContributionRollup.PERIOD_CHOICES):
+            return Response({'period': [f'Unknown period: {period}']}, status=status.HTTP_400_BAD_REQUEST)
+
+        rollups = ContributionRollup.objects.filter(dimension=dimension, period=period)
+        date_from = parse_date(request.query_params.get('date_from'))
+        date_to = parse_date(request.query_params.get('date_to'))
+        if date_from:
+            rollups = rollups.filter(period_start__gte=date_from)
+        if date_to:
+            rollups = rollups.filter(period_start__lte=date_to)
+        if request.query_params.get('key'):
+            rollups = rollups.filter(key=request.query_params['key'])
+
+        rows = list(rollups.order_by('period_start', 'key').values(
+            'period_start', 'key', 'total_amount', 'payment_count'
+        ))
+
+        labels = {}
+        if dimension == 'FAMILY':
+            labels = {str(family.pk): family.name for family in get_lookup('family').objects}
+        elif dimension == 'COHORT':
+            labels = {str(cohort.pk): str(cohort) for cohort in get_lookup('cohort').objects}
+        elif dimension == 'PAYMENT_TYPE':
+            labels = dict(Payment.PAYMENT_TYPES)
+        elif dimension == 'MISSION_TYPE':
+            labels = dict(Payment.MISSION_PAYMENT_TYPES)
+        for row in rows:
+            row['label'] = labels.get(row['key'], row['key'])
+
+        return Response({'dimension': dimension, 'period': period, 'results': rows})
 
 class FamilyForm(forms.ModelForm):
     class Meta:
@@ -348,7 +710,7 @@ def add_family(request):
 
 @login_required
 def family_list(request):
-    families = Family.objects.all().order_by('name')
+    families = sorted(get_lookup('family').objects, key=lambda family: family.name)
     return render(request, 'payments/family_list.html', {
         'families': families
     })
@@ -371,7 +733,7 @@ def add_cohort(request):
 
 @login_required
 def cohort_list(request):
-    cohorts = Cohort.objects.all().order_by('-year', 'name')
+    cohorts = sorted(get_lookup('cohort').objects, key=lambda cohort: (-cohort.year, cohort.name))
     return render(request, 'payments/cohort_list.html', {
         'cohorts': cohorts
     }) 
\ No newline at end of file